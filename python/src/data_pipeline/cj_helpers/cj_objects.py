@@ -4,7 +4,6 @@ Classes to format and normalize CityJSON objects and files.
 
 from __future__ import annotations
 
-import json
 from abc import ABC, abstractmethod
 from collections.abc import Sequence
 from typing import Any
@@ -21,6 +20,7 @@ from data_pipeline.cj_helpers.cj_attributes import (
     BdgUnitAttr,
 )
 from data_pipeline.cj_helpers.cj_geometry import CityJSONGeometries, Geometry
+from data_pipeline.utils import json_io
 from data_pipeline.utils.icon_positions import IconPosition
 from numpy.typing import NDArray
 
@@ -200,7 +200,7 @@ class CityJSONFile:
 
         full_object["vertices"] = vertices
 
-        return json.dumps(full_object)
+        return json_io.dumps(full_object)
 
     def add_cityjson_objects(
         self, cj_objects: Sequence[CityJSONObjectSubclass]
@@ -0,0 +1,400 @@
+"""
+Flat representation of the boundaries of CityJSON geometries, to avoid deeply nested lists.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+SURFACE_TYPES = ("MultiSurface", "CompositeSurface")
+SOLID_TYPES = ("Solid",)
+MULTI_SOLID_TYPES = ("MultiSolid", "CompositeSolid")
+# Types of the geometries whose boundaries are flattened
+FLAT_TYPES = SURFACE_TYPES + SOLID_TYPES + MULTI_SOLID_TYPES
+INSTANCE_TYPE = "GeometryInstance"
+
+
+def _to_numpy(values: array) -> NDArray[np.int64]:
+    return np.frombuffer(values, dtype=np.int64)
+
+
+class FlatBoundaries:
+    """
+    Boundaries of the geometries of multiple CityJSON objects, stored in flat arrays of offsets.
+    The layout follows the nested lists of Arrow: every level stores the offsets of its elements in the next level, down to the vertex indices.
+
+    - `indices` contains the vertex indices of all the rings, one ring after the other,
+    - ring `r` is `indices[ring_offsets[r]:ring_offsets[r + 1]]`,
+    - surface `s` is made of the rings `surface_offsets[s]` to `surface_offsets[s + 1]` (exterior first, then holes),
+    - shell `h` is made of the surfaces `shell_offsets[h]` to `shell_offsets[h + 1]`,
+    - geometry `g` is made of the shells `geometry_offsets[g]` to `geometry_offsets[g + 1]`,
+    - object `o` is made of the geometries `object_offsets[o]` to `object_offsets[o + 1]`.
+
+    A MultiSurface or a CompositeSurface is stored as a single shell.
+    A MultiSolid or a CompositeSolid is stored as the shells of all its solids, one solid after the other, and the number of shells of each solid is stored in `solids`.
+    A GeometryInstance is stored without any shell, and its template, reference point and transformation matrix are stored in `instances`.
+    Geometries of other types are stored without any shell, only with their type and LoD.
+    """
+
+    def __init__(
+        self,
+        object_ids: list[str],
+        object_offsets: NDArray[np.int64],
+        geometry_types: list[str],
+        geometry_lods: list[str],
+        geometry_offsets: NDArray[np.int64],
+        shell_offsets: NDArray[np.int64],
+        surface_offsets: NDArray[np.int64],
+        ring_offsets: NDArray[np.int64],
+        indices: NDArray[np.int64],
+        instances: dict[int, tuple[int, int, list[float]]] | None = None,
+        solids: dict[int, list[int]] | None = None,
+    ) -> None:
+        """
+        Store the flat boundaries.
+
+        Parameters
+        ----------
+        object_ids : list[str]
+            The ids of the objects.
+        object_offsets : NDArray[np.int64]
+            The offsets (n_objects + 1,) of the objects in the geometries.
+        geometry_types : list[str]
+            The CityJSON type of every geometry.
+        geometry_lods : list[str]
+            The LoD of every geometry.
+        geometry_offsets : NDArray[np.int64]
+            The offsets (n_geometries + 1,) of the geometries in the shells.
+        shell_offsets : NDArray[np.int64]
+            The offsets (n_shells + 1,) of the shells in the surfaces.
+        surface_offsets : NDArray[np.int64]
+            The offsets (n_surfaces + 1,) of the surfaces in the rings.
+        ring_offsets : NDArray[np.int64]
+            The offsets (n_rings + 1,) of the rings in the indices.
+        indices : NDArray[np.int64]
+            The vertex indices of all the rings.
+        instances : dict[int, tuple[int, int, list[float]]] | None, optional
+            A dictionary mapping the index of every GeometryInstance to its template index, the vertex index of its reference point and its transformation matrix.
+            By default None, for no instance.
+        solids : dict[int, list[int]] | None, optional
+            A dictionary mapping the index of every MultiSolid and CompositeSolid to the number of shells of each of its solids.
+            By default None, for no MultiSolid or CompositeSolid.
+        """
+        self.object_ids = object_ids
+        self.object_index = {obj_id: i for i, obj_id in enumerate(object_ids)}
+        self.object_offsets = object_offsets
+        self.geometry_types = geometry_types
+        self.geometry_lods = geometry_lods
+        self.geometry_offsets = geometry_offsets
+        self.shell_offsets = shell_offsets
+        self.surface_offsets = surface_offsets
+        self.ring_offsets = ring_offsets
+        self.indices = indices
+        self.instances = {} if instances is None else instances
+        self.solids = {} if solids is None else solids
+
+    @classmethod
+    def from_cityobjects(
+        cls, objects: dict[str, dict[str, Any]], release: bool = False
+    ) -> FlatBoundaries:
+        """
+        Flatten the boundaries of all the given objects in a single pass.
+
+        Parameters
+        ----------
+        objects : dict[str, dict[str, Any]]
+            The CityJSON objects, with their geometry.
+        release : bool, optional
+            Whether to remove the nested "boundaries" from the geometries once they are flattened, to free their memory.
+            The other members of the geometries, and the boundaries of the other geometries, like GeometryInstances, are kept.
+            By default False.
+
+        Returns
+        -------
+        FlatBoundaries
+            The flat boundaries of all the objects, in the order of `objects`.
+        """
+        object_ids: list[str] = []
+        geometry_types: list[str] = []
+        geometry_lods: list[str] = []
+        object_offsets = array("q", [0])
+        geometry_offsets = array("q", [0])
+        shell_offsets = array("q", [0])
+        surface_offsets = array("q", [0])
+        ring_offsets = array("q", [0])
+        indices = array("q")
+        instances: dict[int, tuple[int, int, list[float]]] = {}
+        solids: dict[int, list[int]] = {}
+
+        def add_shell(shell: list[list[list[int]]]) -> None:
+            for surface in shell:
+                for ring in surface:
+                    indices.extend(ring)
+                    ring_offsets.append(len(indices))
+                surface_offsets.append(len(ring_offsets) - 1)
+            shell_offsets.append(len(surface_offsets) - 1)
+
+        for obj_id, obj in objects.items():
+            object_ids.append(obj_id)
+            for geom in obj.get("geometry", []):
+                geom_type = geom["type"]
+                geometry_types.append(geom_type)
+                geometry_lods.append(str(geom.get("lod", "")))
+                if geom_type in SURFACE_TYPES:
+                    add_shell(geom["boundaries"])
+                elif geom_type in SOLID_TYPES:
+                    for shell in geom["boundaries"]:
+                        add_shell(shell)
+                elif geom_type in MULTI_SOLID_TYPES:
+                    solids[len(geometry_types) - 1] = [
+                        len(solid) for solid in geom["boundaries"]
+                    ]
+                    for solid in geom["boundaries"]:
+                        for shell in solid:
+                            add_shell(shell)
+                elif geom_type == INSTANCE_TYPE:
+                    instances[len(geometry_types) - 1] = (
+                        geom["template"],
+                        geom["boundaries"][0],
+                        geom["transformationMatrix"],
+                    )
+                geometry_offsets.append(len(shell_offsets) - 1)
+                if release and geom_type in FLAT_TYPES:
+                    geom.pop("boundaries", None)
+            object_offsets.append(len(geometry_offsets) - 1)
+
+        return cls(
+            object_ids=object_ids,
+            object_offsets=_to_numpy(object_offsets),
+            geometry_types=geometry_types,
+            geometry_lods=geometry_lods,
+            geometry_offsets=_to_numpy(geometry_offsets),
+            shell_offsets=_to_numpy(shell_offsets),
+            surface_offsets=_to_numpy(surface_offsets),
+            ring_offsets=_to_numpy(ring_offsets),
+            indices=_to_numpy(indices),
+            instances=instances,
+            solids=solids,
+        )
+
+    def object_bounds(self, vertices: NDArray[np.float64]) -> NDArray[np.float64]:
+        """
+        Compute the 3D bounding boxes of all the objects at once, over all their geometries.
+
+        Parameters
+        ----------
+        vertices : NDArray[np.float64]
+            The array (N,3) of the vertices coordinates, that the boundaries refer to.
+
+        Returns
+        -------
+        NDArray[np.float64]
+            The bounding boxes (n_objects, 6) as `[min_x, min_y, min_z, max_x, max_y, max_z]`, filled with NaN for the objects without geometry.
+            The GeometryInstances are not included, since their geometry is stored in the templates.
+        """
+        # Offsets of the objects directly in the vertex indices
+        index_offsets = self.ring_offsets[
+            self.surface_offsets[
+                self.shell_offsets[self.geometry_offsets[self.object_offsets]]
+            ]
+        ]
+        bounds = np.full((len(self.object_ids), 6), np.nan, dtype=np.float64)
+        non_empty = np.diff(index_offsets) > 0
+        if not np.any(non_empty):
+            return bounds
+        points = vertices[self.indices]
+        starts = index_offsets[:-1][non_empty]
+        bounds[non_empty, :3] = np.minimum.reduceat(points, starts, axis=0)
+        bounds[non_empty, 3:] = np.maximum.reduceat(points, starts, axis=0)
+        return bounds
+
+    def object_geometries(self, obj_idx: int) -> range:
+        """
+        Indices of the geometries of an object.
+
+        Parameters
+        ----------
+        obj_idx : int
+            The index of the object.
+
+        Returns
+        -------
+        range
+            The indices of the geometries of the object.
+        """
+        return range(self.object_offsets[obj_idx], self.object_offsets[obj_idx + 1])
+
+    def geometry_shells(self, geom_idx: int) -> range:
+        """
+        Indices of the shells of a geometry.
+
+        Parameters
+        ----------
+        geom_idx : int
+            The index of the geometry.
+
+        Returns
+        -------
+        range
+            The indices of the shells of the geometry.
+        """
+        return range(
+            self.geometry_offsets[geom_idx], self.geometry_offsets[geom_idx + 1]
+        )
+
+    def shell_surfaces(self, shell_idx: int) -> range:
+        """
+        Indices of the surfaces of a shell.
+
+        Parameters
+        ----------
+        shell_idx : int
+            The index of the shell.
+
+        Returns
+        -------
+        range
+            The indices of the surfaces of the shell.
+        """
+        return range(self.shell_offsets[shell_idx], self.shell_offsets[shell_idx + 1])
+
+    def surface_rings(self, surface_idx: int) -> list[NDArray[np.int64]]:
+        """
+        Vertex indices of the rings of a surface, as views on `indices`.
+
+        Parameters
+        ----------
+        surface_idx : int
+            The index of the surface.
+
+        Returns
+        -------
+        list[NDArray[np.int64]]
+            The rings of the surface, the exterior ring first and then the holes.
+        """
+        ring_start = self.surface_offsets[surface_idx]
+        ring_end = self.surface_offsets[surface_idx + 1]
+        offsets = self.ring_offsets[ring_start : ring_end + 1]
+        return [
+            self.indices[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)
+        ]
+
+    def single_ring_surfaces(
+        self, surfaces: range
+    ) -> tuple[NDArray[np.bool_], NDArray[np.int64]]:
+        """
+        Find, in a vectorized way, the surfaces made of a single ring, without holes.
+
+        Parameters
+        ----------
+        surfaces : range
+            The indices of the surfaces to check, as returned by `shell_surfaces`.
+
+        Returns
+        -------
+        NDArray[np.bool_]
+            The mask (len(surfaces),) of the surfaces without holes.
+        NDArray[np.int64]
+            The indices of the rings of these surfaces, in the order of the surfaces.
+        """
+        first_rings = self.surface_offsets[surfaces.start : surfaces.stop]
+        n_rings = (
+            self.surface_offsets[surfaces.start + 1 : surfaces.stop + 1] - first_rings
+        )
+        is_single = n_rings == 1
+        return is_single, first_rings[is_single]
+
+    def gather_rings(
+        self, rings: NDArray[np.int64]
+    ) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+        """
+        Gather the vertex indices of the given rings into new flat arrays.
+
+        Parameters
+        ----------
+        rings : NDArray[np.int64]
+            The indices of the rings.
+
+        Returns
+        -------
+        NDArray[np.int64]
+            The vertex indices of all the given rings, one ring after the other.
+        NDArray[np.int64]
+            The offsets (len(rings) + 1,) of the rings in the vertex indices.
+        """
+        starts = self.ring_offsets[rings]
+        lengths = self.ring_offsets[rings + 1] - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return self.indices[positions], offsets
+
+    def geometry_indices(self, geom_idx: int) -> NDArray[np.int64]:
+        """
+        Vertex indices of all the rings of a geometry.
+
+        Parameters
+        ----------
+        geom_idx : int
+            The index of the geometry.
+
+        Returns
+        -------
+        NDArray[np.int64]
+            The vertex indices, one ring after the other.
+        """
+        first_shell, last_shell = self.geometry_offsets[geom_idx : geom_idx + 2]
+        first_surface, last_surface = self.shell_offsets[[first_shell, last_shell]]
+        first_ring, last_ring = self.surface_offsets[[first_surface, last_surface]]
+        start, end = self.ring_offsets[[first_ring, last_ring]]
+        return self.indices[start:end]
+
+    def nested(
+        self, geom_idx: int, mapping: NDArray[np.int64] | None = None
+    ) -> list[Any]:
+        """
+        Rebuild the nested CityJSON boundaries of a geometry.
+
+        Parameters
+        ----------
+        geom_idx : int
+            The index of the geometry.
+        mapping : NDArray[np.int64] | None, optional
+            A mapping applied to the vertex indices, for example to reindex the vertices.
+            By default None.
+
+        Returns
+        -------
+        list[Any]
+            The boundaries as nested lists, as they are stored in CityJSON.
+
+        Raises
+        ------
+        NotImplementedError
+            If the geometry type is not flattened, like GeometryInstances.
+        """
+        geom_type = self.geometry_types[geom_idx]
+        shells = [
+            [
+                [
+                    (ring if mapping is None else mapping[ring]).tolist()
+                    for ring in self.surface_rings(surface_idx)
+                ]
+                for surface_idx in self.shell_surfaces(shell_idx)
+            ]
+            for shell_idx in self.geometry_shells(geom_idx)
+        ]
+        if geom_type in SURFACE_TYPES:
+            return shells[0]
+        elif geom_type in SOLID_TYPES:
+            return shells
+        elif geom_type in MULTI_SOLID_TYPES:
+            shell_offsets = np.cumsum([0] + self.solids[geom_idx])
+            return [
+                shells[start:end]
+                for start, end in zip(shell_offsets[:-1], shell_offsets[1:])
+            ]
+        raise NotImplementedError(f"Unexpected geometry type: '{geom_type}'")
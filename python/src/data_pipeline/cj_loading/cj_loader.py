@@ -2,175 +2,539 @@
 Scripts to load CityJSON files.
 """
 
-import json
+import glob
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any
+from typing import Any, Collection, Iterator
 
 import numpy as np
+import shapely
 import trimesh
-from data_pipeline.utils.geometry_utils import merge_trimeshes, triangulate_surface_3d
+from data_pipeline.cj_loading.cj_boundaries import (
+    FLAT_TYPES,
+    INSTANCE_TYPE,
+    FlatBoundaries,
+)
+from data_pipeline.cj_loading.cj_spatial_index import SpatialIndex
+from data_pipeline.utils import json_io
+from data_pipeline.utils.geometry_utils import (
+    MeshAssembler,
+    classify_convex_planar_rings,
+    fan_triangulate_rings,
+    select_rings,
+    triangulate_surface_3d,
+)
+from data_pipeline.utils.memory_utils import log_peak_rss
 from numpy.typing import NDArray
 
+VERTEX_CACHE_SUFFIX = ".vertices.npy"
+SPATIAL_INDEX_SUFFIX = ".rtree.npz"
 
-def _cj_surface_to_mesh(
-    boundaries: list[list[int]],
+_VERTICES_ARRAY = re.compile(rb'"vertices"\s*:\s*(?=\[\s*\[)')
+_ARRAY_OF_ARRAYS_END = re.compile(rb"\]\s*\]")
+# Replaces the vertices cut out of a raw file, to check that they were the top-level ones
+_STRIPPED_VERTICES = "data-pipeline:stripped-vertices"
+# Number of bytes at the start and at the end of the input hashed in the key of the sidecar files
+_SIDECAR_SAMPLE_BYTES = 64 * 1024
+# The meshes are not cached by default
+DEFAULT_MESH_CACHE_BYTES = 0
+
+
+def _cj_add_shell(
+    assembler: MeshAssembler,
+    boundaries: FlatBoundaries,
+    shell_idx: int,
     vertices: NDArray[np.float64],
-) -> trimesh.Trimesh | None:
+) -> None:
     """
-    Build the Trimesh representation of a CityJSON Surface object.
+    Triangulate the surfaces of a CityJSON shell (a MultiSurface or a shell of a Solid), and add them to the assembler.
+    The surfaces that are triangles or convex planar polygons without holes are triangulated all at once, and only the others are triangulated one by one.
 
     Parameters
     ----------
-    boundaries : list[list[list[list[int]]]]
-        The boundaries of the Surface as represented in CityJSON.
+    assembler : MeshAssembler
+        The assembler accumulating the triangles of the geometry.
+    boundaries : FlatBoundaries
+        The flat boundaries containing the shell.
+    shell_idx : int
+        The index of the shell in `boundaries`.
     vertices : NDArray[np.float64]
         The array (N,3) of the vertices coordinates, that the geometry refers to.
-
-    Returns
-    -------
-    trimesh.Trimesh
-        The Trimesh representation of the Surface.
     """
-    if len(boundaries) == 1 and len(boundaries[0]) == 3:
-        tri_vertices = vertices[boundaries[0]]
-        tri_faces = np.array([0, 1, 2]).reshape(1, 3)
-        return trimesh.Trimesh(vertices=tri_vertices, faces=tri_faces)
+    surfaces = np.array(boundaries.shell_surfaces(shell_idx))
+    is_single, rings = boundaries.single_ring_surfaces(
+        boundaries.shell_surfaces(shell_idx)
+    )
+    ring_indices, ring_offsets = boundaries.gather_rings(rings)
 
-    outer_boundary = np.array(boundaries[0], dtype=np.int64)
-    holes = [np.array(boundary, dtype=np.int64) for boundary in boundaries[1:]]
-    tri_vertices, tri_faces, worked = triangulate_surface_3d(
-        outer_boundary=outer_boundary, holes=holes, vertices=vertices
+    # Triangles are kept as they are, other polygons are checked
+    is_fast = np.diff(ring_offsets) == 3
+    is_fast[~is_fast] = classify_convex_planar_rings(
+        *select_rings(ring_indices, ring_offsets, ~is_fast), vertices=vertices
     )
-    if not worked:
-        return None
-    else:
-        return trimesh.Trimesh(vertices=tri_vertices, faces=tri_faces)
 
+    # Fan-triangulate all the fast rings, only with the vertices they use
+    triangles = fan_triangulate_rings(
+        *select_rings(ring_indices, ring_offsets, is_fast)
+    )
+    if triangles.shape[0] > 0:
+        used_ids, local_triangles = np.unique(triangles, return_inverse=True)
+        assembler.add(vertices[used_ids], local_triangles.reshape(-1, 3))
 
-def _cj_multisurface_to_mesh(
-    boundaries: list[list[list[int]]],
+    # Triangulate the other surfaces
+    is_slow = np.ones(len(surfaces), dtype=np.bool_)
+    is_slow[np.flatnonzero(is_single)[is_fast]] = False
+    for surface_idx in surfaces[is_slow]:
+        rings = boundaries.surface_rings(surface_idx)
+        tri_vertices, tri_faces, worked = triangulate_surface_3d(
+            outer_boundary=rings[0], holes=rings[1:], vertices=vertices
+        )
+        if worked:
+            assembler.add(tri_vertices, tri_faces)
+
+
+def _cj_geometry_to_mesh(
+    boundaries: FlatBoundaries,
+    geom_idx: int,
     vertices: NDArray[np.float64],
 ) -> trimesh.Trimesh:
     """
-    Build the Trimesh representation of a CityJSON MultiSurface object.
+    Build the Trimesh representation of a CityJSON surface or solid geometry.
+    All the surfaces of all the shells are gathered into a single mesh, which is fixed once at the end.
 
     Parameters
     ----------
-    boundaries : list[list[list[list[int]]]]
-        The boundaries of the MultiSurface as represented in CityJSON.
+    boundaries : FlatBoundaries
+        The flat boundaries containing the geometry.
+    geom_idx : int
+        The index of the geometry in `boundaries`.
     vertices : NDArray[np.float64]
         The array (N,3) of the vertices coordinates, that the geometry refers to.
 
     Returns
     -------
     trimesh.Trimesh
-        The Trimesh representation of the MultiSurface.
+        The Trimesh representation of the geometry.
     """
-    surfaces_meshes: list[trimesh.Trimesh] = []
-    for surface in boundaries:
-        mesh = _cj_surface_to_mesh(
-            boundaries=surface,
+    assembler = MeshAssembler()
+    for shell_idx in boundaries.geometry_shells(geom_idx):
+        _cj_add_shell(
+            assembler=assembler,
+            boundaries=boundaries,
+            shell_idx=shell_idx,
             vertices=vertices,
         )
-        if mesh is not None:
-            surfaces_meshes.append(mesh)
-
-    # Merge all the meshes
-    return merge_trimeshes(surfaces_meshes, fix_geometry=True)
+    return assembler.to_trimesh(fix_geometry=True)
 
 
-def _cj_solid_to_mesh(
-    boundaries: list[list[list[list[int]]]],
+def flat_object_to_mesh(
+    boundaries: FlatBoundaries,
+    obj_idx: int,
     vertices: NDArray[np.float64],
-) -> trimesh.Trimesh:
+    lods: Collection[str] | None = None,
+) -> dict[str, trimesh.Trimesh] | None:
     """
-    Build the Trimesh representation of a CityJSON Solid object.
+    Build the Trimesh representation of the geometry of an object, based on its flat boundaries.
+    All the requested LoDs are created and returned, the other ones are not triangulated.
+    GeometryInstances are skipped, since they are kept as shared template meshes (see `CityjsonLoader.instances`).
 
     Parameters
     ----------
-    boundaries : list[list[list[list[int]]]]
-        The boundaries of the Solid as represented in CityJSON.
+    boundaries : FlatBoundaries
+        The flat boundaries containing the object.
+    obj_idx : int
+        The index of the object in `boundaries`.
     vertices : NDArray[np.float64]
         The array (N,3) of the vertices coordinates, that the geometry refers to.
+    lods : Collection[str] | None, optional
+        The LoDs to create, as written in CityJSON (for example "0", "1.3" or "2.2").
+        By default None, to create all of them.
 
     Returns
     -------
-    trimesh.Trimesh
-        The Trimesh representation of the Solid.
+    dict[str, trimesh.Trimesh] | None
+        A dictionary mapping the LoD to its Trimesh representation, or None if the object has no geometry.
+
+    Raises
+    ------
+    NotImplementedError
+        If the geometry is not one of the supported geometry types.
     """
-    solids_meshes: list[trimesh.Trimesh] = []
-    for solid in boundaries:
-        mesh = _cj_multisurface_to_mesh(boundaries=solid, vertices=vertices)
-        if mesh is not None:
-            solids_meshes.append(mesh)
+    geoms_indices = boundaries.object_geometries(obj_idx)
+
+    # Return None if there is no geometry
+    if len(geoms_indices) == 0:
+        return None
+
+    # CityObjects may contain several geometry entries (different LoDs)
+    meshes_lods = {}
+    for geom_idx in geoms_indices:
+        lod = boundaries.geometry_lods[geom_idx]
+        if lods is not None and lod not in lods:
+            continue
+        geom_type = boundaries.geometry_types[geom_idx]
+        if geom_type == INSTANCE_TYPE:
+            continue
+        if geom_type not in FLAT_TYPES:
+            raise NotImplementedError(f"Unexpected geometry type: '{geom_type}'")
+        meshes_lods[lod] = _cj_geometry_to_mesh(
+            boundaries=boundaries,
+            geom_idx=geom_idx,
+            vertices=vertices,
+        )
 
-    # Merge all the meshes
-    return merge_trimeshes(solids_meshes, fix_geometry=True)
+    return meshes_lods
 
 
-def cj_object_to_mesh(
-    obj_dict: dict[str, Any], vertices: NDArray[np.float64]
-) -> dict[str, trimesh.Trimesh] | None:
+def _cj_transform_vertices(
+    normalised_vertices: list[list[int]], transform: dict[str, Any]
+) -> NDArray[np.float64]:
     """
-    Build the Trimesh representation of the geometry, based on a full CityJSON object.
-    All the LoDs are created and returned.
+    Transform integer CityJSON vertices to their real coordinates.
 
     Parameters
     ----------
-    obj_dict : dict[str, Any]
-        The full CityJSON object as stored in the file.
-        In particular, the geometry with potentally multiple LoDs is expected to be stored in "geometry".
-    vertices : NDArray[np.float64]
-        The array (N,3) of the vertices coordinates, that the geometry refers to.
+    normalised_vertices : list[list[int]]
+        The vertices as stored in CityJSON.
+    transform : dict[str, Any]
+        The CityJSON "transform" member, with "scale" and "translate".
 
     Returns
     -------
-    dict[str, trimesh.Trimesh] | None
-        A dictionary mapping the LoD to its Trimesh representation.
+    NDArray[np.float64]
+        The array (N, 3) of vertices coordinates.
+    """
+    normalised = np.array(normalised_vertices, dtype=np.float64).reshape(-1, 3)
+    translate = np.array(transform["translate"], dtype=np.float64)
+    scale = np.array(transform["scale"], dtype=np.float64)
+    return scale * normalised + translate
 
-    Raises
-    ------
-    NotImplementedError
-        If the geometry is not one of the supported geometry types.
+
+def _cj_parent_map(objects: dict[str, dict[str, Any]]) -> dict[str, str]:
     """
+    Compute the parent of every object that has one, based on both "parents" and "children".
 
-    # Return None if there is no geometry
-    if "geometry" not in obj_dict or len(obj_dict["geometry"]) == 0:
-        return None
+    Parameters
+    ----------
+    objects : dict[str, dict[str, Any]]
+        The CityJSON objects.
 
-    # CityObjects may contain several geometry entries (different LoDs)
-    meshes_lods = {}
-    for geom in obj_dict["geometry"]:
-        lod = geom["lod"]
-        geom_type = geom["type"]
-        boundaries = geom["boundaries"]
-        if geom_type == "MultiSurface":
-            mesh = _cj_multisurface_to_mesh(
-                boundaries=boundaries,
-                vertices=vertices,
+    Returns
+    -------
+    dict[str, str]
+        A dictionary mapping the id of an object to the id of its parent.
+    """
+    parent_of: dict[str, str] = {}
+    for obj_key, obj in objects.items():
+        for child_id in obj.get("children", []):
+            if child_id in objects:
+                parent_of.setdefault(child_id, obj_key)
+    for obj_key, obj in objects.items():
+        parents = obj.get("parents", [])
+        if len(parents) > 0 and parents[0] in objects:
+            parent_of[obj_key] = parents[0]
+    return parent_of
+
+
+def _cj_split_vertices(raw_data: bytes) -> tuple[bytes, bytes] | None:
+    """
+    Cut the top-level array of vertices out of a raw CityJSON file, without parsing the file.
+    The array is found with a fast scan of the raw bytes, as the last "vertices" member followed by an array of arrays.
+    It is replaced by the string `_STRIPPED_VERTICES`, so that the caller can check after parsing that the top-level vertices were cut, and not a "vertices" member at a lower level.
+
+    Parameters
+    ----------
+    raw_data : bytes
+        The raw content of the CityJSON file.
+
+    Returns
+    -------
+    tuple[bytes, bytes] | None
+        The raw content with `_STRIPPED_VERTICES` instead of the vertices, and the raw array of vertices, or None if no such array was found.
+    """
+    start = raw_data.rfind(b'"vertices"')
+    while start != -1:
+        member = _VERTICES_ARRAY.match(raw_data, start)
+        if member is not None:
+            # Vertices are arrays of numbers, so the array ends at the first "]]"
+            array_end = _ARRAY_OF_ARRAYS_END.search(raw_data, member.end())
+            if array_end is None:
+                return None
+            stripped = b"".join(
+                (
+                    raw_data[: member.end()],
+                    json_io.dumps_bytes(_STRIPPED_VERTICES),
+                    raw_data[array_end.end() :],
+                )
             )
-        elif geom_type == "Solid":
-            mesh = _cj_solid_to_mesh(
-                boundaries=boundaries,
-                vertices=vertices,
+            return stripped, raw_data[member.end() : array_end.end()]
+        start = raw_data.rfind(b'"vertices"', 0, start)
+    return None
+
+
+class CityjsonFeature:
+    """
+    Group of CityJSON objects formed by a root object and all its descendants, along with the vertices they refer to.
+    This is the equivalent of a CityJSONFeature in a CityJSONSeq file.
+    """
+
+    def __init__(
+        self,
+        feature_id: str,
+        objects: dict[str, dict[str, Any]],
+        vertices: NDArray[np.float64],
+        boundaries: FlatBoundaries,
+    ) -> None:
+        """
+        Group of CityJSON objects sharing the same vertices.
+
+        Parameters
+        ----------
+        feature_id : str
+            The id of the root object of the feature.
+        objects : dict[str, dict[str, Any]]
+            The CityJSON objects of the feature, with their geometry.
+        vertices : NDArray[np.float64]
+            The array (N,3) of the real vertices coordinates, that the geometries refer to.
+        boundaries : FlatBoundaries
+            The flat boundaries of the geometries of the objects, which may also contain other objects.
+        """
+        self.id = feature_id
+        self.objects = objects
+        self.vertices = vertices
+        self.boundaries = boundaries
+
+
+class TemplateInstance:
+    """
+    Placement of a geometry template, stored in CityJSON as a GeometryInstance.
+    The mesh of the template is shared by all its instances, and only the transformation differs.
+    """
+
+    def __init__(self, template: int, lod: str, matrix: NDArray[np.float64]) -> None:
+        """
+        Placement of a geometry template.
+
+        Parameters
+        ----------
+        template : int
+            The index of the template in the "geometry-templates" of the file.
+        lod : str
+            The LoD of the template.
+        matrix : NDArray[np.float64]
+            The 4x4 matrix transforming the vertices of the template to their real coordinates.
+            It combines the "transformationMatrix" of the instance with the translation to its reference point.
+        """
+        self.template = template
+        self.lod = lod
+        self.matrix = matrix
+
+
+class MeshCache:
+    """
+    Least-recently-used cache storing the meshes of CityJSON objects, bounded by the memory used by the meshes.
+    Hits and misses are counted to help choosing the size of the cache.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        Create an empty cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum number of bytes used by the vertices and faces of all the cached meshes.
+            If 0, nothing is cached, but the misses are still counted.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[
+            str, tuple[dict[str, trimesh.Trimesh] | None, int]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __repr__(self) -> str:
+        return f"MeshCache(entries={len(self)}, bytes={self.current_bytes}/{self.max_bytes}, hits={self.hits}, misses={self.misses})"
+
+    def get(self, key: str) -> dict[str, trimesh.Trimesh] | None:
+        """
+        Get the meshes of an object and mark them as recently used.
+        Counts a hit, the presence of the key must be checked before with `in`.
+
+        Parameters
+        ----------
+        key : str
+            The id of the object.
+
+        Returns
+        -------
+        dict[str, trimesh.Trimesh] | None
+            The cached meshes of the object for each LoD, or None if it has no geometry.
+        """
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key][0]
+
+    def put(self, key: str, meshes_lods: dict[str, trimesh.Trimesh] | None) -> None:
+        """
+        Store the meshes of an object and evict the least recently used entries if the cache is full.
+        Counts a miss, as this is expected to be called after failing to find the key.
+
+        Parameters
+        ----------
+        key : str
+            The id of the object.
+        meshes_lods : dict[str, trimesh.Trimesh] | None
+            The meshes of the object for each LoD, or None if it has no geometry.
+        """
+        self.misses += 1
+        if self.max_bytes <= 0:
+            return
+        n_bytes = 0
+        if meshes_lods is not None:
+            n_bytes = sum(
+                mesh.vertices.nbytes + mesh.faces.nbytes
+                for mesh in meshes_lods.values()
             )
-        else:
-            raise NotImplementedError(f"Unexpected geometry type: '{geom_type}'")
-        meshes_lods[lod] = mesh
+        if n_bytes > self.max_bytes:
+            return
 
-    return meshes_lods
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (meshes_lods, n_bytes)
+        self.current_bytes += n_bytes
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+
+    def clear(self) -> None:
+        """
+        Remove all the cached meshes, for example when they are replaced by other meshes.
+        The hits and misses are kept.
+        """
+        self._entries.clear()
+        self.current_bytes = 0
 
 
 class CityjsonLoader:
     """
     Utility CityJSON loader that extracts all data from a CityJSON file and transforms the integer coordinates to their real coordinates.
+
+    Two input formats are supported:
+
+    - CityJSON (`.city.json`), which is fully loaded in memory, with the boundaries of all objects flattened into `boundaries`,
+    - CityJSONSeq (`.city.jsonl`), which is only indexed when loading.
+    The attributes and the hierarchy of all objects are kept in `data` but the geometry is left in the file and read one feature at a time with `iter_features` or `get_feature`, so that the memory is bounded by the largest feature.
     """
 
-    def __init__(self, cj_path: Path) -> None:
+    def __init__(
+        self,
+        cj_path: Path,
+        vertex_cache: bool = False,
+        mesh_cache_bytes: int = DEFAULT_MESH_CACHE_BYTES,
+        spatial_index_cache: bool = False,
+        geometry: bool = True,
+        lods: Collection[str] | None = None,
+        low_memory: bool = False,
+    ) -> None:
+        """
+        Load the given CityJSON or CityJSONSeq file.
+
+        Parameters
+        ----------
+        cj_path : Path
+            Path to the CityJSON (`.city.json`) or CityJSONSeq (`.city.jsonl`) file.
+        vertex_cache : bool, optional
+            Whether to store the transformed vertices in a sidecar `.npy` file next to the input, and to memory-map it instead of transforming the vertices again on the next runs.
+            The sidecar file is keyed on the size and modification time of the input and on a hash of its raw vertices and transform, so it is recomputed whenever they change.
+            The vertices are cut out of the input before parsing it, as with `geometry=False`, and only parsed if the sidecar file does not exist.
+            Ignored for CityJSONSeq files, where vertices are local to every feature.
+            By default False.
+        mesh_cache_bytes : int, optional
+            The memory budget in bytes of the cache storing the meshes computed by `meshes` and `mesh`.
+            By default `DEFAULT_MESH_CACHE_BYTES`, for no cache.
+        spatial_index_cache : bool, optional
+            Whether to store the spatial index built by `spatial_index` in a sidecar `.npz` file next to the input, and to load it instead of building it again on the next runs.
+            The sidecar file is keyed on the size and modification time of the input and on a hash of its first and last bytes.
+            By default False.
+        geometry : bool, optional
+            Whether to load the geometry.
+            If False, the vertices are skipped before parsing the file and the geometry of the objects is dropped, so that only the attributes and the hierarchy are loaded, much faster and with much less memory.
+            All the methods using the geometry then raise a RuntimeError.
+            By default True.
+        lods : Collection[str] | None, optional
+            The LoDs of the meshes created by `meshes` and `mesh`, as written in CityJSON (for example "0", "1.3" or "2.2").
+            The other LoDs are never triangulated.
+            By default None, to create all of them.
+        low_memory : bool, optional
+            Whether to free the input data as soon as it is not needed anymore.
+            The vertices are removed from `data` once they are decoded, the nested boundaries once they are flattened, and the geometry of each object once its meshes are created.
+            Otherwise, `data` keeps the complete geometry of the objects.
+            By default False.
+        """
         self.path = cj_path
+        self.is_sequence = cj_path.suffix == ".jsonl"
+        self.vertex_cache = vertex_cache
+        self.geometry = geometry
+        self.lods = None if lods is None else frozenset(lods)
+        self.low_memory = low_memory
+        self.spatial_index_cache = spatial_index_cache
+        self._spatial_index: SpatialIndex | None = None
+
+        # Map each object to the feature containing it
+        self._object_to_feature: dict[str, str] | None = None
+        # Offsets of the features in the CityJSONSeq file
+        self._feature_offsets: dict[str, int] = {}
+        # Objects grouped by features for a standard CityJSON file
+        self._feature_groups: dict[str, dict[str, dict[str, Any]]] | None = None
+        # Last feature read from the CityJSONSeq file
+        self._last_feature: CityjsonFeature | None = None
 
-        self.data = self._cj_load()
-        self.vertices = self._cj_extract_vertices()
+        self.mesh_cache = MeshCache(max_bytes=mesh_cache_bytes)
+
+        if self.is_sequence:
+            self.data = self._cj_seq_load()
+            self.vertices = np.empty((0, 3), dtype=np.float64)
+            self.boundaries = FlatBoundaries.from_cityobjects({})
+        elif not geometry:
+            self.data = self._cj_load_without_geometry()
+            self.vertices = np.empty((0, 3), dtype=np.float64)
+            self.boundaries = FlatBoundaries.from_cityobjects({})
+        else:
+            if vertex_cache:
+                self.data, self.vertices = self._cj_load_with_vertex_cache()
+            else:
+                self.data = self._cj_load()
+                self.vertices = _cj_transform_vertices(
+                    self.data["vertices"], self.data["transform"]
+                )
+            if low_memory:
+                # The decoded vertices are the only ones used from now on
+                self.data["vertices"] = []
+            # Flatten the boundaries once, and free the nested lists in low-memory mode
+            self.boundaries = FlatBoundaries.from_cityobjects(
+                self.data["CityObjects"], release=low_memory
+            )
+
+        # Geometry templates, whose meshes are shared by all their instances
+        self.templates: FlatBoundaries | None = None
+        self.template_vertices = np.empty((0, 3), dtype=np.float64)
+        self._template_meshes: dict[int, trimesh.Trimesh | None] = {}
+        if geometry and "geometry-templates" in self.data:
+            self._cj_load_templates()
+
+        log_peak_rss(f"loading {self.path.name}")
 
     def _cj_load(self) -> dict[str, Any]:
         """
@@ -181,22 +545,676 @@ class CityjsonLoader:
         dict[str, Any]
             The CityJSON file directly as a dictionary.
         """
-        with open(self.path) as cj_file:
-            cj_data = json.load(cj_file)
+        return json_io.load(self.path)
+
+    def _cj_load_without_vertices(self) -> tuple[dict[str, Any], bytes | None]:
+        """
+        Load the whole file without parsing its vertices.
+        The array of vertices is cut out of the raw file before parsing it, which avoids parsing most of the file (see `_cj_split_vertices`).
+        If it cannot be cut out, the whole file is parsed instead.
+
+        Returns
+        -------
+        dict[str, Any]
+            The CityJSON file directly as a dictionary, with an empty list of "vertices" if they were cut out.
+        bytes | None
+            The raw array of vertices that was cut out, or None if the whole file was parsed.
+        """
+        with open(self.path, "rb") as cj_file:
+            raw_data = cj_file.read()
+        split = _cj_split_vertices(raw_data)
+        if split is not None:
+            stripped, raw_vertices = split
+            try:
+                cj_data: dict[str, Any] | None = json_io.loads(stripped)
+            except ValueError:
+                # The array that was cut was at a lower level, and contained deeper arrays
+                cj_data = None
+            if cj_data is not None and cj_data.get("vertices") == _STRIPPED_VERTICES:
+                cj_data["vertices"] = []
+                return cj_data, raw_vertices
+        # The array found was not the top-level one, which is fine but slower
+        logging.debug(f"Could not cut the vertices out of {self.path} before parsing")
+        return json_io.loads(raw_data), None
+
+    def _cj_load_without_geometry(self) -> dict[str, Any]:
+        """
+        Load the whole file without its vertices and the geometry of its objects, see `_cj_load_without_vertices`.
+
+        Returns
+        -------
+        dict[str, Any]
+            The CityJSON file directly as a dictionary, with an empty list of "vertices" and objects without "geometry".
+        """
+        cj_data, _ = self._cj_load_without_vertices()
+        cj_data["vertices"] = []
+        for obj in cj_data["CityObjects"].values():
+            obj.pop("geometry", None)
+        return cj_data
+
+    def _check_geometry(self) -> None:
+        """
+        Check that the geometry was loaded.
+
+        Raises
+        ------
+        RuntimeError
+            If the file was loaded without its geometry.
+        """
+        if not self.geometry:
+            raise RuntimeError(
+                f"The geometry of {self.path} was not loaded, load it with `geometry=True`."
+            )
+
+    def _cj_seq_load(self) -> dict[str, Any]:
+        """
+        Index a CityJSONSeq file by reading it one feature at a time.
+        Only the attributes and hierarchy of the objects are kept, the geometry is dropped.
 
+        Returns
+        -------
+        dict[str, Any]
+            The header of the CityJSONSeq file as a dictionary, with all the objects of the file without their geometry in "CityObjects".
+
+        Raises
+        ------
+        RuntimeError
+            If the first line of the file is not a CityJSON object.
+        RuntimeError
+            If one of the other lines is not a CityJSONFeature.
+        """
+        object_to_feature: dict[str, str] = {}
+        with open(self.path, "rb") as cj_file:
+            cj_data: dict[str, Any] = json_io.loads(cj_file.readline())
+            if cj_data.get("type", "") != "CityJSON":
+                raise RuntimeError(
+                    f"The first line of a CityJSONSeq file should be a 'CityJSON' object, not '{cj_data.get('type', '')}'"
+                )
+            cj_data["CityObjects"] = {}
+            cj_data["vertices"] = []
+
+            offset = cj_file.tell()
+            for line in cj_file:
+                line_offset = offset
+                offset += len(line)
+                if len(line.strip()) == 0:
+                    continue
+                feature = json_io.loads(line)
+                if feature.get("type", "") != "CityJSONFeature":
+                    raise RuntimeError(
+                        f"Expected a 'CityJSONFeature', not '{feature.get('type', '')}'"
+                    )
+                self._feature_offsets[feature["id"]] = line_offset
+                for obj_key, obj in feature["CityObjects"].items():
+                    obj.pop("geometry", None)
+                    cj_data["CityObjects"][obj_key] = obj
+                    object_to_feature[obj_key] = feature["id"]
+
+        self._object_to_feature = object_to_feature
         return cj_data
 
-    def _cj_extract_vertices(self) -> NDArray[np.float64]:
+    def _cj_load_with_vertex_cache(
+        self,
+    ) -> tuple[dict[str, Any], NDArray[np.float64]]:
         """
-        Extract and transforms the vertices to their real coordinates.
+        Load the whole file, with the vertices transformed to their real coordinates and cached in a sidecar file.
+        The sidecar file is keyed on a hash of the raw array of vertices and of the transform, computed without parsing the vertices.
+        If it exists, it is memory-mapped and the vertices of the file are not parsed, otherwise it is written for the next runs.
 
         Returns
         -------
+        dict[str, Any]
+            The CityJSON file directly as a dictionary, with an empty list of "vertices" if they were read from the sidecar file.
         NDArray[np.float64]
-            The array (N, 3) of vertices coordinates.
+            The array (N, 3) of vertices coordinates, memory-mapped from the sidecar file.
+        """
+        cj_data, raw_vertices = self._cj_load_without_vertices()
+        if raw_vertices is None:
+            # The vertices were parsed with the rest of the file
+            raw_vertices = json_io.dumps_bytes(cj_data["vertices"])
+        cache_path = self._sidecar_path(
+            VERTEX_CACHE_SUFFIX,
+            raw_vertices,
+            json_io.dumps_bytes(cj_data["transform"]),
+        )
+
+        if cache_path.exists():
+            logging.info(f"Memory-map the cached vertices from {cache_path}")
+        else:
+            if len(cj_data["vertices"]) == 0:
+                cj_data["vertices"] = json_io.loads(raw_vertices)
+            self._remove_outdated_sidecars(VERTEX_CACHE_SUFFIX)
+            vertices = _cj_transform_vertices(cj_data["vertices"], cj_data["transform"])
+            # Write to a temporary file first so concurrent runs never read a partial file
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as cache_file:
+                np.save(cache_file, vertices)
+            os.replace(tmp_path, cache_path)
+            logging.info(f"Cached the vertices in {cache_path}")
+
+        return cj_data, np.load(cache_path, mmap_mode="r")
+
+    def _cj_load_templates(self) -> None:
+        """
+        Flatten the boundaries of the geometry templates, with one object per template.
+        The vertices of the templates are stored with their real coordinates, without "transform".
+        """
+        templates = self.data["geometry-templates"]
+        self.templates = FlatBoundaries.from_cityobjects(
+            {
+                str(i): {"geometry": [template]}
+                for i, template in enumerate(templates["templates"])
+            }
+        )
+        self.template_vertices = np.array(
+            templates["vertices-templates"], dtype=np.float64
+        ).reshape(-1, 3)
+
+    def _sidecar_path(self, suffix: str, *contents: bytes) -> Path:
+        """
+        Compute the path of a sidecar file caching data derived from the input.
+        It contains a key made of the size and the modification time of the input file, and of a hash of its first and last bytes and of the given contents.
+        The hash detects the files rewritten with the same size and modification time, for example by `cp -p`, `rsync` or `git checkout`.
+
+        Parameters
+        ----------
+        suffix : str
+            The suffix of the sidecar file, for example `VERTEX_CACHE_SUFFIX`.
+        *contents : bytes
+            The parts of the input that the cached data is derived from, which are hashed as well.
+
+        Returns
+        -------
+        Path
+            The path of the sidecar file.
+        """
+        stat = self.path.stat()
+        digest = hashlib.blake2b(digest_size=8)
+        with open(self.path, "rb") as cj_file:
+            digest.update(cj_file.read(_SIDECAR_SAMPLE_BYTES))
+            cj_file.seek(max(stat.st_size - _SIDECAR_SAMPLE_BYTES, 0))
+            digest.update(cj_file.read())
+        for content in contents:
+            digest.update(content)
+        cache_key = f"{stat.st_size}-{stat.st_mtime_ns}-{digest.hexdigest()}"
+        return self.path.with_name(f"{self.path.name}.{cache_key}{suffix}")
+
+    def _remove_outdated_sidecars(self, suffix: str) -> None:
+        """
+        Remove the sidecar files of the input with the given suffix, before writing a new one.
+
+        Parameters
+        ----------
+        suffix : str
+            The suffix of the sidecar files.
+        """
+        pattern = glob.escape(self.path.name) + ".*" + suffix
+        for old_cache_path in self.path.parent.glob(pattern):
+            old_cache_path.unlink(missing_ok=True)
+
+    def _cj_group_features(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """
+        Group the objects of a standard CityJSON file into features, formed by a root object and all its descendants.
+        The grouping is only computed once.
+
+        Returns
+        -------
+        dict[str, dict[str, dict[str, Any]]]
+            A dictionary mapping the id of every root object to the objects of its feature.
+        """
+        if self._feature_groups is not None:
+            return self._feature_groups
+
+        objects: dict[str, dict[str, Any]] = self.data["CityObjects"]
+        parent_of = _cj_parent_map(objects)
+
+        object_to_feature: dict[str, str] = {}
+        feature_groups: dict[str, dict[str, dict[str, Any]]] = {}
+        for obj_key, obj in objects.items():
+            # Walk up to the root, stopping in case of cycles
+            root_key = obj_key
+            visited = {root_key}
+            while root_key in parent_of and parent_of[root_key] not in visited:
+                root_key = parent_of[root_key]
+                visited.add(root_key)
+            object_to_feature[obj_key] = root_key
+            feature_groups.setdefault(root_key, {})[obj_key] = obj
+
+        self._object_to_feature = object_to_feature
+        self._feature_groups = feature_groups
+        return feature_groups
+
+    def _cj_read_feature(self, feature_id: str) -> CityjsonFeature:
+        """
+        Read a single feature from the CityJSONSeq file.
+
+        Parameters
+        ----------
+        feature_id : str
+            The id of the feature.
+
+        Returns
+        -------
+        CityjsonFeature
+            The feature with its own vertices.
+        """
+        with open(self.path, "rb") as cj_file:
+            cj_file.seek(self._feature_offsets[feature_id])
+            line = cj_file.readline()
+        return self._cj_parse_feature(line)
+
+    def _cj_parse_feature(self, line: bytes) -> CityjsonFeature:
+        """
+        Parse a line of a CityJSONSeq file into a feature.
+
+        Parameters
+        ----------
+        line : bytes
+            The line storing the CityJSONFeature.
+
+        Returns
+        -------
+        CityjsonFeature
+            The feature with its own vertices.
+        """
+        feature = json_io.loads(line)
+        vertices = _cj_transform_vertices(feature["vertices"], self.data["transform"])
+        boundaries = FlatBoundaries.from_cityobjects(
+            feature["CityObjects"], release=self.low_memory
+        )
+        return CityjsonFeature(
+            feature_id=feature["id"],
+            objects=feature["CityObjects"],
+            vertices=vertices,
+            boundaries=boundaries,
+        )
+
+    @property
+    def n_features(self) -> int:
+        """
+        The number of features in the file.
+        """
+        if self.is_sequence:
+            return len(self._feature_offsets)
+        return len(self._cj_group_features())
+
+    def iter_features(self) -> Iterator[CityjsonFeature]:
+        """
+        Iterate over all the features of the file, in the order of the file.
+        With a CityJSONSeq file, only one feature is loaded in memory at a time.
+
+        Yields
+        ------
+        CityjsonFeature
+            The features, with the geometry of their objects and their vertices.
+
+        Raises
+        ------
+        RuntimeError
+            If the file was loaded without its geometry.
+        """
+        self._check_geometry()
+        if self.is_sequence:
+            with open(self.path, "rb") as cj_file:
+                # Skip the header
+                cj_file.readline()
+                for line in cj_file:
+                    if len(line.strip()) == 0:
+                        continue
+                    # Keep it for `get_feature`, used for example by `instances`
+                    self._last_feature = self._cj_parse_feature(line)
+                    yield self._last_feature
+        else:
+            for feature_id, objects in self._cj_group_features().items():
+                yield CityjsonFeature(
+                    feature_id=feature_id,
+                    objects=objects,
+                    vertices=self.vertices,
+                    boundaries=self.boundaries,
+                )
+
+    def get_feature(self, obj_id: str) -> CityjsonFeature:
+        """
+        Get the feature containing the given object.
+
+        Parameters
+        ----------
+        obj_id : str
+            The id of the object.
+
+        Returns
+        -------
+        CityjsonFeature
+            The feature containing the object, with the geometry of its objects and their vertices.
+
+        Raises
+        ------
+        KeyError
+            If the object is not in the file.
+        RuntimeError
+            If the file was loaded without its geometry.
+        """
+        self._check_geometry()
+        if self.is_sequence:
+            assert self._object_to_feature is not None
+            feature_id = self._object_to_feature[obj_id]
+            # Objects of the same feature are often requested one after the other
+            if self._last_feature is None or self._last_feature.id != feature_id:
+                self._last_feature = self._cj_read_feature(feature_id)
+            return self._last_feature
+
+        feature_groups = self._cj_group_features()
+        assert self._object_to_feature is not None
+        feature_id = self._object_to_feature[obj_id]
+        return CityjsonFeature(
+            feature_id=feature_id,
+            objects=feature_groups[feature_id],
+            vertices=self.vertices,
+            boundaries=self.boundaries,
+        )
+
+    def meshes(
+        self, obj_id: str, feature: CityjsonFeature | None = None
+    ) -> dict[str, trimesh.Trimesh] | None:
+        """
+        Get the meshes of all the LoDs of an object, limited to `lods` if it was given.
+        They are computed the first time they are requested, and then stored in `mesh_cache`.
+
+        Warning
+        -------
+        The returned meshes are shared with the cache, and should be copied before being modified.
+
+        Parameters
+        ----------
+        obj_id : str
+            The id of the object.
+        feature : CityjsonFeature | None, optional
+            The feature containing the object, if it is already loaded.
+            If None, it is found with `get_feature`.
+            By default None.
+
+        Returns
+        -------
+        dict[str, trimesh.Trimesh] | None
+            A dictionary mapping the LoD to its Trimesh representation, or None if the object has no geometry.
+        """
+        if obj_id in self.mesh_cache:
+            return self.mesh_cache.get(obj_id)
+
+        if feature is None:
+            feature = self.get_feature(obj_id)
+        meshes_lods = flat_object_to_mesh(
+            boundaries=feature.boundaries,
+            obj_idx=feature.boundaries.object_index[obj_id],
+            vertices=feature.vertices,
+            lods=self.lods,
+        )
+        self.mesh_cache.put(obj_id, meshes_lods)
+        if self.low_memory:
+            # The meshes only depend on the flat boundaries
+            feature.objects[obj_id].pop("geometry", None)
+        return meshes_lods
+
+    def mesh(self, obj_id: str, lod: str) -> trimesh.Trimesh | None:
+        """
+        Get the mesh of an object at the given LoD.
+        It is computed the first time it is requested, and then stored in `mesh_cache`.
+
+        Warning
+        -------
+        The returned mesh is shared with the cache, and should be copied before being modified.
+
+        Parameters
+        ----------
+        obj_id : str
+            The id of the object.
+        lod : str
+            The LoD, as written in CityJSON (for example "0", "1.3" or "2.2").
+
+        Returns
+        -------
+        trimesh.Trimesh | None
+            The mesh of the object, or None if it has no geometry at this LoD.
+        """
+        meshes_lods = self.meshes(obj_id)
+        if meshes_lods is None:
+            return None
+        return meshes_lods.get(lod, None)
+
+    def template_mesh(self, template: int) -> trimesh.Trimesh | None:
+        """
+        Get the mesh of a geometry template, in the coordinates of the template.
+        It is computed the first time it is requested, and then shared by all the instances of the template.
+
+        Warning
+        -------
+        The returned mesh is shared by all the instances, and should be copied before being modified.
+
+        Parameters
+        ----------
+        template : int
+            The index of the template in the "geometry-templates" of the file.
+
+        Returns
+        -------
+        trimesh.Trimesh | None
+            The mesh of the template, or None if it is empty.
+
+        Raises
+        ------
+        RuntimeError
+            If the file has no geometry templates.
+        """
+        if self.templates is None:
+            raise RuntimeError(f"{self.path} has no geometry templates.")
+        if template not in self._template_meshes:
+            meshes_lods = flat_object_to_mesh(
+                boundaries=self.templates,
+                obj_idx=template,
+                vertices=self.template_vertices,
+            )
+            self._template_meshes[template] = (
+                None if not meshes_lods else next(iter(meshes_lods.values()))
+            )
+        return self._template_meshes[template]
+
+    def _instance(
+        self, boundaries: FlatBoundaries, geom_idx: int, vertices: NDArray[np.float64]
+    ) -> TemplateInstance:
+        """
+        Build the placement of a GeometryInstance.
+
+        Parameters
+        ----------
+        boundaries : FlatBoundaries
+            The flat boundaries containing the instance.
+        geom_idx : int
+            The index of the instance in `boundaries`.
+        vertices : NDArray[np.float64]
+            The array (N,3) of the vertices coordinates, that the reference point refers to.
+
+        Returns
+        -------
+        TemplateInstance
+            The placement of the template.
+        """
+        assert self.templates is not None
+        template, reference, transformation = boundaries.instances[geom_idx]
+        matrix = np.eye(4)
+        matrix[:3, 3] = vertices[reference]
+        matrix = matrix @ np.array(transformation, dtype=np.float64).reshape(4, 4)
+        return TemplateInstance(
+            template=template,
+            lod=self.templates.geometry_lods[template],
+            matrix=matrix,
+        )
+
+    def instances(
+        self, obj_id: str, feature: CityjsonFeature | None = None
+    ) -> dict[str, TemplateInstance]:
+        """
+        Get the GeometryInstances of an object, limited to `lods` if it was given.
+        Their meshes are not part of `meshes`, and are obtained from their template with `template_mesh`.
+
+        Parameters
+        ----------
+        obj_id : str
+            The id of the object.
+        feature : CityjsonFeature | None, optional
+            The feature containing the object, if it is already loaded.
+            If None, it is found with `get_feature`.
+            By default None.
+
+        Returns
+        -------
+        dict[str, TemplateInstance]
+            A dictionary mapping the LoD of the template to the placement of the instance.
+        """
+        if self.templates is None:
+            # Instances cannot exist without templates
+            return {}
+
+        if feature is None:
+            feature = self.get_feature(obj_id)
+        boundaries = feature.boundaries
+        instances_lods = {}
+        for geom_idx in boundaries.object_geometries(boundaries.object_index[obj_id]):
+            if geom_idx not in boundaries.instances:
+                continue
+            instance = self._instance(boundaries, geom_idx, feature.vertices)
+            if self.lods is None or instance.lod in self.lods:
+                instances_lods[instance.lod] = instance
+        return instances_lods
+
+    def _add_instance_bounds(
+        self,
+        boundaries: FlatBoundaries,
+        vertices: NDArray[np.float64],
+        bounds: NDArray[np.float64],
+    ) -> None:
+        """
+        Extend the bounding boxes of the objects with the transformed vertices of their GeometryInstances.
+
+        Parameters
+        ----------
+        boundaries : FlatBoundaries
+            The flat boundaries of the objects.
+        vertices : NDArray[np.float64]
+            The array (N,3) of the vertices coordinates, that the boundaries refer to.
+        bounds : NDArray[np.float64]
+            The bounding boxes (n_objects, 6) of the objects, modified in place.
+        """
+        if self.templates is None:
+            return
+        for geom_idx in boundaries.instances:
+            instance = self._instance(boundaries, geom_idx, vertices)
+            template_points = self.template_vertices[
+                self.templates.geometry_indices(instance.template)
+            ]
+            if len(template_points) == 0:
+                continue
+            points = (
+                template_points @ instance.matrix[:3, :3].T + instance.matrix[:3, 3]
+            )
+            obj_idx = (
+                np.searchsorted(boundaries.object_offsets, geom_idx, side="right") - 1
+            )
+            # NaN bounds of objects without other geometry are ignored
+            bounds[obj_idx, :3] = np.fmin(bounds[obj_idx, :3], points.min(axis=0))
+            bounds[obj_idx, 3:] = np.fmax(bounds[obj_idx, 3:], points.max(axis=0))
+
+    def object_bounds(self) -> tuple[list[str], NDArray[np.float64]]:
+        """
+        Compute the 3D bounding boxes of all the objects, feature by feature.
+
+        Returns
+        -------
+        list[str]
+            The ids of the objects, in the order of the file.
+        NDArray[np.float64]
+            The bounding boxes (n_objects, 6) as `[min_x, min_y, min_z, max_x, max_y, max_z]`, filled with NaN for the objects without geometry.
+            The GeometryInstances are included with the transformed vertices of their template.
+
+        Raises
+        ------
+        RuntimeError
+            If the file was loaded without its geometry.
+        """
+        self._check_geometry()
+        if not self.is_sequence:
+            bounds = self.boundaries.object_bounds(self.vertices)
+            self._add_instance_bounds(self.boundaries, self.vertices, bounds)
+            return self.boundaries.object_ids, bounds
+
+        object_ids: list[str] = []
+        features_bounds: list[NDArray[np.float64]] = [
+            np.zeros((0, 6), dtype=np.float64)
+        ]
+        for feature in self.iter_features():
+            object_ids.extend(feature.boundaries.object_ids)
+            bounds = feature.boundaries.object_bounds(feature.vertices)
+            self._add_instance_bounds(feature.boundaries, feature.vertices, bounds)
+            features_bounds.append(bounds)
+        return object_ids, np.concatenate(features_bounds)
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """
+        The spatial index of the bounding boxes of the objects.
+        It is built the first time it is used, or loaded from its sidecar file if `spatial_index_cache` is set.
+        """
+        if self._spatial_index is not None:
+            return self._spatial_index
+
+        index_path = (
+            self._sidecar_path(SPATIAL_INDEX_SUFFIX)
+            if self.spatial_index_cache
+            else None
+        )
+        if index_path is not None and index_path.exists():
+            logging.info(f"Load the spatial index from {index_path}")
+            self._spatial_index = SpatialIndex.load(index_path)
+        else:
+            object_ids, bounds = self.object_bounds()
+            self._spatial_index = SpatialIndex(object_ids=object_ids, bounds=bounds)
+            if index_path is not None:
+                self._remove_outdated_sidecars(SPATIAL_INDEX_SUFFIX)
+                tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+                self._spatial_index.save(tmp_path)
+                os.replace(tmp_path, index_path)
+                logging.info(f"Saved the spatial index in {index_path}")
+        return self._spatial_index
+
+    def query_bbox(self, bbox: tuple[float, ...]) -> list[str]:
+        """
+        Find the objects whose bounding box intersects the given bounding box, with the spatial index.
+
+        Parameters
+        ----------
+        bbox : tuple[float, ...]
+            The bounding box, either in 2D as `(min_x, min_y, max_x, max_y)` or in 3D as `(min_x, min_y, min_z, max_x, max_y, max_z)`.
+
+        Returns
+        -------
+        list[str]
+            The ids of the objects, in the order of the file.
+        """
+        return self.spatial_index.query_bbox(bbox)
+
+    def query_polygon(
+        self, polygon: shapely.Polygon | shapely.MultiPolygon
+    ) -> list[str]:
+        """
+        Find the objects whose 2D bounding box intersects the given polygon, with the spatial index.
+
+        Parameters
+        ----------
+        polygon : shapely.Polygon | shapely.MultiPolygon
+            The polygon, in the same coordinate system as the objects.
+
+        Returns
+        -------
+        list[str]
+            The ids of the objects, in the order of the file.
         """
-        normalised_vertices = np.array(self.data["vertices"], dtype=np.float64)
-        translate = np.array(self.data["transform"]["translate"], dtype=np.float64)
-        scale = np.array(self.data["transform"]["scale"], dtype=np.float64)
-        vertices = scale * normalised_vertices + translate
-        return vertices
+        return self.spatial_index.query_polygon(polygon)
@@ -0,0 +1,399 @@
+"""
+Conversion of the geometry of CityJSON objects to meshes in a pool of worker processes.
+
+The vertices and the flat boundaries are copied once into shared memory, and the workers only receive the indices of the objects to convert.
+The meshes are sent back as plain arrays, and yielded in the order of the requested objects, so that the result does not depend on the number of workers.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Collection, Iterator
+
+import numpy as np
+import trimesh
+from data_pipeline.cj_loading.cj_boundaries import FlatBoundaries
+from data_pipeline.cj_loading.cj_loader import (
+    _cj_transform_vertices,
+    flat_object_to_mesh,
+)
+from data_pipeline.utils import json_io, triangulation_cache
+from numpy.typing import NDArray
+
+DEFAULT_CHUNK_SIZE = 64
+
+_BOUNDARIES_ARRAYS = (
+    "object_offsets",
+    "geometry_offsets",
+    "shell_offsets",
+    "surface_offsets",
+    "ring_offsets",
+    "indices",
+)
+
+ArraySpec = tuple[str, tuple[int, ...], str]
+CacheSettings = tuple[Path, int] | None
+MeshArrays = (
+    dict[str, tuple[NDArray[np.float64], NDArray[np.int64], dict[str, Any]]] | None
+)
+
+# State of a worker process, set by the pool initializers
+_worker_state: dict[str, Any] = {}
+
+
+def _share_array(array: NDArray[Any]) -> tuple[SharedMemory, ArraySpec]:
+    """
+    Copy an array into a new block of shared memory.
+
+    Parameters
+    ----------
+    array : NDArray[Any]
+        The array to share.
+
+    Returns
+    -------
+    SharedMemory
+        The block of shared memory, which must be closed and unlinked by the caller.
+    ArraySpec
+        The name, shape and dtype of the shared array, to attach to it from other processes.
+    """
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach_array(spec: ArraySpec) -> NDArray[Any]:
+    """
+    Attach to an array shared by `_share_array`.
+    The block of shared memory is kept open until the end of the worker process.
+
+    Parameters
+    ----------
+    spec : ArraySpec
+        The name, shape and dtype of the shared array.
+
+    Returns
+    -------
+    NDArray[Any]
+        The read-only shared array.
+    """
+    name, shape, dtype = spec
+    shm = SharedMemory(name=name)
+    _worker_state.setdefault("shared_memory", []).append(shm)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _meshes_to_arrays(
+    meshes_lods: dict[str, trimesh.Trimesh] | None,
+) -> MeshArrays:
+    if meshes_lods is None:
+        return None
+    return {
+        lod: (np.asarray(mesh.vertices), np.asarray(mesh.faces), mesh.metadata)
+        for lod, mesh in meshes_lods.items()
+    }
+
+
+def _arrays_to_meshes(
+    meshes_arrays: MeshArrays,
+) -> dict[str, trimesh.Trimesh] | None:
+    if meshes_arrays is None:
+        return None
+    meshes_lods = {}
+    for lod, (vertices, faces, metadata) in meshes_arrays.items():
+        # The meshes were already processed by the workers, and their metadata is exported as glTF extras
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+        mesh.metadata.update(metadata)
+        meshes_lods[lod] = mesh
+    return meshes_lods
+
+
+def _cache_settings() -> CacheSettings:
+    cache = triangulation_cache.get_cache()
+    if cache is None:
+        return None
+    return cache.path, cache.max_bytes
+
+
+def _init_cache(cache_settings: CacheSettings) -> None:
+    """
+    Use the same triangulation cache as the main process in a worker.
+
+    Parameters
+    ----------
+    cache_settings : CacheSettings
+        The path and size budget of the cache of the main process, or None if it is disabled.
+    """
+    if cache_settings is None:
+        triangulation_cache.disable()
+    else:
+        triangulation_cache.enable(path=cache_settings[0], max_bytes=cache_settings[1])
+
+
+def _flush_cache() -> None:
+    # Workers exit without running the `atexit` handlers
+    cache = triangulation_cache.get_cache()
+    if cache is not None:
+        cache.flush()
+
+
+def _init_shared_worker(
+    vertices_spec: ArraySpec,
+    boundaries_specs: dict[str, ArraySpec],
+    geometry_types: list[str],
+    geometry_lods: list[str],
+    lods: Collection[str] | None,
+    cache_settings: CacheSettings,
+) -> None:
+    """
+    Initialize a worker converting objects of a standard CityJSON file.
+
+    Parameters
+    ----------
+    vertices_spec : ArraySpec
+        The shared array of vertices.
+    boundaries_specs : dict[str, ArraySpec]
+        The shared arrays of the flat boundaries.
+    geometry_types : list[str]
+        The type of every geometry of the flat boundaries.
+    geometry_lods : list[str]
+        The LoD of every geometry of the flat boundaries.
+    lods : Collection[str] | None
+        The LoDs to convert, or None to convert all of them.
+    cache_settings : CacheSettings
+        The path and size budget of the triangulation cache, or None if it is disabled.
+    """
+    _init_cache(cache_settings)
+    _worker_state["lods"] = lods
+    _worker_state["vertices"] = _attach_array(vertices_spec)
+    _worker_state["boundaries"] = FlatBoundaries(
+        object_ids=[],
+        geometry_types=geometry_types,
+        geometry_lods=geometry_lods,
+        **{key: _attach_array(spec) for key, spec in boundaries_specs.items()},
+    )
+
+
+def _convert_objects(obj_indices: list[int]) -> list[MeshArrays]:
+    """
+    Convert a chunk of objects of the shared flat boundaries, in a worker.
+
+    Parameters
+    ----------
+    obj_indices : list[int]
+        The indices of the objects in the shared flat boundaries.
+
+    Returns
+    -------
+    list[MeshArrays]
+        The meshes of every object, as arrays.
+    """
+    results = [
+        _meshes_to_arrays(
+            flat_object_to_mesh(
+                boundaries=_worker_state["boundaries"],
+                obj_idx=obj_idx,
+                vertices=_worker_state["vertices"],
+                lods=_worker_state["lods"],
+            )
+        )
+        for obj_idx in obj_indices
+    ]
+    _flush_cache()
+    return results
+
+
+def _init_sequence_worker(
+    cj_path: Path,
+    transform: dict[str, Any],
+    lods: Collection[str] | None,
+    cache_settings: CacheSettings,
+) -> None:
+    """
+    Initialize a worker converting features of a CityJSONSeq file.
+
+    Parameters
+    ----------
+    cj_path : Path
+        The path of the CityJSONSeq file.
+    transform : dict[str, Any]
+        The transform of the vertices, from the header of the file.
+    lods : Collection[str] | None
+        The LoDs to convert, or None to convert all of them.
+    cache_settings : CacheSettings
+        The path and size budget of the triangulation cache, or None if it is disabled.
+    """
+    _init_cache(cache_settings)
+    _worker_state["lods"] = lods
+    _worker_state["path"] = cj_path
+    _worker_state["transform"] = transform
+
+
+def _convert_features(
+    offsets: list[int],
+) -> list[list[tuple[str, MeshArrays]]]:
+    """
+    Read and convert a chunk of features of a CityJSONSeq file, in a worker.
+
+    Parameters
+    ----------
+    offsets : list[int]
+        The offsets of the features in the file.
+
+    Returns
+    -------
+    list[list[tuple[str, MeshArrays]]]
+        For every feature, the id and the meshes as arrays of all its objects, in the order of the file.
+    """
+    results = []
+    with open(_worker_state["path"], "rb") as cj_file:
+        for offset in offsets:
+            cj_file.seek(offset)
+            feature = json_io.loads(cj_file.readline())
+            vertices = _cj_transform_vertices(
+                feature["vertices"], _worker_state["transform"]
+            )
+            boundaries = FlatBoundaries.from_cityobjects(feature["CityObjects"])
+            results.append(
+                [
+                    (
+                        obj_id,
+                        _meshes_to_arrays(
+                            flat_object_to_mesh(
+                                boundaries=boundaries,
+                                obj_idx=obj_idx,
+                                vertices=vertices,
+                                lods=_worker_state["lods"],
+                            )
+                        ),
+                    )
+                    for obj_idx, obj_id in enumerate(boundaries.object_ids)
+                ]
+            )
+    _flush_cache()
+    return results
+
+
+def _chunks(values: list[Any], chunk_size: int) -> list[list[Any]]:
+    return [values[i : i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+
+def parallel_object_meshes(
+    boundaries: FlatBoundaries,
+    vertices: NDArray[np.float64],
+    obj_ids: list[str],
+    workers: int,
+    lods: Collection[str] | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple[str, dict[str, trimesh.Trimesh] | None]]:
+    """
+    Convert the geometry of objects to meshes in a pool of worker processes.
+    The vertices and flat boundaries are shared with the workers through shared memory.
+
+    Parameters
+    ----------
+    boundaries : FlatBoundaries
+        The flat boundaries of the objects.
+    vertices : NDArray[np.float64]
+        The array (N,3) of the vertices coordinates, that the geometry refers to.
+    obj_ids : list[str]
+        The ids of the objects to convert.
+    workers : int
+        The number of worker processes.
+    lods : Collection[str] | None, optional
+        The LoDs to convert, as written in CityJSON.
+        By default None, to convert all of them.
+    chunk_size : int, optional
+        The number of objects sent to a worker at once.
+        By default `DEFAULT_CHUNK_SIZE`.
+
+    Yields
+    ------
+    tuple[str, dict[str, trimesh.Trimesh] | None]
+        The id of every object with the dictionary mapping its LoDs to their meshes, in the order of `obj_ids`.
+    """
+    shared_blocks: list[SharedMemory] = []
+    try:
+        shm, vertices_spec = _share_array(np.asarray(vertices, dtype=np.float64))
+        shared_blocks.append(shm)
+        boundaries_specs = {}
+        for key in _BOUNDARIES_ARRAYS:
+            shm, boundaries_specs[key] = _share_array(getattr(boundaries, key))
+            shared_blocks.append(shm)
+
+        obj_indices = [boundaries.object_index[obj_id] for obj_id in obj_ids]
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_shared_worker,
+            initargs=(
+                vertices_spec,
+                boundaries_specs,
+                boundaries.geometry_types,
+                boundaries.geometry_lods,
+                lods,
+                _cache_settings(),
+            ),
+        ) as executor:
+            chunks_ids = _chunks(obj_ids, chunk_size)
+            # `map` returns the results in the order of the chunks
+            results = executor.map(_convert_objects, _chunks(obj_indices, chunk_size))
+            for chunk_ids, chunk_results in zip(chunks_ids, results):
+                for obj_id, meshes_arrays in zip(chunk_ids, chunk_results):
+                    yield obj_id, _arrays_to_meshes(meshes_arrays)
+    finally:
+        for shm in shared_blocks:
+            shm.close()
+            shm.unlink()
+
+
+def parallel_sequence_meshes(
+    cj_path: Path,
+    transform: dict[str, Any],
+    feature_offsets: list[int],
+    workers: int,
+    lods: Collection[str] | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple[str, dict[str, trimesh.Trimesh] | None]]:
+    """
+    Read and convert the features of a CityJSONSeq file to meshes in a pool of worker processes.
+    Every worker reads its own features from the file, so only the offsets of the features are sent to it.
+
+    Parameters
+    ----------
+    cj_path : Path
+        The path of the CityJSONSeq file.
+    transform : dict[str, Any]
+        The transform of the vertices, from the header of the file.
+    feature_offsets : list[int]
+        The offsets of the features to convert in the file.
+    workers : int
+        The number of worker processes.
+    lods : Collection[str] | None, optional
+        The LoDs to convert, as written in CityJSON.
+        By default None, to convert all of them.
+    chunk_size : int, optional
+        The number of features sent to a worker at once.
+        By default `DEFAULT_CHUNK_SIZE`.
+
+    Yields
+    ------
+    tuple[str, dict[str, trimesh.Trimesh] | None]
+        The id of every object with the dictionary mapping its LoDs to their meshes, feature by feature in the order of `feature_offsets`.
+    """
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_sequence_worker,
+        initargs=(cj_path, transform, lods, _cache_settings()),
+    ) as executor:
+        # `map` returns the results in the order of the chunks
+        for chunk_results in executor.map(
+            _convert_features, _chunks(feature_offsets, chunk_size)
+        ):
+            for feature_results in chunk_results:
+                for obj_id, meshes_arrays in feature_results:
+                    yield obj_id, _arrays_to_meshes(meshes_arrays)
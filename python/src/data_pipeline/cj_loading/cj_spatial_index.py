@@ -0,0 +1,152 @@
+"""
+Spatial index over the bounding boxes of CityJSON objects, to find objects in an area without scanning all of them.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import shapely
+from numpy.typing import NDArray
+from rtree import index
+
+
+class SpatialIndex:
+    """
+    R-tree of the 3D bounding boxes of objects, packed with the Sort-Tile-Recursive algorithm of `rtree` bulk loading.
+    Objects without geometry are not indexed.
+    """
+
+    def __init__(self, object_ids: list[str], bounds: NDArray[np.float64]) -> None:
+        """
+        Build the index.
+
+        Parameters
+        ----------
+        object_ids : list[str]
+            The ids of the objects.
+        bounds : NDArray[np.float64]
+            The bounding boxes (n_objects, 6) of the objects as `[min_x, min_y, min_z, max_x, max_y, max_z]`, with NaN for the objects without geometry.
+        """
+        self.object_ids = object_ids
+        self.bounds = bounds
+
+        properties = index.Property()
+        properties.dimension = 3
+        indexed = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        # Range of altitudes used to query with 2D bounding boxes
+        self._z_range: tuple[float, float] | None = None
+        if len(indexed) == 0:
+            self._rtree = index.Index(properties=properties)
+        else:
+            # A stream of items triggers the bulk loading of `rtree`
+            self._rtree = index.Index(
+                ((int(i), tuple(bounds[i]), None) for i in indexed),
+                properties=properties,
+            )
+            self._z_range = (
+                float(np.min(bounds[indexed, 2])),
+                float(np.max(bounds[indexed, 5])),
+            )
+
+    def __len__(self) -> int:
+        return len(self.object_ids)
+
+    def _query(self, bbox: tuple[float, ...]) -> NDArray[np.int64]:
+        if len(bbox) == 4:
+            if self._z_range is None:
+                return np.zeros(0, dtype=np.int64)
+            min_z, max_z = self._z_range
+            bbox = (bbox[0], bbox[1], min_z, bbox[2], bbox[3], max_z)
+        elif len(bbox) != 6:
+            raise ValueError(
+                f"Expected a bounding box with 4 (2D) or 6 (3D) values, not {len(bbox)}."
+            )
+        return np.sort(np.fromiter(self._rtree.intersection(bbox), dtype=np.int64))
+
+    def query_bbox(self, bbox: tuple[float, ...]) -> list[str]:
+        """
+        Find the objects whose bounding box intersects the given bounding box.
+
+        Parameters
+        ----------
+        bbox : tuple[float, ...]
+            The bounding box, either in 2D as `(min_x, min_y, max_x, max_y)` or in 3D as `(min_x, min_y, min_z, max_x, max_y, max_z)`.
+
+        Returns
+        -------
+        list[str]
+            The ids of the objects, in the order of the file.
+
+        Raises
+        ------
+        ValueError
+            If the bounding box does not have 4 or 6 values.
+        """
+        return [self.object_ids[i] for i in self._query(bbox)]
+
+    def query_polygon(
+        self, polygon: shapely.Polygon | shapely.MultiPolygon
+    ) -> list[str]:
+        """
+        Find the objects whose 2D bounding box intersects the given polygon.
+
+        Parameters
+        ----------
+        polygon : shapely.Polygon | shapely.MultiPolygon
+            The polygon, in the same coordinate system as the objects.
+
+        Returns
+        -------
+        list[str]
+            The ids of the objects, in the order of the file.
+        """
+        candidates = self._query(polygon.bounds)
+        boxes = shapely.box(
+            self.bounds[candidates, 0],
+            self.bounds[candidates, 1],
+            self.bounds[candidates, 3],
+            self.bounds[candidates, 4],
+        )
+        shapely.prepare(polygon)
+        is_inside = shapely.intersects(polygon, boxes)
+        return [self.object_ids[i] for i in candidates[is_inside]]
+
+    def save(self, path: Path) -> None:
+        """
+        Save the index to a `.npz` file.
+        Only the ids and bounding boxes are stored, the R-tree is packed again when loading.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the file.
+        """
+        with open(path, "wb") as index_file:
+            np.savez(
+                index_file,
+                object_ids=np.array(self.object_ids, dtype=np.str_),
+                bounds=self.bounds,
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> SpatialIndex:
+        """
+        Load an index saved with `save`.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the file.
+
+        Returns
+        -------
+        SpatialIndex
+            The index.
+        """
+        with np.load(path) as index_data:
+            return cls(
+                object_ids=index_data["object_ids"].tolist(),
+                bounds=index_data["bounds"],
+            )
@@ -0,0 +1,339 @@
+"""
+Scripts to extract a subset of the objects of a CityJSON file, with only the vertices they use.
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+import shapely
+from data_pipeline.cj_loading.cj_boundaries import FLAT_TYPES
+from data_pipeline.cj_loading.cj_loader import DEFAULT_MESH_CACHE_BYTES, CityjsonLoader
+from data_pipeline.utils import json_io
+from numpy.typing import NDArray
+from tqdm import tqdm
+
+# Number of vertices serialised at once when writing the output
+_VERTICES_CHUNK = 100_000
+
+
+def _nested_indices(boundaries: Any) -> list[int]:
+    if isinstance(boundaries, int):
+        return [boundaries]
+    return [index for child in boundaries for index in _nested_indices(child)]
+
+
+def _remap_nested(boundaries: Any, mapping: NDArray[np.int64]) -> Any:
+    if isinstance(boundaries, int):
+        return int(mapping[boundaries])
+    return [_remap_nested(child, mapping) for child in boundaries]
+
+
+def load_geojson_polygon(gj_path: Path) -> shapely.Polygon | shapely.MultiPolygon:
+    """
+    Load the union of all the polygons of a GeoJSON file.
+
+    Parameters
+    ----------
+    gj_path : Path
+        The path of the GeoJSON file, containing a geometry, a Feature or a FeatureCollection.
+
+    Returns
+    -------
+    shapely.Polygon | shapely.MultiPolygon
+        The union of the polygons.
+
+    Raises
+    ------
+    ValueError
+        If the file does not contain any polygon.
+    """
+    gj_data = json_io.load(gj_path)
+    if gj_data.get("type", "") == "FeatureCollection":
+        geometries = [feature["geometry"] for feature in gj_data["features"]]
+    elif gj_data.get("type", "") == "Feature":
+        geometries = [gj_data["geometry"]]
+    else:
+        geometries = [gj_data]
+
+    polygons = [
+        shapely.geometry.shape(geometry)
+        for geometry in geometries
+        if geometry is not None
+        and geometry.get("type", "") in ("Polygon", "MultiPolygon")
+    ]
+    if len(polygons) == 0:
+        raise ValueError(f"The GeoJSON file {gj_path} does not contain any polygon.")
+    return shapely.union_all(polygons)
+
+
+class VertexCompactor:
+    """
+    Reindex the vertices used by a subset of geometries, in the order in which they are first used.
+    """
+
+    def __init__(self) -> None:
+        self.n_vertices = 0
+        self.chunks: list[NDArray[np.float64]] = []
+        self._vertices: NDArray[np.float64] | None = None
+        self._mapping = np.zeros(0, dtype=np.int64)
+
+    def reindex(
+        self, old_indices: NDArray[np.int64], vertices: NDArray[np.float64]
+    ) -> NDArray[np.int64]:
+        """
+        Give new indices to vertices, reusing the indices of the vertices that were already used.
+
+        Parameters
+        ----------
+        old_indices : NDArray[np.int64]
+            The indices of the vertices in `vertices`.
+        vertices : NDArray[np.float64]
+            The vertices the indices refer to.
+            They can change between calls, for example from one CityJSONSeq feature to the next one.
+
+        Returns
+        -------
+        NDArray[np.int64]
+            The mapping from the indices in `vertices` to the new indices, with -1 for the unused vertices.
+        """
+        if vertices is not self._vertices:
+            self._vertices = vertices
+            self._mapping = np.full(len(vertices), -1, dtype=np.int64)
+
+        unique_ids, first_positions = np.unique(old_indices, return_index=True)
+        is_new = self._mapping[unique_ids] == -1
+        # Keep the order of first use
+        new_ids = unique_ids[is_new][np.argsort(first_positions[is_new])]
+        if len(new_ids) > 0:
+            self._mapping[new_ids] = np.arange(
+                self.n_vertices, self.n_vertices + len(new_ids)
+            )
+            self.chunks.append(vertices[new_ids])
+            self.n_vertices += len(new_ids)
+        return self._mapping
+
+
+class CityjsonSubset(CityjsonLoader):
+    """
+    Load a CityJSON file to extract subsets of its objects.
+    The selected objects always come with their descendants and ancestors, and only the vertices they use are written, with new indices.
+    The input can also be a CityJSONSeq file, in which case the output gathers the vertices of all the selected features.
+    """
+
+    def __init__(
+        self,
+        cj_path: Path,
+        vertex_cache: bool = False,
+        mesh_cache_bytes: int = DEFAULT_MESH_CACHE_BYTES,
+        spatial_index_cache: bool = False,
+    ) -> None:
+        super().__init__(
+            cj_path,
+            vertex_cache=vertex_cache,
+            mesh_cache_bytes=mesh_cache_bytes,
+            spatial_index_cache=spatial_index_cache,
+        )
+
+    def select(
+        self,
+        obj_ids: Iterable[str] = (),
+        bbox: tuple[float, ...] | None = None,
+        polygon: shapely.Polygon | shapely.MultiPolygon | None = None,
+    ) -> list[str]:
+        """
+        Select objects by id and by location, with all their descendants and ancestors.
+
+        Parameters
+        ----------
+        obj_ids : Iterable[str], optional
+            The ids of the objects to select.
+            By default no object.
+        bbox : tuple[float, ...] | None, optional
+            Also select the objects whose bounding box intersects this bounding box, in 2D or 3D (see `query_bbox`).
+            By default None.
+        polygon : shapely.Polygon | shapely.MultiPolygon | None, optional
+            Also select the objects whose 2D bounding box intersects this polygon.
+            By default None.
+
+        Returns
+        -------
+        list[str]
+            The ids of all the selected objects, in the order of the file.
+        """
+        objects = self.data["CityObjects"]
+        selected: set[str] = set()
+        missing = 0
+        for obj_id in obj_ids:
+            if obj_id in objects:
+                selected.add(obj_id)
+            else:
+                missing += 1
+        if missing > 0:
+            logging.warning(f"{missing} of the requested objects are not in the file.")
+        if bbox is not None:
+            selected.update(self.query_bbox(bbox))
+        if polygon is not None:
+            selected.update(self.query_polygon(polygon))
+
+        # Add the descendants and the ancestors, without going back down from the ancestors
+        closure = self._reachable(selected, "children") | self._reachable(
+            selected, "parents"
+        )
+
+        return [obj_id for obj_id in objects if obj_id in closure]
+
+    def _reachable(self, obj_ids: set[str], relation: str) -> set[str]:
+        """
+        Find the objects reachable from the given objects by following one relation.
+        The ids of the related objects that are not in the file are skipped.
+
+        Parameters
+        ----------
+        obj_ids : set[str]
+            The ids of the starting objects.
+        relation : str
+            The relation to follow, "children" or "parents".
+
+        Returns
+        -------
+        set[str]
+            The ids of the starting objects and of all the objects reachable from them.
+        """
+        objects = self.data["CityObjects"]
+        reached: set[str] = set()
+        to_visit = list(obj_ids)
+        while len(to_visit) > 0:
+            obj_id = to_visit.pop()
+            if obj_id in reached or obj_id not in objects:
+                continue
+            reached.add(obj_id)
+            to_visit.extend(objects[obj_id].get(relation, []))
+        return reached
+
+    def export(self, output_cj_path: Path, obj_ids: list[str]) -> None:
+        """
+        Write the given objects to a new CityJSON file, streaming them one by one.
+        The vertices are compacted and reindexed to keep only the ones used by the objects.
+
+        Parameters
+        ----------
+        output_cj_path : Path
+            The path of the output CityJSON file.
+        obj_ids : list[str]
+            The ids of the objects to write, usually returned by `select`.
+        """
+        transform = self.data["transform"]
+        scale = np.array(transform["scale"], dtype=np.float64)
+        translate = np.array(transform["translate"], dtype=np.float64)
+        compactor = VertexCompactor()
+        exported_ids = set(obj_ids)
+
+        with open(output_cj_path, "wb") as cj_file:
+            # Same layout as `json_io.dumps_bytes` for the whole document
+            item, key_sep = json_io.ITEM_SEPARATOR, json_io.KEY_SEPARATOR
+            cj_file.write(b'{"type"' + key_sep + b'"CityJSON"' + item)
+            cj_file.write(b'"version"' + key_sep)
+            cj_file.write(json_io.dumps_bytes(self.data["version"]))
+            cj_file.write(item + b'"transform"' + key_sep)
+            cj_file.write(json_io.dumps_bytes(transform))
+
+            cj_file.write(item + b'"CityObjects"' + key_sep + b"{")
+            for i, obj_id in enumerate(tqdm(obj_ids, desc="Writing the objects")):
+                obj = self._compacted_object(obj_id, compactor, exported_ids)
+                if i > 0:
+                    cj_file.write(item)
+                cj_file.write(json_io.dumps_bytes(obj_id))
+                cj_file.write(key_sep)
+                cj_file.write(json_io.dumps_bytes(obj))
+
+            cj_file.write(b"}" + item + b'"vertices"' + key_sep + b"[")
+            first_chunk = True
+            for vertices in compactor.chunks:
+                int_vertices = np.rint((vertices - translate) / scale).astype(np.int64)
+                for start in range(0, len(int_vertices), _VERTICES_CHUNK):
+                    chunk = int_vertices[start : start + _VERTICES_CHUNK]
+                    if not first_chunk:
+                        cj_file.write(item)
+                    # Remove the brackets of the list to concatenate the chunks
+                    cj_file.write(json_io.dumps_bytes(chunk.tolist())[1:-1])
+                    first_chunk = False
+            cj_file.write(b"]")
+
+            # Write the other members of the header, with an updated extent
+            for key, value in self.data.items():
+                if key in ("type", "version", "transform", "CityObjects", "vertices"):
+                    continue
+                if key == "metadata" and "geographicalExtent" in value:
+                    value = dict(value)
+                    if compactor.n_vertices > 0:
+                        all_vertices = np.concatenate(compactor.chunks)
+                        value["geographicalExtent"] = np.concatenate(
+                            (all_vertices.min(axis=0), all_vertices.max(axis=0))
+                        ).tolist()
+                    else:
+                        value.pop("geographicalExtent")
+                cj_file.write(item)
+                cj_file.write(json_io.dumps_bytes(key))
+                cj_file.write(key_sep)
+                cj_file.write(json_io.dumps_bytes(value))
+            cj_file.write(b"}")
+
+        logging.info(
+            f"Wrote {len(obj_ids)} objects and {compactor.n_vertices} vertices to {output_cj_path}"
+        )
+
+    def _compacted_object(
+        self, obj_id: str, compactor: VertexCompactor, exported_ids: set[str]
+    ) -> dict[str, Any]:
+        """
+        Build a copy of an object with its geometry referring to the compacted vertices.
+        The references to children and parents that are not exported are removed.
+
+        Parameters
+        ----------
+        obj_id : str
+            The id of the object.
+        compactor : VertexCompactor
+            The compactor of the vertices of the output.
+        exported_ids : set[str]
+            The ids of all the exported objects.
+
+        Returns
+        -------
+        dict[str, Any]
+            The object, ready to be written.
+        """
+        feature = self.get_feature(obj_id)
+        obj = dict(feature.objects[obj_id])
+        for relation in ("children", "parents"):
+            if relation in obj:
+                obj[relation] = [
+                    other_id for other_id in obj[relation] if other_id in exported_ids
+                ]
+                if len(obj[relation]) == 0:
+                    del obj[relation]
+        if "geometry" not in obj:
+            return obj
+
+        boundaries = feature.boundaries
+        geoms_indices = boundaries.object_geometries(boundaries.object_index[obj_id])
+        new_geometries = []
+        for geom, geom_idx in zip(obj["geometry"], geoms_indices):
+            geom = dict(geom)
+            if geom["type"] in FLAT_TYPES:
+                mapping = compactor.reindex(
+                    boundaries.geometry_indices(geom_idx), feature.vertices
+                )
+                geom["boundaries"] = boundaries.nested(geom_idx, mapping=mapping)
+            else:
+                # Other geometries were not flattened, and still have their boundaries
+                old_indices = np.array(
+                    _nested_indices(geom["boundaries"]), dtype=np.int64
+                )
+                mapping = compactor.reindex(old_indices, feature.vertices)
+                geom["boundaries"] = _remap_nested(geom["boundaries"], mapping)
+            new_geometries.append(geom)
+        obj["geometry"] = new_geometries
+        return obj
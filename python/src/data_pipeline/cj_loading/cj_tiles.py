@@ -0,0 +1,203 @@
+"""
+Spatial partition of the objects into tiles, described by a manifest following the layout of 3D Tiles.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+DEFAULT_MAX_TILE_FEATURES = 256
+# Limit of the depth of the quadtree, reached only when many features share the same position
+MAX_TILE_LEVEL = 16
+# Folder of the glb files of the tiles, next to the manifest
+TILES_FOLDER_NAME = "tiles"
+
+
+class Tile:
+    """
+    Tile of a quadtree over the footprints of features, formed by a root object and all its descendants.
+    Only the leaves of the quadtree have features, the other tiles only group their children.
+    """
+
+    def __init__(
+        self,
+        level: int,
+        x: int,
+        y: int,
+        features: NDArray[np.int64],
+        bounds: NDArray[np.float64],
+        children: list[Tile],
+    ) -> None:
+        """
+        Tile of a quadtree.
+
+        Parameters
+        ----------
+        level : int
+            The level of the tile in the quadtree, 0 for the root.
+        x : int
+            The column of the tile at its level, from 0 to 2**level - 1.
+        y : int
+            The row of the tile at its level, from 0 to 2**level - 1.
+        features : NDArray[np.int64]
+            The indices of the features stored in the tile, empty if the tile is not a leaf.
+        bounds : NDArray[np.float64]
+            The 3D bounding box of all the features in the tile and its descendants, as `[min_x, min_y, min_z, max_x, max_y, max_z]`.
+        children : list[Tile]
+            The non-empty children of the tile.
+        """
+        self.level = level
+        self.x = x
+        self.y = y
+        self.features = features
+        self.bounds = bounds
+        self.children = children
+
+    @property
+    def content_uri(self) -> str:
+        """
+        The path of the glb file of the tile, relative to the manifest.
+        """
+        return f"{TILES_FOLDER_NAME}/{self.level}_{self.x}_{self.y}.glb"
+
+    def leaves(self) -> Iterator[Tile]:
+        """
+        Iterate over the tiles storing features, depth first.
+
+        Yields
+        ------
+        Tile
+            The leaves of the quadtree below this tile, or the tile itself if it is a leaf.
+        """
+        if len(self.children) == 0:
+            yield self
+        for child in self.children:
+            yield from child.leaves()
+
+
+def quadtree_tiles(
+    bounds: NDArray[np.float64],
+    max_features: int = DEFAULT_MAX_TILE_FEATURES,
+) -> Tile | None:
+    """
+    Partition features into a quadtree, based on the center of their 2D footprint.
+    The cells of the quadtree split the extent of all the features in four equal parts at every level, and a cell is split until it contains at most `max_features` features.
+
+    Parameters
+    ----------
+    bounds : NDArray[np.float64]
+        The 3D bounding boxes (n_features, 6) of the features, as `[min_x, min_y, min_z, max_x, max_y, max_z]`.
+        The features with NaN bounds, without geometry, are not stored in any tile.
+    max_features : int, optional
+        The maximum number of features in a tile, unless `MAX_TILE_LEVEL` is reached.
+        By default `DEFAULT_MAX_TILE_FEATURES`.
+
+    Returns
+    -------
+    Tile | None
+        The root of the quadtree, or None if no feature has a geometry.
+    """
+    features = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+    if len(features) == 0:
+        return None
+    centers = (bounds[:, :2] + bounds[:, 3:5]) / 2
+    extent_min = centers[features].min(axis=0)
+    extent_size = np.maximum(centers[features].max(axis=0) - extent_min, 1e-9)
+
+    def make_tile(level: int, x: int, y: int, tile_features: NDArray[np.int64]) -> Tile:
+        tile_bounds = np.concatenate(
+            (
+                bounds[tile_features, :3].min(axis=0),
+                bounds[tile_features, 3:].max(axis=0),
+            )
+        )
+        if len(tile_features) <= max_features or level == MAX_TILE_LEVEL:
+            return Tile(level, x, y, tile_features, tile_bounds, [])
+
+        # Cell of every feature at the next level, clipped for the features on the upper edge
+        n_cells = 2 ** (level + 1)
+        cells = np.floor(
+            (centers[tile_features] - extent_min) / extent_size * n_cells
+        ).astype(np.int64)
+        cells = np.clip(cells, 0, n_cells - 1)
+        children = []
+        for child_x in (2 * x, 2 * x + 1):
+            for child_y in (2 * y, 2 * y + 1):
+                in_child = (cells[:, 0] == child_x) & (cells[:, 1] == child_y)
+                if np.any(in_child):
+                    children.append(
+                        make_tile(level + 1, child_x, child_y, tile_features[in_child])
+                    )
+        return Tile(level, x, y, np.zeros(0, dtype=np.int64), tile_bounds, children)
+
+    return make_tile(0, 0, 0, features)
+
+
+def _bounding_box(bounds: NDArray[np.float64]) -> list[float]:
+    """
+    Convert a bounding box to a 3D Tiles "box" bounding volume, made of its center and its three half-axes.
+
+    Parameters
+    ----------
+    bounds : NDArray[np.float64]
+        The bounding box as `[min_x, min_y, min_z, max_x, max_y, max_z]`.
+
+    Returns
+    -------
+    list[float]
+        The 12 values of the bounding volume.
+    """
+    center = (bounds[:3] + bounds[3:]) / 2
+    half_axes = np.diag((bounds[3:] - bounds[:3]) / 2)
+    return center.tolist() + half_axes.reshape(-1).tolist()
+
+
+def tileset(root: Tile, feature_objects: list[list[str]]) -> dict[str, Any]:
+    """
+    Build the manifest of a quadtree of tiles, following the layout of a 3D Tiles tileset.
+    The coordinates are the ones of the glb files, without any root transform.
+    Every leaf refers to its glb file, and lists the ids of its objects in its "extras".
+
+    Parameters
+    ----------
+    root : Tile
+        The root of the quadtree.
+    feature_objects : list[list[str]]
+        The ids of the objects of every feature.
+
+    Returns
+    -------
+    dict[str, Any]
+        The manifest, ready to be written as JSON.
+    """
+
+    def tile_json(tile: Tile) -> dict[str, Any]:
+        # Simple heuristic: the error of not loading a tile is its size
+        diagonal = float(np.linalg.norm(tile.bounds[3:] - tile.bounds[:3]))
+        tile_dict: dict[str, Any] = {
+            "boundingVolume": {"box": _bounding_box(tile.bounds)},
+            "geometricError": 0.0 if len(tile.children) == 0 else diagonal,
+        }
+        if len(tile.children) > 0:
+            tile_dict["children"] = [tile_json(child) for child in tile.children]
+        else:
+            tile_dict["content"] = {"uri": tile.content_uri}
+            tile_dict["extras"] = {
+                "objects": [
+                    obj_id
+                    for feature_idx in tile.features
+                    for obj_id in feature_objects[feature_idx]
+                ]
+            }
+        return tile_dict
+
+    root_json = tile_json(root)
+    root_json["refine"] = "ADD"
+    return {
+        "asset": {"version": "1.1"},
+        "geometricError": float(np.linalg.norm(root.bounds[3:] - root.bounds[:3])),
+        "root": root_json,
+    }
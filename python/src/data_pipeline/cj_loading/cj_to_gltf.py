@@ -2,73 +2,617 @@
 Scripts to load CityJSON files exported by the other scripts and export to a dual CityJSON/glTF format by transferring all the geometry to glTF.
 """
 
-import json
-from copy import deepcopy
+import logging
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Collection, Iterator
 
 import numpy as np
 import trimesh
-from data_pipeline.cj_loading.cj_loader import CityjsonLoader, cj_object_to_mesh
+from data_pipeline.cj_helpers.cj_attributes import ARGUMENT_TO_NAME
+from data_pipeline.cj_loading.cj_loader import DEFAULT_MESH_CACHE_BYTES, CityjsonLoader
+from data_pipeline.cj_loading.cj_parallel import (
+    parallel_object_meshes,
+    parallel_sequence_meshes,
+)
+from data_pipeline.cj_loading.cj_tiles import (
+    DEFAULT_MAX_TILE_FEATURES,
+    TILES_FOLDER_NAME,
+    quadtree_tiles,
+    tileset,
+)
+from data_pipeline.utils import json_io
+from data_pipeline.utils.gltf_utils import (
+    FEATURE_ID_ATTRIBUTE,
+    add_feature_ids,
+    instance_glb,
+    quantize_glb,
+)
+from data_pipeline.utils.memory_utils import log_peak_rss
+from data_pipeline.utils.mesh_optimization import (
+    DEFAULT_VERTEX_CACHE_SIZE,
+    optimize_vertex_cache,
+    translation_fingerprint,
+)
+from data_pipeline.utils.mesh_simplification import DEFAULT_MAX_FACES, simplify_mesh
+from numpy.typing import NDArray
 from tqdm import tqdm
 
+# Index of the glb files written by `export_lods`
+LODS_INDEX_NAME = "geometry-lods.json"
+# Quantization of the glb files: one grid per mesh or one grid per file
+QUANTIZATION_MODES = ("mesh", "file")
+# Groups of objects merged by `batch_meshes`, and the table of their feature ids
+BATCH_GROUPS = ("building", "storey")
+FEATURE_TABLE_NAME = "feature-ids.json"
+# LoD of the simplified meshes added by `add_far_lod`
+FAR_LOD = "far"
+# Manifest and folder of the attribute shards written by `write_attribute_shards`
+SHARDS_MANIFEST_NAME = "attributes-manifest.json"
+SHARDS_FOLDER_NAME = "attributes"
+
+
+def _lod_detail(lod: str) -> tuple[bool, float, str]:
+    """
+    Key ordering the LoDs of CityJSON from the least to the most detailed.
+    The LoDs that are not numbers, such as empty LoDs, are considered less detailed than all the others, and ordered by name.
+
+    Parameters
+    ----------
+    lod : str
+        The LoD, as written in CityJSON.
+
+    Returns
+    -------
+    tuple[bool, float, str]
+        The key of the LoD.
+    """
+    try:
+        return True, float(lod), lod
+    except ValueError:
+        return False, 0.0, lod
+
+
+def _scene_parents(objects: dict[str, dict[str, Any]]) -> dict[str, str]:
+    """
+    Compute the parent of the node of every object in the glTF scene, based on "parent" and "children".
+    When they disagree, the last object of the file referring to a child wins.
+
+    Parameters
+    ----------
+    objects : dict[str, dict[str, Any]]
+        The CityJSON objects.
+
+    Returns
+    -------
+    dict[str, str]
+        A dictionary mapping the id of an object to the id of its parent, for the objects that have one.
+    """
+    parent_of: dict[str, str] = {}
+    for obj_key, obj in objects.items():
+        parent = obj.get("parent", None)
+        if parent is not None:
+            parent_of[obj_key] = parent
+        # If the object defines explicit "children", ensure they are linked too
+        for child_id in obj.get("children", []):
+            parent_of[child_id] = obj_key
+    return parent_of
+
+
+def _object_trees(objects: dict[str, dict[str, Any]]) -> dict[str, list[str]]:
+    """
+    Gather the objects into trees, formed by a root object and all its descendants, following the hierarchy of the glTF scene.
+    The root of a tree is the highest ancestor that is in the file.
+
+    Parameters
+    ----------
+    objects : dict[str, dict[str, Any]]
+        The CityJSON objects.
+
+    Returns
+    -------
+    dict[str, list[str]]
+        A dictionary mapping the id of every root object to the ids of the objects of its tree, in the order of the file.
+    """
+    parent_of = _scene_parents(objects)
+    trees: dict[str, list[str]] = {}
+    root_of: dict[str, str] = {}
+    for obj_key in objects:
+        root = obj_key
+        visited = {root}
+        while parent_of.get(root) in objects and parent_of[root] not in visited:
+            root = parent_of[root]
+            visited.add(root)
+        root_of[obj_key] = root
+        trees.setdefault(root, [])
+    for obj_key, root in root_of.items():
+        trees[root].append(obj_key)
+    return trees
+
+
+def _check_no_outputs(folder: Path, pattern: str) -> None:
+    """
+    Check that a folder does not contain outputs of a previous export.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder of the outputs.
+    pattern : str
+        The glob pattern of the outputs in the folder.
+
+    Raises
+    ------
+    RuntimeError
+        If the folder contains a file matching the pattern.
+    """
+    for path in folder.glob(pattern):
+        raise RuntimeError(
+            f"File {path} already exists. Set `overwrite` to True to overwrite."
+        )
+
 
 class Cityjson2Gltf(CityjsonLoader):
     """
     Load a CityJSON file and transforms it into a pair formed by a glTF file storing the geometry and a CityJSON file storing the attributes.
     The hierarchy of the CityJSON file is fully preserved, only the geometry is removed and stored in glTF, with identifiers of the form `<cityjson_key>-lod_<lod>`.
     The hierarchy of the CityJSON file is also reproduced in glTF, with all LoDs stored as children of their main object, which has no geometry.
+    GeometryInstances keep the mesh of their template, stored once as `template_<index>` in glTF and placed by the transformation of their node.
+    The input can also be a CityJSONSeq file, in which case the geometry is converted one feature at a time.
+    If `lods` is given, only these LoDs are converted and stored in glTF.
     """
 
-    def __init__(self, cj_path: Path) -> None:
-        super().__init__(cj_path)
+    def __init__(
+        self,
+        cj_path: Path,
+        vertex_cache: bool = False,
+        mesh_cache_bytes: int = DEFAULT_MESH_CACHE_BYTES,
+        geometry: bool = True,
+        lods: Collection[str] | None = None,
+        low_memory: bool = False,
+    ) -> None:
+        super().__init__(
+            cj_path,
+            vertex_cache=vertex_cache,
+            mesh_cache_bytes=mesh_cache_bytes,
+            geometry=geometry,
+            lods=lods,
+            low_memory=low_memory,
+        )
 
-    def make_gltf_scene(self):
+    def iter_object_meshes(
+        self, workers: int = 1
+    ) -> Iterator[tuple[str, dict[str, trimesh.Trimesh] | None]]:
+        """
+        Iterate over the meshes of all the objects, feature by feature in the order of the file.
+        With more than one worker, the meshes are computed in a pool of processes, but still returned in the same order.
+
+        Parameters
+        ----------
+        workers : int, optional
+            The number of processes computing the meshes.
+            By default 1, to compute them in the current process.
+
+        Yields
+        ------
+        tuple[str, dict[str, trimesh.Trimesh] | None]
+            The id of every object with the dictionary mapping its LoDs to their meshes, or None if it has no geometry.
+        """
+        if workers <= 1:
+            for feature in self.iter_features():
+                for obj_key in feature.objects:
+                    yield obj_key, self.meshes(obj_key, feature=feature)
+            return
+
+        logging.info(f"Compute the meshes with {workers} workers")
+        if self.is_sequence:
+            meshes_iterator = parallel_sequence_meshes(
+                cj_path=self.path,
+                transform=self.data["transform"],
+                feature_offsets=list(self._feature_offsets.values()),
+                workers=workers,
+                lods=self.lods,
+            )
+        else:
+            obj_ids = [
+                obj_key
+                for objects in self._cj_group_features().values()
+                for obj_key in objects
+            ]
+            meshes_iterator = parallel_object_meshes(
+                boundaries=self.boundaries,
+                vertices=self.vertices,
+                obj_ids=obj_ids,
+                workers=workers,
+                lods=self.lods,
+            )
+        for obj_key, meshes_lods in meshes_iterator:
+            self.mesh_cache.put(obj_key, meshes_lods)
+            if self.low_memory:
+                self.data["CityObjects"][obj_key].pop("geometry", None)
+            yield obj_key, meshes_lods
+
+    def make_gltf_scene(self, workers: int = 1):
         """
         Create the scene for glTF, preserving the structure from the CityJSON input.
+
+        Parameters
+        ----------
+        workers : int, optional
+            The number of processes converting the geometry of the objects to meshes.
+            The scene is the same for any number of workers.
+            By default 1.
         """
         objects: dict[str, dict] = self.data["CityObjects"]
         scene = trimesh.Scene()
+        parent_of = _scene_parents(objects)
+        base_frame = scene.graph.base_frame
+        # Shared by all the edges, it is never modified
+        identity = np.eye(4)
 
-        # First insert all the objects without hierarchy
-        for obj_key, obj in tqdm(objects.items(), desc="Inserting the objects"):
-            meshes_lods = cj_object_to_mesh(
-                obj_dict=obj,
-                vertices=self.vertices,
+        # Collect all the edges of the graph first, in the order of the file
+        edges: list[tuple[str, str, dict[str, Any]]] = []
+        lod_nodes: dict[str, list[str]] = {}
+        for obj_key, meshes_lods in tqdm(
+            self.iter_object_meshes(workers=workers),
+            desc="Inserting the objects",
+            total=len(objects),
+        ):
+            # Every object has a node without geometry, that its LoDs and children are attached to
+            edges.append(
+                (parent_of.get(obj_key, base_frame), obj_key, {"matrix": identity})
             )
-            # Insert an empty node so children can still to it
-            scene.graph.update(frame_to=obj_key, frame_from=None, matrix=np.eye(4))
             if meshes_lods is not None:
                 for lod, mesh in meshes_lods.items():
-                    scene.add_geometry(
-                        mesh,
-                        node_name=obj_key + "-lod_" + lod,
-                        parent_node_name=obj_key,
+                    geom_name = f"geometry_{len(scene.geometry)}"
+                    scene.geometry[geom_name] = mesh
+                    node_name = obj_key + "-lod_" + lod
+                    edges.append(
+                        (
+                            obj_key,
+                            node_name,
+                            {"matrix": identity, "geometry": geom_name},
+                        )
+                    )
+                    lod_nodes.setdefault(lod, []).append(node_name)
+            # Instances share the mesh of their template, with their own transformation
+            for lod, instance in self.instances(obj_key).items():
+                template_name = f"template_{instance.template}"
+                if template_name not in scene.geometry:
+                    template_mesh = self.template_mesh(instance.template)
+                    if template_mesh is None:
+                        continue
+                    scene.geometry[template_name] = template_mesh
+                node_name = obj_key + "-lod_" + lod
+                edges.append(
+                    (
+                        obj_key,
+                        node_name,
+                        {"matrix": instance.matrix, "geometry": template_name},
                     )
-
-        # Then set up the structure
-        for obj_key, obj in tqdm(objects.items(), desc="Setting up the structure"):
-            parent = obj.get("parent", None)
-            if parent is not None:
-                # Attach child node to its parent in the scene graph
-                scene.graph.update(
-                    frame_to=obj_key,
-                    frame_from=parent,
-                    matrix=np.eye(4),
                 )
-            # If the object defines explicit "children", ensure they are linked too
-            for child_id in obj.get("children", []):
-                scene.graph.update(
-                    frame_to=child_id,
-                    frame_from=obj_key,
-                    matrix=np.eye(4),
+                lod_nodes.setdefault(lod, []).append(node_name)
+
+        logging.info(f"Mesh cache after inserting the objects: {self.mesh_cache}")
+
+        # Children referenced by an object but missing from the file still get a node
+        for child_id, parent in parent_of.items():
+            if child_id not in objects:
+                edges.append((parent, child_id, {"matrix": identity}))
+
+        # Then insert all the edges at once, without the per-call overhead of `scene.graph.update`
+        transforms = scene.graph.transforms
+        for frame_from, frame_to, attributes in edges:
+            transforms.add_edge(frame_from, frame_to, **attributes)
+
+        self.scene = scene
+        # Names of the nodes with the geometry of every LoD
+        self.lod_nodes = lod_nodes
+        # CityJSON keys of the feature ids of every batched node, filled by `batch_meshes`
+        self.feature_tables: dict[str, list[str]] = {}
+        log_peak_rss("creating the glTF scene")
+
+    def _merge_nodes(
+        self, nodes: list[str], frame: str
+    ) -> tuple[trimesh.Trimesh, list[int]]:
+        """
+        Merge the meshes of some nodes into a single mesh, expressed in the frame of another node.
+
+        Parameters
+        ----------
+        nodes : list[str]
+            The names of the nodes with a mesh.
+        frame : str
+            The name of the node whose frame the merged mesh is expressed in.
+
+        Returns
+        -------
+        trimesh.Trimesh
+            The merged mesh, with the vertices of the nodes in the given order.
+        list[int]
+            The number of vertices of the mesh of every node.
+        """
+        graph = self.scene.graph
+        node_data = graph.transforms.node_data
+        frame_inverse = np.linalg.inv(graph.get(frame)[0])
+        vertices: list[NDArray[np.float64]] = []
+        faces: list[NDArray[np.int64]] = []
+        vertex_counts: list[int] = []
+        for node in nodes:
+            mesh = self.scene.geometry[node_data[node]["geometry"]]
+            vertices.append(
+                trimesh.transform_points(
+                    mesh.vertices, frame_inverse @ graph.get(node)[0]
                 )
+            )
+            faces.append(mesh.faces + sum(vertex_counts))
+            vertex_counts.append(len(mesh.vertices))
+        merged = trimesh.Trimesh(
+            vertices=np.concatenate(vertices),
+            faces=np.concatenate(faces),
+            process=False,
+        )
+        return merged, vertex_counts
 
+    def add_far_lod(
+        self,
+        max_faces: int = DEFAULT_MAX_FACES,
+        max_error: float | None = None,
+        source_lod: str | None = None,
+    ) -> None:
+        """
+        Add a simplified LoD to every feature (a root object with all its descendants), to render it cheaply from far away.
+        The meshes of a LoD of all the objects of the feature are merged and simplified with `simplify_mesh`, and attached to the root object as `<cityjson_key>-lod_far`.
+
+        Parameters
+        ----------
+        max_faces : int, optional
+            The number of triangles of the simplified mesh of every feature.
+            By default `DEFAULT_MAX_FACES`.
+        max_error : float | None, optional
+            If given, the distance that the simplification cannot exceed, even if `max_faces` is not reached.
+            By default None.
+        source_lod : str | None, optional
+            The LoD to simplify.
+            By default None, for the most detailed LoD of every feature.
+        """
+        node_lods = {
+            node: lod for lod, nodes in self.lod_nodes.items() for node in nodes
+        }
+        far_nodes = self.lod_nodes.setdefault(FAR_LOD, [])
+        n_faces = n_far_faces = 0
+        for nodes in tqdm(self._features_nodes(), desc="Simplifying the features"):
+            feature_lods = {node_lods[node] for node in nodes if node in node_lods}
+            feature_lods.discard(FAR_LOD)
+            if source_lod is not None:
+                lod = source_lod
+            elif len(feature_lods) > 0:
+                lod = max(feature_lods, key=_lod_detail)
+            else:
+                continue
+            lod_nodes = [node for node in nodes if node_lods.get(node) == lod]
+            if len(lod_nodes) == 0:
+                continue
+            mesh, _ = self._merge_nodes(lod_nodes, nodes[0])
+            far_mesh = simplify_mesh(mesh, max_faces=max_faces, max_error=max_error)
+            n_faces += len(mesh.faces)
+            n_far_faces += len(far_mesh.faces)
+            geom_name = f"far_{len(far_nodes)}"
+            node_name = f"{nodes[0]}-lod_{FAR_LOD}"
+            self.scene.geometry[geom_name] = far_mesh
+            self.scene.graph.transforms.add_edge(
+                nodes[0], node_name, matrix=np.eye(4), geometry=geom_name
+            )
+            far_nodes.append(node_name)
+        logging.info(
+            f"Simplified {len(far_nodes)} features from {n_faces} to {n_far_faces} triangles"
+        )
+
+    def batch_meshes(self, group: str = "building") -> None:
+        """
+        Merge the meshes of every group of objects into a single mesh per LoD, to draw them in a single call.
+        Every vertex stores the index of its object in the `_FEATURE_ID_0` attribute, written with the `EXT_mesh_features` extension, and `feature_tables` maps these indices to the CityJSON keys.
+        The batched mesh of a LoD is attached to the node of the group as `<group_key>-lod_<lod>`, and replaces the nodes of the LoD of all the objects of the group.
+
+        Parameters
+        ----------
+        group : str, optional
+            The objects merged together: "building" for a root object with all its descendants, or "storey" for a `BuildingStorey` with all its descendants, the other objects being merged with their root object.
+            By default "building".
+
+        Raises
+        ------
+        ValueError
+            If `group` is unknown.
+        """
+        if group not in BATCH_GROUPS:
+            raise ValueError(f"Unknown group {group}, expected one of {BATCH_GROUPS}.")
+        objects = self.data["CityObjects"]
+        graph = self.scene.graph
+        transforms = graph.transforms
+        node_data = transforms.node_data
+
+        # Group of every node with a mesh, and the meshes of every group and LoD in the order of the scene
+        node_lods = {
+            node: lod for lod, nodes in self.lod_nodes.items() for node in nodes
+        }
+        batches: dict[tuple[str, str], list[str]] = {}
+        batch_of: dict[str, tuple[str, str]] = {}
+        for nodes in self._features_nodes():
+            group_of = {nodes[0]: nodes[0]}
+            for node in nodes[1:]:
+                parent = transforms.parents[node]
+                if (
+                    group == "storey"
+                    and objects.get(node, {}).get("type") == "BuildingStorey"
+                ):
+                    group_of[node] = node
+                else:
+                    group_of[node] = group_of[parent]
+                if node_data[node].get("geometry") is not None:
+                    batch = (group_of[parent], node_lods[node])
+                    batches.setdefault(batch, []).append(node)
+                    batch_of[node] = batch
+
+        # Merge the meshes, expressed in the frame of the node of their group
+        batch_meshes: dict[tuple[str, str], str] = {}
+        geometry: dict[str, trimesh.Trimesh] = {}
+        feature_tables: dict[str, list[str]] = {}
+        lod_nodes: dict[str, list[str]] = {}
+        for (group_key, lod), nodes in tqdm(
+            batches.items(), desc="Batching the meshes"
+        ):
+            mesh, vertex_counts = self._merge_nodes(nodes, group_key)
+            # Every object has a single node per LoD
+            mesh.vertex_attributes[FEATURE_ID_ATTRIBUTE] = np.repeat(
+                np.arange(len(nodes), dtype=np.float32), vertex_counts
+            )
+            geom_name = f"batch_{len(geometry)}"
+            geometry[geom_name] = mesh
+            batch_meshes[(group_key, lod)] = geom_name
+            feature_tables[f"{group_key}-lod_{lod}"] = [
+                transforms.parents[node] for node in nodes
+            ]
+
+        # Rebuild the scene in the same order, the first mesh of every batch giving the position of the batched node
+        scene = trimesh.Scene()
+        base_frame = graph.base_frame
+        for (frame_from, frame_to), attributes in transforms.edge_data.items():
+            if frame_from == base_frame:
+                frame_from = scene.graph.base_frame
+            batch = batch_of.get(frame_to)
+            if batch is None:
+                scene.graph.transforms.add_edge(frame_from, frame_to, **attributes)
+                continue
+            geom_name = batch_meshes.pop(batch, None)
+            if geom_name is None:
+                continue
+            group_key, lod = batch
+            node_name = f"{group_key}-lod_{lod}"
+            scene.geometry[geom_name] = geometry[geom_name]
+            scene.graph.transforms.add_edge(
+                group_key, node_name, matrix=np.eye(4), geometry=geom_name
+            )
+            lod_nodes.setdefault(lod, []).append(node_name)
+
+        n_meshes = len(self.scene.geometry)
         self.scene = scene
+        self.lod_nodes = lod_nodes
+        self.feature_tables = feature_tables
+        logging.info(
+            f"Batched {len(batch_of)} nodes with {n_meshes} meshes into {len(geometry)} meshes"
+        )
+
+    def deduplicate_meshes(self) -> None:
+        """
+        Share the meshes of the scene that are translated copies of each other, found with `translation_fingerprint`.
+        The nodes keep their names, and get the translation of their mesh in their transformation instead.
+        The vertices are compared with a tolerance of the scale of the CityJSON vertices.
+        The meshes cached by `meshes` are cleared, since they are not the meshes of the scene anymore.
+        """
+        transforms = self.scene.graph.transforms
+        tolerance = min(self.data["transform"]["scale"])
+        # Name and origin of the first mesh of every fingerprint
+        originals: dict[bytes, tuple[str, NDArray[np.float64]]] = {}
+        # Original mesh and translation of the copies
+        copies: dict[str, tuple[str, NDArray[np.float64]]] = {}
+        for geom_name, mesh in self.scene.geometry.items():
+            if len(mesh.vertices) == 0:
+                continue
+            fingerprint, origin = translation_fingerprint(mesh, tolerance)
+            if fingerprint not in originals:
+                originals[fingerprint] = (geom_name, origin)
+                continue
+            original_name, original_origin = originals[fingerprint]
+            translation = origin - original_origin
+            if np.allclose(
+                mesh.vertices - translation,
+                self.scene.geometry[original_name].vertices,
+                rtol=0,
+                atol=tolerance,
+            ):
+                copies[geom_name] = (original_name, translation)
+
+        for (frame_from, frame_to), attributes in list(transforms.edge_data.items()):
+            geom_name = attributes.get("geometry")
+            if geom_name not in copies:
+                continue
+            original_name, translation = copies[geom_name]
+            matrix = attributes["matrix"] @ trimesh.transformations.translation_matrix(
+                translation
+            )
+            transforms.add_edge(
+                frame_from,
+                frame_to,
+                **{**attributes, "matrix": matrix, "geometry": original_name},
+            )
+        for geom_name in copies:
+            del self.scene.geometry[geom_name]
+        self.mesh_cache.clear()
+        n_originals = len({original_name for original_name, _ in copies.values()})
+        logging.info(
+            f"Shared {len(copies)} meshes that are translated copies of {n_originals} meshes"
+        )
+
+    def optimize_meshes(self, cache_size: int = DEFAULT_VERTEX_CACHE_SIZE) -> None:
+        """
+        Reorder the triangles and vertices of all the meshes of the scene for the post-transform vertex cache of the GPU, with `optimize_vertex_cache`.
+        The average cache miss ratio (ACMR) before and after is logged for every feature at the DEBUG level, and for the whole scene at the INFO level.
+        The meshes cached by `meshes` are cleared, since they are not the meshes of the scene anymore.
 
-    def export(self, output_folder: Path, overwrite: bool = False) -> None:
+        Parameters
+        ----------
+        cache_size : int, optional
+            The number of vertices in the simulated cache.
+            By default `DEFAULT_VERTEX_CACHE_SIZE`.
+        """
+        node_data = self.scene.graph.transforms.node_data
+        # Number of triangles and ACMR before and after of every mesh, shared meshes being optimized once
+        mesh_stats: dict[str, tuple[int, float, float]] = {}
+        total_before = total_after = total_faces = 0.0
+        for nodes in tqdm(self._features_nodes(), desc="Optimizing the meshes"):
+            feature_before = feature_after = feature_faces = 0.0
+            for node in nodes:
+                geom_name = node_data[node].get("geometry")
+                if geom_name is None:
+                    continue
+                if geom_name not in mesh_stats:
+                    mesh = self.scene.geometry[geom_name]
+                    optimized, acmr_before, acmr_after = optimize_vertex_cache(
+                        mesh, cache_size=cache_size
+                    )
+                    self.scene.geometry[geom_name] = optimized
+                    mesh_stats[geom_name] = (len(mesh.faces), acmr_before, acmr_after)
+                    total_faces += len(mesh.faces)
+                    total_before += acmr_before * len(mesh.faces)
+                    total_after += acmr_after * len(mesh.faces)
+                n_faces, acmr_before, acmr_after = mesh_stats[geom_name]
+                feature_faces += n_faces
+                feature_before += acmr_before * n_faces
+                feature_after += acmr_after * n_faces
+            if feature_faces > 0:
+                logging.debug(
+                    f"ACMR of {nodes[0]}: {feature_before / feature_faces:.3f} -> {feature_after / feature_faces:.3f}"
+                )
+        self.mesh_cache.clear()
+        if total_faces > 0:
+            logging.info(
+                f"ACMR of the {len(mesh_stats)} meshes with a cache of {cache_size} vertices: "
+                f"{total_before / total_faces:.3f} -> {total_after / total_faces:.3f}"
+            )
+
+    def export(
+        self,
+        output_folder: Path,
+        overwrite: bool = False,
+        max_tile_features: int | None = None,
+        split_lods: bool = False,
+        quantization: str | None = None,
+        gpu_instancing: bool = False,
+        shard_attributes: bool = False,
+    ) -> None:
         """
         Export the dual representation into the given folder.
+        If the file was loaded without its geometry, only the CityJSON file with the attributes is written.
 
         Parameters
         ----------
@@ -77,35 +621,471 @@ class Cityjson2Gltf(CityjsonLoader):
         overwrite : bool, optional
             Whether to overwrite the files if they exist.
             By default False.
+        max_tile_features : int | None, optional
+            If given, the geometry is split into spatial tiles of at most this number of features, written with `export_tiles` instead of a single `geometry.glb`.
+            By default None.
+        split_lods : bool, optional
+            Whether to write every LoD in its own glb file with `export_lods`, instead of a single `geometry.glb`.
+            By default False.
+        quantization : str | None, optional
+            If given, the glb files are quantized with `KHR_mesh_quantization`, on a grid fitted to every "mesh" or to every "file".
+            By default None.
+        gpu_instancing : bool, optional
+            Whether to draw the meshes shared by several nodes with `EXT_mesh_gpu_instancing`, see `deduplicate_meshes` to share the identical meshes.
+            By default False.
+        shard_attributes : bool, optional
+            Whether to also write the attributes in shards that can be loaded lazily, with `write_attribute_shards`.
+            By default False.
 
         Raises
         ------
+        ValueError
+            If both `max_tile_features` and `split_lods` are given, or if `quantization` is unknown.
         RuntimeError
-            If the path of any of the two outputs already exists and `overwrite` was not set to True.
+            If the path of any of the outputs already exists and `overwrite` was not set to True.
         """
+        if max_tile_features is not None and split_lods:
+            raise ValueError("The geometry cannot be split both in tiles and in LoDs.")
+        if quantization is not None and quantization not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unknown quantization {quantization}, expected one of {QUANTIZATION_MODES}."
+            )
         output_folder.mkdir(parents=True, exist_ok=overwrite)
-        glb_path = output_folder / "geometry.glb"
+        if max_tile_features is not None:
+            geometry_path = output_folder / "tileset.json"
+        elif split_lods:
+            geometry_path = output_folder / LODS_INDEX_NAME
+        else:
+            geometry_path = output_folder / "geometry.glb"
         cj_path = output_folder / "attributes.city.json"
         if not overwrite:
-            if glb_path.exists():
+            if self.geometry and geometry_path.exists():
                 raise RuntimeError(
-                    f"File {glb_path} already exists. Set `overwrite` to True to overwrite."
+                    f"File {geometry_path} already exists. Set `overwrite` to True to overwrite."
                 )
             if cj_path.exists():
                 raise RuntimeError(
                     f"File {cj_path} already exists. Set `overwrite` to True to overwrite."
                 )
+            manifest_path = output_folder / SHARDS_MANIFEST_NAME
+            if shard_attributes and manifest_path.exists():
+                raise RuntimeError(
+                    f"File {manifest_path} already exists. Set `overwrite` to True to overwrite."
+                )
 
-        # Write the glb file with geometry
-        self.scene.export(glb_path)
+        # Write the glb file(s) with geometry
+        if self.geometry:
+            if max_tile_features is not None:
+                self.export_tiles(
+                    output_folder,
+                    overwrite=overwrite,
+                    max_features=max_tile_features,
+                    quantization=quantization,
+                    gpu_instancing=gpu_instancing,
+                )
+            elif split_lods:
+                self.export_lods(
+                    output_folder,
+                    quantization=quantization,
+                    gpu_instancing=gpu_instancing,
+                )
+            else:
+                self._write_glb(
+                    self.scene,
+                    geometry_path,
+                    quantization=quantization,
+                    gpu_instancing=gpu_instancing,
+                )
+
+            if len(self.feature_tables) > 0:
+                json_io.dump(self.feature_tables, output_folder / FEATURE_TABLE_NAME)
 
         # Write the CityJSON file with structure and attributes
-        cj_data_copy = deepcopy(self.data)
-        objects: dict[str, dict[str, Any]] = cj_data_copy["CityObjects"]
-        # Remove the geometry
-        for obj in objects.values():
+        self.write_attributes(cj_path)
+        if shard_attributes:
+            self.write_attribute_shards(output_folder, overwrite=overwrite)
+        log_peak_rss("exporting the dual representation")
+
+    def _features_nodes(self) -> list[list[str]]:
+        """
+        Gather the nodes of the scene into features, formed by a root node and all its descendants.
+
+        Returns
+        -------
+        list[list[str]]
+            The names of the nodes of every feature, the root first.
+        """
+        graph = self.scene.graph
+        children = graph.transforms.children
+        features_nodes: list[list[str]] = []
+        for root in children.get(graph.base_frame, []):
+            nodes = [root]
+            # The list grows while it is traversed, so this visits all the descendants
+            for node in nodes:
+                nodes.extend(children.get(node, []))
+            features_nodes.append(nodes)
+        return features_nodes
+
+    def _scene_features(self) -> tuple[list[list[str]], NDArray[np.float64]]:
+        """
+        Gather the nodes of the scene into features, formed by a root node and all its descendants, and compute their bounding boxes.
+
+        Returns
+        -------
+        list[list[str]]
+            The names of the nodes of every feature, the root first.
+        NDArray[np.float64]
+            The 3D bounding boxes (n_features, 6) of the meshes of every feature, as `[min_x, min_y, min_z, max_x, max_y, max_z]`, filled with NaN for the features without mesh.
+        """
+        graph = self.scene.graph
+        node_data = graph.transforms.node_data
+        features_nodes = self._features_nodes()
+        bounds = np.full((len(features_nodes), 6), np.nan, dtype=np.float64)
+        for i, nodes in enumerate(features_nodes):
+            corners = [
+                trimesh.transform_points(
+                    trimesh.bounds.corners(self.scene.geometry[geom_name].bounds),
+                    graph.get(node)[0],
+                )
+                for node in nodes
+                if (geom_name := node_data[node].get("geometry")) is not None
+                and len(self.scene.geometry[geom_name].vertices) > 0
+            ]
+            if len(corners) > 0:
+                points = np.concatenate(corners)
+                bounds[i] = np.concatenate((points.min(axis=0), points.max(axis=0)))
+        return features_nodes, bounds
+
+    def _subscene(self, nodes: list[str]) -> trimesh.Scene:
+        """
+        Extract some nodes of the scene with their geometry into a new scene, keeping their names and transformations.
+
+        Parameters
+        ----------
+        nodes : list[str]
+            The names of the nodes, whose parents must also be extracted unless they are the root of the scene.
+
+        Returns
+        -------
+        trimesh.Scene
+            The new scene, sharing the geometry with the scene.
+        """
+        graph = self.scene.graph
+        parents = graph.transforms.parents
+        edge_data = graph.transforms.edge_data
+        subscene = trimesh.Scene()
+        transforms = subscene.graph.transforms
+        for node in nodes:
+            parent = parents[node]
+            attributes = edge_data[(parent, node)]
+            if parent == graph.base_frame:
+                parent = subscene.graph.base_frame
+            geom_name = attributes.get("geometry")
+            if geom_name is not None:
+                subscene.geometry[geom_name] = self.scene.geometry[geom_name]
+            transforms.add_edge(parent, node, **attributes)
+        return subscene
+
+    def _write_glb(
+        self,
+        scene: trimesh.Scene,
+        glb_path: Path,
+        quantization: str | None = None,
+        gpu_instancing: bool = False,
+    ) -> None:
+        """
+        Write a scene to a glb file, instanced with `EXT_mesh_gpu_instancing` and quantized with `KHR_mesh_quantization` if requested.
+        The meshes are only quantized if the error stays below the scale of the CityJSON vertices, where it is not noticeable, and the file is only quantized if it gets smaller.
+
+        Parameters
+        ----------
+        scene : trimesh.Scene
+            The scene to write.
+        glb_path : Path
+            The path of the glb file.
+        quantization : str | None, optional
+            If given, quantize the positions on a grid fitted to every "mesh" or to the whole "file".
+            By default None.
+        gpu_instancing : bool, optional
+            Whether to draw the meshes shared by several nodes as instances.
+            By default False.
+        """
+        glb = scene.export(file_type="glb")
+        if any(
+            FEATURE_ID_ATTRIBUTE in mesh.vertex_attributes
+            for mesh in scene.geometry.values()
+        ):
+            glb = add_feature_ids(glb)
+        if gpu_instancing:
+            glb, n_instanced = instance_glb(glb)
+            logging.debug(f"Instanced {n_instanced} meshes in {glb_path.name}")
+        if quantization is not None:
+            scale = min(self.data["transform"]["scale"])
+            quantized, max_error = quantize_glb(
+                glb,
+                source_meshes=scene.geometry,
+                per_mesh=quantization == "mesh",
+                max_error=scale,
+            )
+            if len(quantized) < len(glb):
+                logging.debug(
+                    f"Quantized {glb_path.name} from {len(glb)} to {len(quantized)} bytes "
+                    f"({len(quantized) / max(len(glb), 1):.0%}), "
+                    f"with a maximum error of {max_error:.2e} for a CityJSON scale of {scale:.0e}"
+                )
+                glb = quantized
+            else:
+                logging.info(
+                    f"Did not quantize {glb_path.name}, which would not get smaller with an error below the CityJSON scale of {scale:.0e}"
+                )
+        glb_path.write_bytes(glb)
+
+    def export_tiles(
+        self,
+        output_folder: Path,
+        overwrite: bool = False,
+        max_features: int = DEFAULT_MAX_TILE_FEATURES,
+        quantization: str | None = None,
+        gpu_instancing: bool = False,
+    ) -> None:
+        """
+        Write the geometry as spatial tiles, partitioned with a quadtree over the footprints of the features.
+        Every tile is a glb file in `tiles/`, storing whole features with the same node names as `geometry.glb`.
+        They are listed in `tileset.json`, following the layout of a 3D Tiles tileset, with the bounding box and the object ids of every tile.
+
+        Parameters
+        ----------
+        output_folder : Path
+            The path to the folder where the files should be written.
+        overwrite : bool, optional
+            Whether to replace the tiles of a previous export, which are all removed since they may not be part of the new tileset.
+            By default False.
+        max_features : int, optional
+            The maximum number of features in a tile.
+            By default `DEFAULT_MAX_TILE_FEATURES`.
+        quantization : str | None, optional
+            If given, quantize every tile on a grid fitted to every "mesh" or to the whole "file".
+            By default None.
+        gpu_instancing : bool, optional
+            Whether to draw the meshes shared by several nodes of a tile as instances.
+            By default False.
+
+        Raises
+        ------
+        RuntimeError
+            If the folder of the tiles already contains tiles and `overwrite` was not set to True.
+        """
+        tiles_folder = output_folder / TILES_FOLDER_NAME
+        tiles_folder.mkdir(parents=True, exist_ok=True)
+        if not overwrite:
+            _check_no_outputs(tiles_folder, "*.glb")
+        # Remove the tiles of a previous export, which may not be part of the new tileset
+        for old_tile_path in tiles_folder.glob("*.glb"):
+            old_tile_path.unlink()
+
+        features_nodes, bounds = self._scene_features()
+        root = quadtree_tiles(bounds, max_features=max_features)
+
+        objects = self.data["CityObjects"]
+        features_objects = [
+            [node for node in nodes if node in objects] for nodes in features_nodes
+        ]
+        if root is None:
+            logging.warning("No geometry to write in tiles.")
+            manifest: dict[str, Any] = {
+                "asset": {"version": "1.1"},
+                "geometricError": 0.0,
+                "root": {"boundingVolume": {"box": [0.0] * 12}, "geometricError": 0.0},
+            }
+        else:
+            leaves = list(root.leaves())
+            for tile in tqdm(leaves, desc="Writing the tiles"):
+                tile_nodes = [
+                    node
+                    for feature in tile.features
+                    for node in features_nodes[feature]
+                ]
+                self._write_glb(
+                    self._subscene(tile_nodes),
+                    output_folder / tile.content_uri,
+                    quantization=quantization,
+                    gpu_instancing=gpu_instancing,
+                )
+            manifest = tileset(root, features_objects)
+            logging.info(f"Wrote {len(leaves)} tiles to {tiles_folder}")
+        json_io.dump(manifest, output_folder / "tileset.json")
+
+    def export_lods(
+        self,
+        output_folder: Path,
+        quantization: str | None = None,
+        gpu_instancing: bool = False,
+    ) -> None:
+        """
+        Write every LoD of the geometry in its own `geometry-lod_<lod>.glb` file, so that they can be loaded separately.
+        Every file contains the whole hierarchy of the objects, with the same node names as `geometry.glb` but only the meshes of one LoD.
+        They are listed in an index mapping every LoD to its file and number of meshes.
+
+        Parameters
+        ----------
+        output_folder : Path
+            The path to the folder where the files should be written.
+        quantization : str | None, optional
+            If given, quantize every file on a grid fitted to every "mesh" or to the whole "file".
+            By default None.
+        gpu_instancing : bool, optional
+            Whether to draw the meshes shared by several nodes of a file as instances.
+            By default False.
+        """
+        graph = self.scene.graph
+        lod_node_names = {node for nodes in self.lod_nodes.values() for node in nodes}
+        # Object nodes without geometry, in the order of the scene
+        hierarchy_nodes = [
+            node
+            for node in graph.transforms.node_data
+            if node != graph.base_frame and node not in lod_node_names
+        ]
+
+        index: dict[str, Any] = {"lods": {}}
+        for lod, nodes in sorted(self.lod_nodes.items()):
+            lod_path = output_folder / f"geometry-lod_{lod}.glb"
+            self._write_glb(
+                self._subscene(hierarchy_nodes + nodes),
+                lod_path,
+                quantization=quantization,
+                gpu_instancing=gpu_instancing,
+            )
+            index["lods"][lod] = {"uri": lod_path.name, "meshes": len(nodes)}
+            logging.info(f"Wrote {len(nodes)} meshes of LoD {lod} to {lod_path}")
+        json_io.dump(index, output_folder / LODS_INDEX_NAME)
+
+    def write_attributes(self, cj_path: Path) -> None:
+        """
+        Write the CityJSON file storing the structure and the attributes, without any geometry.
+        It is streamed object by object straight from `data`, without copying it.
+
+        Parameters
+        ----------
+        cj_path : Path
+            The path of the CityJSON file.
+        """
+        self._write_cityjson(cj_path, self.data["CityObjects"])
+
+    def _write_cityjson(
+        self, cj_path: Path, objects: dict[str, dict[str, Any]]
+    ) -> None:
+        """
+        Write a CityJSON file with the members of `data` and the given objects, without any geometry.
+        It is the same file as `json.dump` of a copy of `data` without the geometry of the objects and with empty "vertices".
+
+        Parameters
+        ----------
+        cj_path : Path
+            The path of the CityJSON file.
+        objects : dict[str, dict[str, Any]]
+            The CityJSON objects to write, instead of the ones of `data`.
+        """
+        with open(cj_path, "wb") as cj_file:
+            cj_file.write(b"{")
+            first_member = True
+            for key, value in self.data.items():
+                if not first_member:
+                    cj_file.write(json_io.ITEM_SEPARATOR)
+                first_member = False
+                cj_file.write(json_io.dumps_bytes(key))
+                cj_file.write(json_io.KEY_SEPARATOR)
+                if key == "vertices":
+                    cj_file.write(b"[]")
+                elif key == "CityObjects":
+                    self._write_objects(cj_file, objects)
+                else:
+                    cj_file.write(json_io.dumps_bytes(value))
+            cj_file.write(b"}")
+
+    def write_attribute_shards(
+        self, output_folder: Path, overwrite: bool = False
+    ) -> None:
+        """
+        Write the attributes in small CityJSON files, so that a viewer only loads the attributes of the buildings it opens.
+        Every tree of objects (a root object, such as a building or an outdoor unit container, with all its descendants) is written in its own shard `attributes/<index>.city.json`.
+        The index `attributes/index.city.json` contains the root objects, and only the icon position of their descendants that have one.
+        The manifest `attributes-manifest.json` lists the index and the shard of every root object, with its number of objects.
+
+        Parameters
+        ----------
+        output_folder : Path
+            The path to the folder where the files should be written.
+        overwrite : bool, optional
+            Whether to replace the shards of a previous export, which are all removed since they may not be part of the new manifest.
+            By default False.
+
+        Raises
+        ------
+        RuntimeError
+            If the folder of the shards already contains shards and `overwrite` was not set to True.
+        """
+        objects = self.data["CityObjects"]
+        shards_folder = output_folder / SHARDS_FOLDER_NAME
+        shards_folder.mkdir(parents=True, exist_ok=True)
+        if not overwrite:
+            _check_no_outputs(shards_folder, "*.city.json")
+        # Remove the shards of a previous export, which may not be part of the new manifest
+        for old_shard_path in shards_folder.glob("*.city.json"):
+            old_shard_path.unlink()
+
+        icon_name = ARGUMENT_TO_NAME["icon_position"]
+        index_objects: dict[str, dict[str, Any]] = {}
+        manifest: dict[str, Any] = {
+            "index": f"{SHARDS_FOLDER_NAME}/index.city.json",
+            "shards": {},
+        }
+        trees = _object_trees(objects)
+        for i, (root, tree) in enumerate(
+            tqdm(trees.items(), desc="Writing the shards")
+        ):
+            index_objects[root] = objects[root]
+            for obj_key in tree:
+                if obj_key == root:
+                    continue
+                attributes = objects[obj_key].get("attributes", {})
+                if icon_name in attributes:
+                    index_objects[obj_key] = {
+                        "type": objects[obj_key]["type"],
+                        "attributes": {icon_name: attributes[icon_name]},
+                    }
+            shard_uri = f"{SHARDS_FOLDER_NAME}/{i}.city.json"
+            self._write_cityjson(
+                output_folder / shard_uri,
+                {obj_key: objects[obj_key] for obj_key in tree},
+            )
+            manifest["shards"][root] = {"uri": shard_uri, "objects": len(tree)}
+
+        self._write_cityjson(output_folder / manifest["index"], index_objects)
+        json_io.dump(manifest, output_folder / SHARDS_MANIFEST_NAME)
+        logging.info(
+            f"Wrote the attributes of {len(objects)} objects in {len(trees)} shards"
+        )
+
+    @staticmethod
+    def _write_objects(cj_file: BinaryIO, objects: dict[str, dict[str, Any]]) -> None:
+        """
+        Write the CityJSON objects without their geometry, one by one.
+
+        Parameters
+        ----------
+        cj_file : BinaryIO
+            The file to write to.
+        objects : dict[str, dict[str, Any]]
+            The CityJSON objects.
+        """
+        cj_file.write(b"{")
+        for i, (obj_key, obj) in enumerate(objects.items()):
+            if i > 0:
+                cj_file.write(json_io.ITEM_SEPARATOR)
             if "geometry" in obj:
-                obj.pop("geometry")
-        cj_data_copy["vertices"] = []
-        with open(cj_path, "w") as cj_file:
-            json.dump(cj_data_copy, cj_file)
+                # Shallow copy of the other members only
+                obj = {key: value for key, value in obj.items() if key != "geometry"}
+            cj_file.write(json_io.dumps_bytes(obj_key))
+            cj_file.write(json_io.KEY_SEPARATOR)
+            cj_file.write(json_io.dumps_bytes(obj))
+        cj_file.write(b"}")
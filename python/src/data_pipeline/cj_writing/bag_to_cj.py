@@ -4,7 +4,7 @@ Scripts to load 3DBAG building shells and export them to CityJSON after adding c
 
 import logging
 from pathlib import Path
-from typing import Any, Optional
+from typing import Collection, Optional
 
 import numpy as np
 import trimesh
@@ -26,28 +26,30 @@ from data_pipeline.cj_helpers.cj_objects import (
     CityJSONSpace,
     CityJSONSpaceSubclass,
 )
-from data_pipeline.cj_loading.cj_loader import CityjsonLoader, cj_object_to_mesh
+from data_pipeline.cj_loading.cj_loader import DEFAULT_MESH_CACHE_BYTES, CityjsonLoader
 from data_pipeline.utils.geometry_utils import merge_trimeshes, orient_polygons_z_up
-from numpy.typing import NDArray
+from data_pipeline.utils.memory_utils import log_peak_rss
 from tqdm import tqdm
 
+# LoDs of the 3DBAG input, with the LoD of the corresponding output geometry
+BAG_LODS = {"0": 0, "1.3": 1, "2.2": 2}
+
 
 def process_bag_geoms(
-    cj_objects: dict[str, dict[str, Any]],
-    vertices: NDArray[np.float64],
+    loader: CityjsonLoader,
     bag_2d_ids: list[str],
 ) -> tuple[list[MultiSurface], list[str]]:
     """
     Process the geometry of multiple CityJSON objects and combines them into one mesh, for each LoD.
+    Only the LoDs in `loader.lods` are processed, if it was given.
 
     Parameters
     ----------
-    cj_objects : dict[str, dict[str, Any]]
-        The input CityJSON file as a dictionary.
-    vertices : NDArray[np.float64]
-        The vertices correctly transformed to their actual coordinates.
+    loader : CityjsonLoader
+        The loader of the input CityJSON file, used to access the meshes of the objects.
+        The meshes are cached by the loader, so objects shared between buildings are only triangulated once.
     bag_2d_ids : list[str]
-        The IDs of the objects to extract from `cj_objects` and to combine into one mesh.
+        The IDs of the objects to extract from the loader and to combine into one mesh.
 
     Returns
     -------
@@ -59,7 +61,7 @@ def process_bag_geoms(
     Raises
     ------
     RuntimeError
-        If an object from `cj_objects` has no geometry, which is not expected from the
+        If an object from the loader has no geometry, which is not expected from the
         3DBAG.
     """
     # Extract the ids of all the BAG buidlings that constitue this building
@@ -69,28 +71,35 @@ def process_bag_geoms(
         return [], []
 
     # Load all the geometries as Trimesh
-    all_meshes: dict[int, list[trimesh.Trimesh]] = {0: [], 1: [], 2: []}
+    bag_lods = [
+        bag_lod for bag_lod in BAG_LODS if loader.lods is None or bag_lod in loader.lods
+    ]
+    all_meshes: dict[int, list[trimesh.Trimesh]] = {
+        BAG_LODS[bag_lod]: [] for bag_lod in bag_lods
+    }
+    bag_3d_lods = [bag_lod for bag_lod in bag_lods if bag_lod != "0"]
     for bag_2d_id in bag_2d_ids:
         # Extract LoD 0 geometry
-        bag_2d = cj_objects[bag_2d_id]
-        meshes_lods = cj_object_to_mesh(obj_dict=bag_2d, vertices=vertices)
-        if meshes_lods is None:
-            raise RuntimeError(
-                f"An object without geometry is unexpected in the 3DBAG."
-            )
-        all_meshes[0].append(meshes_lods["0"])
+        if "0" in bag_lods:
+            meshes_lods = loader.meshes(bag_2d_id)
+            if meshes_lods is None:
+                raise RuntimeError(
+                    f"An object without geometry is unexpected in the 3DBAG."
+                )
+            all_meshes[0].append(meshes_lods["0"])
 
         # Process the children
-        for bag_3d_id in bag_2d["children"]:
+        for bag_3d_id in loader.data["CityObjects"][bag_2d_id]["children"]:
             bag_3d_ids.append(bag_3d_id)
-            obj_3d = cj_objects[bag_3d_id]
-            meshes_lods = cj_object_to_mesh(obj_dict=obj_3d, vertices=vertices)
+            if len(bag_3d_lods) == 0:
+                continue
+            meshes_lods = loader.meshes(bag_3d_id)
             if meshes_lods is None:
                 raise RuntimeError(
                     f"An object without geometry is unexpected in the 3DBAG."
                 )
-            all_meshes[1].append(meshes_lods["1.3"])
-            all_meshes[2].append(meshes_lods["2.2"])
+            for bag_lod in bag_3d_lods:
+                all_meshes[BAG_LODS[bag_lod]].append(meshes_lods[bag_lod])
 
     # Merge all the meshes at the same LoD
     final_meshes: dict[int, trimesh.Trimesh] = {}
@@ -106,10 +115,10 @@ def process_bag_geoms(
     # all_geoms.append(MultiSurface.from_mesh(lod=0, mesh=lod_0_mesh))
 
     # Add the other geoms
-    orient_polygons_z_up(final_meshes[0])
-    all_geoms.append(MultiSurface.from_mesh(lod=0, mesh=final_meshes[0]))
-    all_geoms.append(MultiSurface.from_mesh(lod=1, mesh=final_meshes[1]))
-    all_geoms.append(MultiSurface.from_mesh(lod=2, mesh=final_meshes[2]))
+    if 0 in final_meshes:
+        orient_polygons_z_up(final_meshes[0])
+    for lod, final_mesh in final_meshes.items():
+        all_geoms.append(MultiSurface.from_mesh(lod=lod, mesh=final_mesh))
 
     return (all_geoms, bag_2d_ids + bag_3d_ids)
 
@@ -117,6 +126,8 @@ def process_bag_geoms(
 class Bag2Cityjson(CityjsonLoader):
     """
     Class to process the 3DBAG building shells and combine them with attributes.
+    The input can be a CityJSON file or a CityJSONSeq file, in which case each 3DBAG building is read from the file only when it is processed.
+    If `lods` is given, only these 3DBAG LoDs (among "0", "1.3" and "2.2") are processed and exported.
     """
 
     def __init__(
@@ -124,13 +135,28 @@ class Bag2Cityjson(CityjsonLoader):
         cj_path: Path,
         bdgs_attr_path: Optional[Path],
         bdgs_sub_attr_path: Optional[Path],
+        vertex_cache: bool = False,
+        mesh_cache_bytes: int = DEFAULT_MESH_CACHE_BYTES,
+        lods: Collection[str] | None = None,
+        low_memory: bool = False,
     ) -> None:
-        super().__init__(cj_path)
+        if lods is not None and not set(lods).issubset(BAG_LODS):
+            raise ValueError(
+                f"Unexpected LoDs {sorted(set(lods) - set(BAG_LODS))}, the 3DBAG LoDs are {list(BAG_LODS)}."
+            )
+        super().__init__(
+            cj_path,
+            vertex_cache=vertex_cache,
+            mesh_cache_bytes=mesh_cache_bytes,
+            lods=lods,
+            low_memory=low_memory,
+        )
 
         self.cj_file = self._connect_buildings_attributes(
             bdgs_attr_path=bdgs_attr_path,
             bdgs_sub_attr_path=bdgs_sub_attr_path,
         )
+        log_peak_rss("processing the 3DBAG buildings")
 
     def _connect_buildings_attributes(
         self,
@@ -185,8 +211,7 @@ class Bag2Cityjson(CityjsonLoader):
                 return
 
             all_geoms, processed_bag_ids = process_bag_geoms(
-                cj_objects=self.data["CityObjects"],
-                vertices=self.vertices,
+                loader=self,
                 bag_2d_ids=bag_ids,
             )
 
@@ -308,6 +333,8 @@ class Bag2Cityjson(CityjsonLoader):
                 )
                 all_objects_cj[obj_key] = building
 
+        logging.info(f"Mesh cache after processing the buildings: {self.mesh_cache}")
+
         cj_file = CityJSONFile(
             scale=np.array([0.00001, 0.00001, 0.00001], dtype=np.float64),
             translate=np.array([0, 0, 0], dtype=np.float64),
@@ -331,5 +358,6 @@ class Bag2Cityjson(CityjsonLoader):
         # Write to CityJSON
         output_cj_path.parent.mkdir(parents=True, exist_ok=True)
         file_json = self.cj_file.to_json()
-        with open(output_cj_path, "w") as f:
+        with open(output_cj_path, "w", encoding="utf-8") as f:
             f.write(file_json)
+        log_peak_rss("exporting the CityJSON file")
@@ -2,7 +2,6 @@
 Scripts to load icons from GeoJSON and export them to CityJSON.
 """
 
-import json
 from collections import defaultdict
 from pathlib import Path
 from pprint import pprint
@@ -16,6 +15,7 @@ from data_pipeline.cj_helpers.cj_objects import (
     OutdoorUnit,
     OutdoorUnitContainer,
 )
+from data_pipeline.utils import json_io
 from data_pipeline.utils.csv_utils import csv_get_row_value
 from data_pipeline.utils.icon_positions import IconPosition
 
@@ -42,8 +42,7 @@ def load_geojson_icons(gj_path: Path, output_cj_path: Path):
     NotImplementedError
         If a feature is not a Point.
     """
-    with open(gj_path) as gj_file:
-        gj_data: dict[str, Any] = json.load(gj_file)
+    gj_data: dict[str, Any] = json_io.load(gj_path)
     if gj_data.get("type", "") != "FeatureCollection":
         raise NotImplementedError(
             f"Only 'FeatureCollection' is supported for now, not '{gj_data.get("type", "")}'"
@@ -137,5 +136,5 @@ def load_geojson_icons(gj_path: Path, output_cj_path: Path):
     # Write to CityJSON
     output_cj_path.parent.mkdir(parents=True, exist_ok=True)
     file_json = cj_file.to_json()
-    with open(output_cj_path, "w") as f:
+    with open(output_cj_path, "w", encoding="utf-8") as f:
         f.write(file_json)
@@ -8,7 +8,6 @@ More information about the CLI can be obtained with:
 """
 
 import logging
-import subprocess
 from pathlib import Path
 from typing import Annotated, List, Mapping, Optional
 
@@ -30,26 +29,93 @@ from data_pipeline.cj_helpers.cj_objects import (
     BuildingStorey,
     CityJSONSpace,
 )
-from data_pipeline.cj_loading.cj_to_gltf import Cityjson2Gltf
+from data_pipeline.cj_loading.cj_loader import DEFAULT_MESH_CACHE_BYTES
+from data_pipeline.cj_loading.cj_subset import CityjsonSubset, load_geojson_polygon
+from data_pipeline.cj_loading.cj_tiles import DEFAULT_MAX_TILE_FEATURES
+from data_pipeline.cj_loading.cj_to_gltf import (
+    BATCH_GROUPS,
+    QUANTIZATION_MODES,
+    Cityjson2Gltf,
+)
 from data_pipeline.cj_writing.bag_to_cj import Bag2Cityjson
 from data_pipeline.cj_writing.gj_to_cj import load_geojson_icons
 from data_pipeline.cj_writing.gltf_to_cj import (
     full_building_from_gltf,
     load_units_from_csv,
 )
+from data_pipeline.utils import json_io, triangulation_cache
 from data_pipeline.utils.codelists import format_codelist_json
+from data_pipeline.utils.mesh_simplification import DEFAULT_MAX_FACES
 from tqdm.contrib.logging import logging_redirect_tqdm
 
 app = typer.Typer()
 
 
+@app.callback()
+def main(
+    json_backend: Annotated[
+        str,
+        typer.Option(
+            "--json-backend",
+            help=f"JSON library used to parse all the files: 'auto' or one of {', '.join(json_io.BACKENDS)}.",
+        ),
+    ] = "auto",
+    use_triangulation_cache: Annotated[
+        bool,
+        typer.Option(
+            "--triangulation-cache/--no-triangulation-cache",
+            help="Reuse the triangulations of the surfaces computed in the previous runs, stored in a cache file (by default ~/.cache/data-pipeline/triangulations.sqlite, or under $XDG_CACHE_HOME).",
+        ),
+    ] = False,
+    triangulation_cache_path: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--triangulation-cache-path",
+            help="Path of the cache file of the triangulations, used with --triangulation-cache.",
+        ),
+    ] = None,
+    triangulation_cache_mb: Annotated[
+        int,
+        typer.Option(
+            "--triangulation-cache-mb",
+            help="Maximum size in MB of the triangulations stored in the cache file.",
+        ),
+    ] = triangulation_cache.DEFAULT_MAX_BYTES
+    // 1024**2,
+):
+    """
+    Options shared by all the commands.
+
+    Parameters
+    ----------
+    json_backend : str, optional
+        JSON library used to parse all the files, which are always written in the layout of the standard library: 'auto' (the fastest installed) or one of `json_io.BACKENDS`. By default 'auto'.
+    use_triangulation_cache : bool, optional
+        Reuse the triangulations of the surfaces computed in the previous runs, stored in a cache file (see `triangulation_cache.default_cache_path`). By default False, so that nothing is written outside of the outputs.
+    triangulation_cache_path : Optional[Path], optional
+        Path of the cache file of the triangulations, used with `use_triangulation_cache`. By default None, to use `triangulation_cache.default_cache_path()`.
+    triangulation_cache_mb : int, optional
+        Maximum size in MB of the triangulations stored in the cache file. By default 1024.
+    """
+    json_io.set_backend(json_backend)
+    if use_triangulation_cache:
+        triangulation_cache.enable(
+            path=triangulation_cache_path,
+            max_bytes=triangulation_cache_mb * 1024**2,
+        )
+
+
 @app.command(
     "load_3dbag",
     help="Load 3DBAG geometries and combines it with given attributes to export a properly formatted CityJSON file.",
 )
 def load_3dbag(
     input_cj_path: Annotated[
-        Path, typer.Argument(help="Input CityJSON file with 3DBAG data.", exists=True)
+        Path,
+        typer.Argument(
+            help="Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file with 3DBAG data.",
+            exists=True,
+        ),
     ],
     output_cj_path: Annotated[Path, typer.Argument(help="Output CityJSON path.")],
     bdgs_attr_path: Annotated[
@@ -78,6 +144,35 @@ def load_3dbag(
             help="Overwrite the output file if the file already exists.",
         ),
     ] = False,
+    vertex_cache: Annotated[
+        bool,
+        typer.Option(
+            "--vertex-cache",
+            help="Cache the decoded vertices in a sidecar .npy file next to the input, and reuse it in the next runs on the same input.",
+        ),
+    ] = False,
+    mesh_cache_mb: Annotated[
+        int,
+        typer.Option(
+            "--mesh-cache-mb",
+            help="Memory budget in MB of the cache storing the meshes of the input objects. Disabled by default.",
+        ),
+    ] = DEFAULT_MESH_CACHE_BYTES
+    // 1024**2,
+    lods: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--lod",
+            help="3DBAG LoD to process (0, 1.3 or 2.2), can be repeated. All of them by default.",
+        ),
+    ] = None,
+    low_memory: Annotated[
+        bool,
+        typer.Option(
+            "--low-memory",
+            help="Free the input data as soon as it is converted, to reduce the peak memory usage.",
+        ),
+    ] = False,
     verbose: Annotated[
         int,
         typer.Option(
@@ -94,7 +189,7 @@ def load_3dbag(
     Parameters
     ----------
     input_cj_path : Path
-        Input CityJSON file with 3DBAG data.
+        Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file with 3DBAG data.
     output_cj_path : Path
         Output CityJSON path.
     bdgs_attr_path : Optional[Path], optional
@@ -103,6 +198,14 @@ def load_3dbag(
         CSV path with the buildings subdivisions attributes. By default None.
     overwrite : bool, optional
         Overwrite the output file if the file already exists. By default False.
+    vertex_cache : bool, optional
+        Cache the decoded vertices in a sidecar .npy file next to the input, and reuse it in the next runs on the same input. By default False.
+    mesh_cache_mb : int, optional
+        Memory budget in MB of the cache storing the meshes of the input objects. By default 0, for no cache.
+    lods : Optional[List[str]], optional
+        3DBAG LoD to process (0, 1.3 or 2.2), can be repeated. By default None, for all of them.
+    low_memory : bool, optional
+        Free the input data as soon as it is converted, to reduce the peak memory usage. By default False.
     verbose : int, optional
         How much information to provide during the execution of the script. By default 0.
 
@@ -127,6 +230,10 @@ def load_3dbag(
             cj_path=input_cj_path,
             bdgs_attr_path=bdgs_attr_path,
             bdgs_sub_attr_path=bdgs_sub_attr_path,
+            vertex_cache=vertex_cache,
+            mesh_cache_bytes=mesh_cache_mb * 1024**2,
+            lods=lods,
+            low_memory=low_memory,
         )
         cj_bag_data.export(output_cj_path)
 
@@ -331,7 +438,7 @@ def load_custom_building(
         # Write to CityJSON
         file_json = cj_file.to_json()
         output_cj_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(Path(output_cj_path), "w") as f:
+        with open(Path(output_cj_path), "w", encoding="utf-8") as f:
             f.write(file_json)
 
 
@@ -368,7 +475,11 @@ def load_outdoor(
 )
 def split_cj(
     input_cj_path: Annotated[
-        Path, typer.Argument(help="Input CityJSON file", exists=True)
+        Path,
+        typer.Argument(
+            help="Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file.",
+            exists=True,
+        ),
     ],
     output_folder_path: Annotated[Path, typer.Argument(help="Output folder")],
     overwrite: Annotated[
@@ -379,6 +490,138 @@ def split_cj(
             help="Overwrite the content of the folder if files with the same names exist.",
         ),
     ] = False,
+    vertex_cache: Annotated[
+        bool,
+        typer.Option(
+            "--vertex-cache",
+            help="Cache the decoded vertices in a sidecar .npy file next to the input, and reuse it in the next runs on the same input.",
+        ),
+    ] = False,
+    mesh_cache_mb: Annotated[
+        int,
+        typer.Option(
+            "--mesh-cache-mb",
+            help="Memory budget in MB of the cache storing the meshes of the input objects. Disabled by default.",
+        ),
+    ] = DEFAULT_MESH_CACHE_BYTES
+    // 1024**2,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers",
+            "-w",
+            min=1,
+            help="Number of processes converting the geometry to glTF meshes.",
+        ),
+    ] = 1,
+    lods: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--lod",
+            help="LoD to convert to glTF, as written in the CityJSON file (for example 2.2), can be repeated. All of them by default.",
+        ),
+    ] = None,
+    low_memory: Annotated[
+        bool,
+        typer.Option(
+            "--low-memory",
+            help="Free the input data as soon as it is converted, to reduce the peak memory usage.",
+        ),
+    ] = False,
+    attributes_only: Annotated[
+        bool,
+        typer.Option(
+            "--attributes-only",
+            help="Only write the CityJSON file with the attributes, without loading the geometry.",
+        ),
+    ] = False,
+    tiles: Annotated[
+        bool,
+        typer.Option(
+            "--tiles",
+            help="Split the geometry into spatial tiles listed in tileset.json, instead of a single geometry.glb.",
+        ),
+    ] = False,
+    tile_max_features: Annotated[
+        int,
+        typer.Option(
+            "--tile-max-features",
+            min=1,
+            help="Maximum number of features (root objects with their descendants) in a tile.",
+        ),
+    ] = DEFAULT_MAX_TILE_FEATURES,
+    split_lods: Annotated[
+        bool,
+        typer.Option(
+            "--split-lods",
+            help="Write every LoD in its own geometry-lod_<lod>.glb, listed in geometry-lods.json, instead of a single geometry.glb.",
+        ),
+    ] = False,
+    optimize_meshes: Annotated[
+        bool,
+        typer.Option(
+            "--optimize-meshes",
+            help="Reorder the triangles and vertices of the meshes for the vertex cache of the GPU, and log the ACMR before and after.",
+        ),
+    ] = False,
+    far_lod: Annotated[
+        bool,
+        typer.Option(
+            "--far-lod",
+            help="Add a simplified LoD 'far' to every building, stored as <cityjson_key>-lod_far.",
+        ),
+    ] = False,
+    far_max_faces: Annotated[
+        int,
+        typer.Option(
+            "--far-max-faces",
+            min=1,
+            help="Number of triangles of the far LoD of every building.",
+        ),
+    ] = DEFAULT_MAX_FACES,
+    far_max_error: Annotated[
+        Optional[float],
+        typer.Option(
+            "--far-max-error",
+            min=0,
+            help="Maximum error in meters of the far LoD, which keeps more triangles than --far-max-faces if needed. Not bounded by default.",
+        ),
+    ] = None,
+    far_source_lod: Annotated[
+        Optional[str],
+        typer.Option(
+            "--far-source-lod",
+            help="LoD simplified into the far LoD, as written in the CityJSON file (for example 2.2). The most detailed LoD of every building by default.",
+        ),
+    ] = None,
+    batch: Annotated[
+        Optional[str],
+        typer.Option(
+            "--batch",
+            help="Merge the meshes of every 'building' or 'storey' into one mesh per LoD, with the feature id of every object listed in feature-ids.json. Not batched by default.",
+        ),
+    ] = None,
+    gpu_instancing: Annotated[
+        bool,
+        typer.Option(
+            "--gpu-instancing",
+            help="Share the meshes that are translated copies of each other, and draw them with EXT_mesh_gpu_instancing.",
+        ),
+    ] = False,
+    quantize: Annotated[
+        Optional[str],
+        typer.Option(
+            "--quantize",
+            help="Quantize the glb files with KHR_mesh_quantization, on a grid fitted to every 'mesh' or to every 'file'. Not quantized by default.",
+        ),
+    ] = None,
+    shard_attributes: Annotated[
+        bool,
+        typer.Option(
+            "--shard-attributes",
+            help="Also write the attributes of every building in its own file in attributes/, with a light index and attributes-manifest.json, to load them lazily.",
+        ),
+    ] = False,
     verbose: Annotated[
         int,
         typer.Option(
@@ -395,19 +638,65 @@ def split_cj(
     Parameters
     ----------
     input_cj_path : Path
-        Input CityJSON file.
+        Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file.
     output_folder_path : Path
         Output folder.
     overwrite : bool, optional
         Overwrite the content of the folder if files with the same names exist. By default False.
+    vertex_cache : bool, optional
+        Cache the decoded vertices in a sidecar .npy file next to the input, and reuse it in the next runs on the same input. By default False.
+    mesh_cache_mb : int, optional
+        Memory budget in MB of the cache storing the meshes of the input objects. By default 0, for no cache.
+    workers : int, optional
+        Number of processes converting the geometry to glTF meshes. By default 1.
+    lods : Optional[List[str]], optional
+        LoD to convert to glTF, as written in the CityJSON file (for example 2.2), can be repeated. By default None, for all of them.
+    low_memory : bool, optional
+        Free the input data as soon as it is converted, to reduce the peak memory usage. By default False.
+    attributes_only : bool, optional
+        Only write the CityJSON file with the attributes, without loading the geometry. By default False.
+    tiles : bool, optional
+        Split the geometry into spatial tiles listed in tileset.json, instead of a single geometry.glb. By default False.
+    tile_max_features : int, optional
+        Maximum number of features (root objects with their descendants) in a tile. By default 256.
+    split_lods : bool, optional
+        Write every LoD in its own geometry-lod_<lod>.glb, listed in geometry-lods.json, instead of a single geometry.glb. By default False.
+    optimize_meshes : bool, optional
+        Reorder the triangles and vertices of the meshes for the vertex cache of the GPU, and log the ACMR before and after. By default False.
+    far_lod : bool, optional
+        Add a simplified LoD 'far' to every building, stored as <cityjson_key>-lod_far. By default False.
+    far_max_faces : int, optional
+        Number of triangles of the far LoD of every building. By default 128.
+    far_max_error : Optional[float], optional
+        Maximum error in meters of the far LoD, which keeps more triangles than `far_max_faces` if needed. By default None, for no bound.
+    far_source_lod : Optional[str], optional
+        LoD simplified into the far LoD, as written in the CityJSON file (for example 2.2). By default None, for the most detailed LoD of every building.
+    batch : Optional[str], optional
+        Merge the meshes of every 'building' or 'storey' into one mesh per LoD, with the feature id of every object listed in feature-ids.json. By default None, for no batching.
+    gpu_instancing : bool, optional
+        Share the meshes that are translated copies of each other, and draw them with EXT_mesh_gpu_instancing. By default False.
+    quantize : Optional[str], optional
+        Quantize the glb files with KHR_mesh_quantization, on a grid fitted to every 'mesh' or to every 'file'. By default None, for no quantization.
+    shard_attributes : bool, optional
+        Also write the attributes of every building in its own file in attributes/, with a light index and attributes-manifest.json, to load them lazily. By default False.
     verbose : int, optional
         How much information to provide during the execution of the script. By default 0.
 
     Raises
     ------
+    ValueError
+        If both `tiles` and `split_lods` are set, or if `batch` or `quantize` is unknown.
     RuntimeError
         If `overwrite` is set to False but the output folder already exists.
     """
+    if tiles and split_lods:
+        raise ValueError("The geometry cannot be split both in tiles and in LoDs.")
+    if batch is not None and batch not in BATCH_GROUPS:
+        raise ValueError(f"Unknown batch {batch}, expected one of {BATCH_GROUPS}.")
+    if quantize is not None and quantize not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"Unknown quantization {quantize}, expected one of {QUANTIZATION_MODES}."
+        )
     if output_folder_path.exists() and not overwrite:
         raise RuntimeError(
             f"Path '{output_folder_path.absolute()}' already exists but `overwrite` was set to False."
@@ -417,58 +706,130 @@ def split_cj(
     with logging_redirect_tqdm():
         output_folder_path.mkdir(parents=True, exist_ok=overwrite)
 
-        cj_data = Cityjson2Gltf(input_cj_path)
-        cj_data.make_gltf_scene()
-        cj_data.export(output_folder_path, overwrite=overwrite)
+        cj_data = Cityjson2Gltf(
+            input_cj_path,
+            vertex_cache=vertex_cache,
+            mesh_cache_bytes=mesh_cache_mb * 1024**2,
+            geometry=not attributes_only,
+            lods=lods,
+            low_memory=low_memory,
+        )
+        if not attributes_only:
+            cj_data.make_gltf_scene(workers=workers)
+            if far_lod:
+                cj_data.add_far_lod(
+                    max_faces=far_max_faces,
+                    max_error=far_max_error,
+                    source_lod=far_source_lod,
+                )
+            if batch is not None:
+                cj_data.batch_meshes(group=batch)
+            if gpu_instancing:
+                cj_data.deduplicate_meshes()
+            if optimize_meshes:
+                cj_data.optimize_meshes()
+        cj_data.export(
+            output_folder_path,
+            overwrite=overwrite,
+            max_tile_features=tile_max_features if tiles else None,
+            split_lods=split_lods,
+            quantization=quantize,
+            gpu_instancing=gpu_instancing,
+            shard_attributes=shard_attributes,
+        )
 
 
 @app.command(
     "subset_cj",
-    help="Create a subset of a CityJSON file based on a list of identifiers in the file.",
+    help="Create a subset of a CityJSON file based on a list of identifiers in the file and/or an area, with the children and parents of the selected objects.",
 )
 def subset_cj(
     input_cj_path: Annotated[
-        Path, typer.Argument(help="Input CityJSON path.", exists=True)
+        Path,
+        typer.Argument(
+            help="Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file.",
+            exists=True,
+        ),
     ],
     output_cj_path: Annotated[Path, typer.Argument(help="Output CityJSON path.")],
     subset_txt_path: Annotated[
-        Path,
+        Optional[Path],
         typer.Argument(
             help="Text path containing the object ids to keep, separated with new lines.",
+            exists=True,
         ),
-    ],
+    ] = None,
+    bbox: Annotated[
+        Optional[tuple[float, float, float, float]],
+        typer.Option(
+            "--bbox",
+            help="Also keep the objects intersecting this 2D bounding box, given as 'min_x min_y max_x max_y' in the coordinates of the file.",
+        ),
+    ] = None,
+    polygon_path: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--polygon",
+            help="Also keep the objects intersecting the polygons of this GeoJSON file, in the coordinates of the file.",
+            exists=True,
+        ),
+    ] = None,
+    verbose: Annotated[
+        int,
+        typer.Option(
+            "--verbose",
+            "-v",
+            count=True,
+            help="How much information to provide during the execution of the script.",
+        ),
+    ] = 0,
 ):
     """
-    Create a subset of a CityJSON file based on a list of identifiers in the file.
+    Create a subset of a CityJSON file based on a list of identifiers in the file and/or an area, with the children and parents of the selected objects.
+    Only the vertices used by the selected objects are kept.
 
     Parameters
     ----------
     input_cj_path : Path
-        Input CityJSON path.
+        Input CityJSON (.city.json) or CityJSONSeq (.city.jsonl) file.
     output_cj_path : Path
         Output CityJSON path.
-    subset_txt_path : Path
-        Text path containing the object ids to keep, separated with new lines.
+    subset_txt_path : Optional[Path], optional
+        Text path containing the object ids to keep, separated with new lines. By default None.
+    bbox : Optional[tuple[float, float, float, float]], optional
+        Also keep the objects intersecting this 2D bounding box, given as 'min_x min_y max_x max_y' in the coordinates of the file. By default None.
+    polygon_path : Optional[Path], optional
+        Also keep the objects intersecting the polygons of this GeoJSON file, in the coordinates of the file. By default None.
+    verbose : int, optional
+        How much information to provide during the execution of the script. By default 0.
 
     Raises
     ------
-    ValueError
-        If the input path does not end with '.json'.
     ValueError
         If the output path does not end with '.json'.
+    ValueError
+        If no ids, bounding box or polygon is given.
     """
-    if not input_cj_path.suffix == ".json":
-        raise ValueError("The input path should end with '.json'")
     if not output_cj_path.suffix == ".json":
         raise ValueError("The output path should end with '.json'")
+    if subset_txt_path is None and bbox is None and polygon_path is None:
+        raise ValueError("Give a file with ids, a bounding box or a polygon.")
 
-    command = ["cjio", str(input_cj_path.absolute()), "subset"]
-    with open(subset_txt_path) as f:
-        for obj_key_line in f.readlines():
-            obj_key = obj_key_line.strip()
-            command.extend(["--id", obj_key])
-    command.extend(["save", str(output_cj_path.absolute())])
-    subprocess.run(command)
+    setup_logging(verbose=verbose)
+    with logging_redirect_tqdm():
+        obj_ids: list[str] = []
+        if subset_txt_path is not None:
+            with open(subset_txt_path) as f:
+                obj_ids = [line.strip() for line in f if len(line.strip()) > 0]
+
+        polygon = None
+        if polygon_path is not None:
+            polygon = load_geojson_polygon(polygon_path)
+
+        cj_subset = CityjsonSubset(input_cj_path)
+        selected_ids = cj_subset.select(obj_ids=obj_ids, bbox=bbox, polygon=polygon)
+        logging.info(f"Selected {len(selected_ids)} objects")
+        cj_subset.export(output_cj_path, selected_ids)
 
 
 @app.command(
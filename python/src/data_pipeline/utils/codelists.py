@@ -2,10 +2,10 @@
 Format the usage codelist into a convenient JSON file for the JavaScript app.
 """
 
-import json
 from collections import defaultdict
 from pathlib import Path
 
+from data_pipeline.utils import json_io
 from data_pipeline.utils.csv_utils import csv_read_attributes
 
 
@@ -52,5 +52,4 @@ def format_codelist_json(input_csv_path: Path, output_json_path: Path):
         codes_attributes[code]["Implied by"] = codes_implied_by[code]
 
     output_json_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_json_path, "w") as f:
-        f.write(json.dumps(codes_attributes))
+    json_io.dump(codes_attributes, output_json_path)
@@ -12,6 +12,7 @@ import shapely
 import shapely.geometry as sg
 import triangle as tri
 import trimesh
+from data_pipeline.utils import triangulation_cache
 from data_pipeline.utils.plane import Plane3D
 from numpy.typing import NDArray
 from shapely import LineString, MultiPolygon, Polygon
@@ -186,15 +187,112 @@ def merge_trimeshes(
         logging.debug("Empty!")
         return full_mesh
     if fix_geometry:
-        full_mesh.process(validate=True)
-        full_mesh.update_faces(full_mesh.unique_faces())
-        full_mesh.fix_normals()
-        full_mesh.fill_holes()
+        fix_trimesh(full_mesh)
     else:
         full_mesh.process()
     return full_mesh
 
 
+def fix_trimesh(mesh: trimesh.Trimesh) -> None:
+    """
+    Apply different operations to fix the mesh: merge the duplicate vertices, remove the degenerate and duplicate faces, orient the faces consistently and fill the holes.
+
+    Warning
+    -------
+    This function modifies the mesh directly.
+
+    Parameters
+    ----------
+    mesh : trimesh.Trimesh
+        The mesh to fix.
+    """
+    mesh.process(validate=True)
+    mesh.update_faces(mesh.unique_faces())
+    mesh.fix_normals()
+    mesh.fill_holes()
+
+
+class MeshAssembler:
+    """
+    Accumulate the vertices and faces of many small meshes into growing arrays, to build a single Trimesh at the end.
+    This avoids creating and merging one Trimesh per surface.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        """
+        Create an empty assembler.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            The initial number of vertices and faces that can be stored before growing the arrays.
+            By default 64.
+        """
+        self._vertices = np.empty((capacity, 3), dtype=np.float64)
+        self._faces = np.empty((capacity, 3), dtype=np.int64)
+        self.n_vertices = 0
+        self.n_faces = 0
+
+    @staticmethod
+    def _grow(buffer: NDArray, required: int) -> NDArray:
+        if required <= buffer.shape[0]:
+            return buffer
+        new_buffer = np.empty(
+            (max(required, 2 * buffer.shape[0]), buffer.shape[1]), dtype=buffer.dtype
+        )
+        new_buffer[: buffer.shape[0]] = buffer
+        return new_buffer
+
+    def add(self, vertices: NDArray[np.float64], faces: NDArray[np.int64]) -> None:
+        """
+        Append a mesh to the assembler.
+
+        Parameters
+        ----------
+        vertices : NDArray[np.float64]
+            The vertices (N, 3) of the mesh.
+        faces : NDArray[np.int64]
+            The triangles (M, 3) of the mesh, referring to `vertices`.
+        """
+        n_vertices = vertices.shape[0]
+        n_faces = faces.shape[0]
+        self._vertices = self._grow(self._vertices, self.n_vertices + n_vertices)
+        self._faces = self._grow(self._faces, self.n_faces + n_faces)
+        self._vertices[self.n_vertices : self.n_vertices + n_vertices] = vertices
+        self._faces[self.n_faces : self.n_faces + n_faces] = faces + self.n_vertices
+        self.n_vertices += n_vertices
+        self.n_faces += n_faces
+
+    def to_trimesh(self, fix_geometry: bool) -> trimesh.Trimesh:
+        """
+        Build a single Trimesh with everything that was added.
+        Optionally fix the geometry of the final mesh, once for all the added meshes.
+
+        Parameters
+        ----------
+        fix_geometry : bool
+            Whether to apply different operations to fix the mesh.
+
+        Returns
+        -------
+        trimesh.Trimesh
+            The assembled mesh.
+        """
+        mesh = trimesh.Trimesh(
+            vertices=self._vertices[: self.n_vertices].copy(),
+            faces=self._faces[: self.n_faces].copy(),
+            process=False,
+        )
+        if mesh.is_empty:
+            logging.debug("Empty!")
+            return mesh
+        if fix_geometry:
+            fix_trimesh(mesh)
+        else:
+            mesh.process()
+        return mesh
+
+
 # def cleanup_vertices(
 #     boundaries: list[NDArray[np.int64]],
 #     vertices: NDArray[np.float64],
@@ -392,6 +490,160 @@ def triangulate_polygon_2d(
     return tri_vertices, tri_faces, True
 
 
+def select_rings(
+    ring_indices: NDArray[np.int64],
+    ring_offsets: NDArray[np.int64],
+    mask: NDArray[np.bool_],
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """
+    Select a subset of rings stored in flat arrays.
+
+    Parameters
+    ----------
+    ring_indices : NDArray[np.int64]
+        The vertex indices of all the rings, one ring after the other.
+    ring_offsets : NDArray[np.int64]
+        The offsets (R + 1,) of the rings in `ring_indices`.
+    mask : NDArray[np.bool_]
+        The mask (R,) of the rings to keep.
+
+    Returns
+    -------
+    NDArray[np.int64]
+        The vertex indices of the selected rings.
+    NDArray[np.int64]
+        The offsets of the selected rings.
+    """
+    lengths = np.diff(ring_offsets)
+    new_offsets = np.concatenate(([0], np.cumsum(lengths[mask])))
+    return ring_indices[np.repeat(mask, lengths)], new_offsets
+
+
+def classify_convex_planar_rings(
+    ring_indices: NDArray[np.int64],
+    ring_offsets: NDArray[np.int64],
+    vertices: NDArray[np.float64],
+    planarity_tolerance: float = 1e-3,
+) -> NDArray[np.bool_]:
+    """
+    Find, in a vectorized way, the rings that are planar, strictly convex and simple, and can therefore be fan-triangulated.
+    Rings with repeated consecutive vertices, collinear points or self-intersections are rejected.
+
+    Parameters
+    ----------
+    ring_indices : NDArray[np.int64]
+        The vertex indices of all the rings, one ring after the other, without repeating the first vertex.
+    ring_offsets : NDArray[np.int64]
+        The offsets (R + 1,) of the rings in `ring_indices`.
+    vertices : NDArray[np.float64]
+        The vertices (N, 3) that the rings refer to.
+    planarity_tolerance : float, optional
+        The maximum distance of a vertex to the plane of its ring.
+        By default 1e-3.
+
+    Returns
+    -------
+    NDArray[np.bool_]
+        The mask (R,) of the rings that are convex and planar.
+    """
+    n_rings = ring_offsets.shape[0] - 1
+    if n_rings == 0:
+        return np.zeros(0, dtype=np.bool_)
+    lengths = np.diff(ring_offsets)
+    valid = lengths >= 3
+    # Empty rings are removed to be able to use `reduceat`
+    non_empty = lengths > 0
+    starts = ring_offsets[:-1][non_empty]
+    n_points = ring_indices.shape[0]
+    if n_points == 0:
+        return np.zeros(n_rings, dtype=np.bool_)
+
+    # Centre every ring on its centroid for numerical stability
+    points = vertices[ring_indices]
+    ring_ids = np.repeat(np.arange(n_rings), lengths)
+    centroids = np.zeros((n_rings, 3), dtype=np.float64)
+    centroids[non_empty] = np.add.reduceat(points, starts, axis=0)
+    centroids[non_empty] /= lengths[non_empty, None]
+    points = points - centroids[ring_ids]
+
+    # Previous and next point of every point in its ring
+    positions = np.arange(n_points)
+    next_positions = positions + 1
+    next_positions[ring_offsets[1:][non_empty] - 1] = starts
+    prev_positions = positions - 1
+    prev_positions[starts] = ring_offsets[1:][non_empty] - 1
+    points_next = points[next_positions]
+
+    # Newell normal of every ring
+    normals = np.zeros((n_rings, 3), dtype=np.float64)
+    normals[non_empty] = np.add.reduceat(np.cross(points, points_next), starts, axis=0)
+    normals_norm = np.linalg.norm(normals, axis=1)
+    valid &= normals_norm > 1e-12
+    normals[valid] /= normals_norm[valid, None]
+    point_normals = normals[ring_ids]
+
+    # Planarity: every point must be close to the plane of its ring
+    distances = np.abs(np.einsum("ij,ij->i", points, point_normals))
+    max_distances = np.zeros(n_rings, dtype=np.float64)
+    max_distances[non_empty] = np.maximum.reduceat(distances, starts)
+    valid &= max_distances <= planarity_tolerance
+
+    # Convexity: every turn must go in the direction of the normal
+    edges_in = points - points[prev_positions]
+    edges_out = points_next - points
+    lengths_in = np.linalg.norm(edges_in, axis=1)
+    lengths_out = np.linalg.norm(edges_out, axis=1)
+    turns_sin = np.einsum("ij,ij->i", np.cross(edges_in, edges_out), point_normals)
+    turns_cos = np.einsum("ij,ij->i", edges_in, edges_out)
+    is_convex_turn = (lengths_in > 1e-9) & (lengths_out > 1e-9)
+    is_convex_turn &= turns_sin > 1e-9 * lengths_in * lengths_out
+    all_convex = np.zeros(n_rings, dtype=np.bool_)
+    all_convex[non_empty] = np.logical_and.reduceat(is_convex_turn, starts)
+    valid &= all_convex
+
+    # Simplicity: the turns of a convex ring must add up to exactly one turn
+    turn_angles = np.arctan2(turns_sin, turns_cos)
+    total_angles = np.zeros(n_rings, dtype=np.float64)
+    total_angles[non_empty] = np.add.reduceat(turn_angles, starts)
+    valid &= np.abs(total_angles - 2 * np.pi) < 1e-3
+
+    return valid
+
+
+def fan_triangulate_rings(
+    ring_indices: NDArray[np.int64], ring_offsets: NDArray[np.int64]
+) -> NDArray[np.int64]:
+    """
+    Triangulate convex rings in a vectorized way, with triangles all sharing the first vertex of their ring.
+
+    Parameters
+    ----------
+    ring_indices : NDArray[np.int64]
+        The vertex indices of all the rings, one ring after the other, without repeating the first vertex.
+    ring_offsets : NDArray[np.int64]
+        The offsets (R + 1,) of the rings in `ring_indices`.
+
+    Returns
+    -------
+    NDArray[np.int64]
+        The triangles (T, 3) referring to the same vertices as `ring_indices`, with the orientation of the rings.
+    """
+    n_triangles = np.maximum(np.diff(ring_offsets) - 2, 0)
+    triangle_offsets = np.concatenate(([0], np.cumsum(n_triangles)))
+    ring_starts = np.repeat(ring_offsets[:-1], n_triangles)
+    position_in_fan = np.arange(triangle_offsets[-1]) - np.repeat(
+        triangle_offsets[:-1], n_triangles
+    )
+    positions = np.column_stack(
+        (
+            ring_starts,
+            ring_starts + position_in_fan + 1,
+            ring_starts + position_in_fan + 2,
+        )
+    )
+    return ring_indices[positions]
+
+
 def triangulate_surface_3d(
     outer_boundary: NDArray[np.int64],
     holes: list[NDArray[np.int64]],
@@ -399,6 +651,7 @@ def triangulate_surface_3d(
 ) -> Tuple[NDArray[np.float64], NDArray[np.int64], bool]:
     """
     Triangulate a 3D Surface.
+    If the triangulation cache is enabled, the triangulation of a surface with the same coordinates (see `triangulation_cache.surface_key`) is reused.
 
     Parameters
     ----------
@@ -419,11 +672,52 @@ def triangulate_surface_3d(
         Whether the output is a valid triangulation.
     """
     # Do nothing if the object is already a triangle
-    if outer_boundary.shape == 3 and len(holes) == 0:
+    if outer_boundary.shape[0] == 3 and len(holes) == 0:
         tri_vertices = vertices[outer_boundary]
         tri_faces = np.array([0, 1, 2]).reshape(1, 3)
         return tri_vertices, tri_faces, True
 
+    # Reuse the triangulation of a previous run if the surface did not change
+    cache = triangulation_cache.get_cache()
+    if cache is None:
+        return _triangulate_surface_3d(outer_boundary, holes, vertices)
+    key = triangulation_cache.surface_key(outer_boundary, holes, vertices)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    tri_vertices, tri_faces, worked = _triangulate_surface_3d(
+        outer_boundary, holes, vertices
+    )
+    cache.put(key, tri_vertices, tri_faces, worked)
+    return tri_vertices, tri_faces, worked
+
+
+def _triangulate_surface_3d(
+    outer_boundary: NDArray[np.int64],
+    holes: list[NDArray[np.int64]],
+    vertices: NDArray[np.float64],
+) -> Tuple[NDArray[np.float64], NDArray[np.int64], bool]:
+    """
+    Triangulate a 3D Surface without the triangulation cache, by projecting it on its plane and triangulating the 2D polygon.
+
+    Parameters
+    ----------
+    outer_boundary : NDArray[np.int64]
+        Outer boundary of the Surface, referring to `vertices`.
+    holes : list[NDArray[np.int64]]
+        Holes of the Surface, referring to `vertices`
+    vertices : NDArray[np.float64]
+        The vertices to extract the boundaries from.
+
+    Returns
+    -------
+    tri_vertices: NDArray[np.float64]
+        The vertices of the output triangulation.
+    tri_triangles: NDArray[np.int64]
+        The triangles of the output triangulation, refering to `tri_vertices`.
+    valid: bool
+        Whether the output is a valid triangulation.
+    """
     # Compute the plane of the surface
     used_ids = np.unique(np.concatenate([outer_boundary] + holes))
     unique_points = np.unique(vertices[used_ids], axis=0)
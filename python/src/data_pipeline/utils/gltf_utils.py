@@ -0,0 +1,671 @@
+"""
+Utilities to post-process binary glTF (glb) files written by trimesh, for encodings that trimesh cannot write.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import struct
+from typing import Any
+
+import numpy as np
+import trimesh
+from numpy.typing import NDArray
+
+from data_pipeline.utils import json_io
+
+_GLB_MAGIC = b"glTF"
+_JSON_CHUNK = 0x4E4F534A
+_BIN_CHUNK = 0x004E4942
+
+# glTF component types and number of components of the accessor types
+COMPONENT_DTYPES: dict[int, np.dtype] = {
+    5120: np.dtype(np.int8),
+    5121: np.dtype(np.uint8),
+    5122: np.dtype(np.int16),
+    5123: np.dtype(np.uint16),
+    5125: np.dtype(np.uint32),
+    5126: np.dtype(np.float32),
+}
+_DTYPE_COMPONENTS = {dtype: component for component, dtype in COMPONENT_DTYPES.items()}
+TYPE_SIZES = {
+    "SCALAR": 1,
+    "VEC2": 2,
+    "VEC3": 3,
+    "VEC4": 4,
+    "MAT2": 4,
+    "MAT3": 9,
+    "MAT4": 16,
+}
+
+QUANTIZATION_EXTENSION = "KHR_mesh_quantization"
+INSTANCING_EXTENSION = "EXT_mesh_gpu_instancing"
+# Extras of the instanced nodes listing the names of the nodes of their instances
+INSTANCE_NODES_EXTRAS = "instanceNodes"
+FEATURES_EXTENSION = "EXT_mesh_features"
+# Vertex attribute storing the index of the feature of every vertex, in the convention of `EXT_mesh_features`
+FEATURE_ID_ATTRIBUTE = "_FEATURE_ID_0"
+# Range of the quantized positions, symmetric to keep the center at 0
+_POSITION_RANGE = 32767
+_NORMAL_RANGE = 127
+_TRANSFORM_KEYS = ("matrix", "translation", "rotation", "scale")
+
+
+def _pad4(length: int) -> int:
+    return (length + 3) // 4 * 4
+
+
+class GlbDocument:
+    """
+    Content of a glb file, formed by the glTF JSON and its binary buffer.
+    """
+
+    def __init__(self, gltf: dict[str, Any], binary: bytes) -> None:
+        """
+        Content of a glb file.
+
+        Parameters
+        ----------
+        gltf : dict[str, Any]
+            The glTF JSON.
+        binary : bytes
+            The binary buffer, which is the only buffer of the file.
+        """
+        self.gltf = gltf
+        self.binary = binary
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> GlbDocument:
+        """
+        Parse a glb file.
+
+        Parameters
+        ----------
+        data : bytes
+            The content of the glb file.
+
+        Returns
+        -------
+        GlbDocument
+            The parsed document.
+
+        Raises
+        ------
+        ValueError
+            If the data is not a glb file.
+        """
+        if data[:4] != _GLB_MAGIC:
+            raise ValueError("The data is not a binary glTF file.")
+        gltf: dict[str, Any] = {}
+        binary = b""
+        offset = 12
+        while offset < len(data):
+            chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+            chunk = data[offset + 8 : offset + 8 + chunk_length]
+            if chunk_type == _JSON_CHUNK:
+                gltf = json_io.loads(chunk)
+            elif chunk_type == _BIN_CHUNK:
+                binary = bytes(chunk)
+            offset += 8 + chunk_length
+        return cls(gltf=gltf, binary=binary)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialise the document to a glb file.
+
+        Returns
+        -------
+        bytes
+            The content of the glb file.
+        """
+        json_chunk = json_io.dumps_bytes(self.gltf, compact=True)
+        json_chunk += b" " * (_pad4(len(json_chunk)) - len(json_chunk))
+        bin_chunk = self.binary + b"\0" * (_pad4(len(self.binary)) - len(self.binary))
+        length = 12 + 8 + len(json_chunk) + (8 + len(bin_chunk) if bin_chunk else 0)
+        parts = [
+            struct.pack("<4sII", _GLB_MAGIC, 2, length),
+            struct.pack("<II", len(json_chunk), _JSON_CHUNK),
+            json_chunk,
+        ]
+        if bin_chunk:
+            parts += [struct.pack("<II", len(bin_chunk), _BIN_CHUNK), bin_chunk]
+        return b"".join(parts)
+
+    def accessor_array(self, accessor_idx: int) -> NDArray[Any]:
+        """
+        Read the values of an accessor.
+
+        Parameters
+        ----------
+        accessor_idx : int
+            The index of the accessor.
+
+        Returns
+        -------
+        NDArray[Any]
+            The array (count, n_components) of the raw values, with the dtype of the accessor.
+
+        Raises
+        ------
+        NotImplementedError
+            If the accessor is sparse or has no buffer view.
+        """
+        accessor = self.gltf["accessors"][accessor_idx]
+        if "sparse" in accessor or "bufferView" not in accessor:
+            raise NotImplementedError("Sparse accessors are not supported.")
+        view = self.gltf["bufferViews"][accessor["bufferView"]]
+        dtype = COMPONENT_DTYPES[accessor["componentType"]]
+        n_components = TYPE_SIZES[accessor["type"]]
+        element_size = dtype.itemsize * n_components
+        stride = view.get("byteStride", element_size)
+        start = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+        count = accessor["count"]
+        raw = np.frombuffer(
+            self.binary,
+            dtype=np.uint8,
+            count=max(0, (count - 1) * stride + element_size),
+            offset=start,
+        )
+        if count == 0:
+            return np.zeros((0, n_components), dtype=dtype)
+        rows = np.lib.stride_tricks.as_strided(
+            raw, shape=(count, element_size), strides=(stride, 1)
+        )
+        return np.ascontiguousarray(rows).view(dtype).reshape(count, n_components)
+
+    def vertex_accessors(self) -> set[int]:
+        """
+        Find the accessors used as vertex attributes by the primitives.
+
+        Returns
+        -------
+        set[int]
+            The indices of the accessors.
+        """
+        return {
+            accessor_idx
+            for mesh in self.gltf.get("meshes", [])
+            for primitive in mesh["primitives"]
+            for accessor_idx in primitive["attributes"].values()
+        }
+
+    def rebuild_buffer(self, arrays: dict[int, NDArray[Any]]) -> None:
+        """
+        Rebuild the binary buffer with one buffer view per distinct accessor content, replacing the values of some accessors.
+        The accessors with identical values share their buffer view, as in the files written by trimesh.
+        The vertex attributes are padded to 4-byte aligned elements as required by glTF, and the other buffer views used by images are kept.
+
+        Parameters
+        ----------
+        arrays : dict[int, NDArray[Any]]
+            The new values (count, n_components) of some accessors, whose dtype gives the new component type.
+            The accessors with a "min" and a "max" get new bounds, computed on the new values, unless they are normalized.
+        """
+        accessors = self.gltf.get("accessors", [])
+        vertex_accessors = self.vertex_accessors()
+        chunks: list[bytes] = []
+        views: list[dict[str, Any]] = []
+        shared_views: dict[tuple[bytes, int | None], int] = {}
+        offset = 0
+
+        def add_view(data: bytes, stride: int | None) -> int:
+            nonlocal offset
+            view: dict[str, Any] = {
+                "buffer": 0,
+                "byteOffset": offset,
+                "byteLength": len(data),
+            }
+            if stride is not None:
+                view["byteStride"] = stride
+            padded = data + b"\0" * (_pad4(len(data)) - len(data))
+            chunks.append(padded)
+            offset += len(padded)
+            views.append(view)
+            return len(views) - 1
+
+        # Keep the views of the images
+        for image in self.gltf.get("images", []):
+            if "bufferView" in image:
+                view = self.gltf["bufferViews"][image["bufferView"]]
+                start = view.get("byteOffset", 0)
+                image["bufferView"] = add_view(
+                    self.binary[start : start + view["byteLength"]], None
+                )
+
+        for accessor_idx, accessor in enumerate(accessors):
+            if accessor_idx in arrays:
+                values = arrays[accessor_idx]
+                accessor["componentType"] = _DTYPE_COMPONENTS[values.dtype]
+            else:
+                values = self.accessor_array(accessor_idx)
+            values = np.ascontiguousarray(values)
+            accessor.pop("byteOffset", None)
+            if "min" in accessor and len(values) > 0:
+                if accessor.get("normalized", False):
+                    accessor.pop("min")
+                    accessor.pop("max")
+                else:
+                    accessor["min"] = values.min(axis=0).tolist()
+                    accessor["max"] = values.max(axis=0).tolist()
+
+            element_size = values.dtype.itemsize * values.shape[1]
+            stride = None
+            data = values.tobytes()
+            if accessor_idx in vertex_accessors and element_size % 4 != 0:
+                # Every element of a vertex attribute starts on a 4-byte boundary
+                stride = _pad4(element_size)
+                padded = np.zeros((len(values), stride), dtype=np.uint8)
+                padded[:, :element_size] = values.view(np.uint8).reshape(
+                    len(values), element_size
+                )
+                data = padded.tobytes()
+            if (data, stride) not in shared_views:
+                shared_views[(data, stride)] = add_view(data, stride)
+            accessor["bufferView"] = shared_views[(data, stride)]
+
+        self.gltf["bufferViews"] = views
+        self.binary = b"".join(chunks)
+        self.gltf["buffers"] = [{"byteLength": len(self.binary)}]
+
+    def add_extension(self, extension: str, required: bool) -> None:
+        """
+        Declare an extension used by the document.
+
+        Parameters
+        ----------
+        extension : str
+            The name of the extension.
+        required : bool
+            Whether the extension is required to load the document.
+        """
+        keys = ["extensionsUsed"] + (["extensionsRequired"] if required else [])
+        for key in keys:
+            extensions = self.gltf.setdefault(key, [])
+            if extension not in extensions:
+                extensions.append(extension)
+
+
+def _node_matrix(node: dict[str, Any]) -> NDArray[np.float64]:
+    """
+    Get the local transformation of a glTF node as a 4x4 matrix.
+
+    Parameters
+    ----------
+    node : dict[str, Any]
+        The glTF node.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The 4x4 matrix of the node.
+    """
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4).T
+    matrix = np.eye(4)
+    if "scale" in node:
+        matrix = np.diag(list(node["scale"]) + [1.0])
+    if "rotation" in node:
+        x, y, z, w = node["rotation"]
+        matrix = trimesh.transformations.quaternion_matrix([w, x, y, z]) @ matrix
+    if "translation" in node:
+        matrix[:3, 3] += node["translation"]
+    return matrix
+
+
+def _set_node_matrix(node: dict[str, Any], matrix: NDArray[np.float64]) -> None:
+    for key in _TRANSFORM_KEYS:
+        node.pop(key, None)
+    node["matrix"] = matrix.T.reshape(-1).tolist()
+
+
+def _quantization_overhead(
+    node: dict[str, Any], dequantization: NDArray[np.float64]
+) -> int:
+    """
+    Estimate the number of bytes added to the glTF JSON by moving a dequantization to a node using a mesh.
+
+    Parameters
+    ----------
+    node : dict[str, Any]
+        The glTF node.
+    dequantization : NDArray[np.float64]
+        The 4x4 dequantization matrix of its mesh.
+
+    Returns
+    -------
+    int
+        The number of bytes added.
+    """
+    transform = {key: node[key] for key in _TRANSFORM_KEYS if key in node}
+    quantized: dict[str, Any] = {}
+    if len(node.get("children", [])) > 0:
+        # The mesh is moved to a new child node
+        quantized = {"name": f"{node.get('name', '')}-mesh", "mesh": 0}
+        _set_node_matrix(quantized, dequantization)
+        return len(json_io.dumps_bytes(quantized, compact=True)) + 4
+    _set_node_matrix(quantized, _node_matrix(node) @ dequantization)
+    return len(json_io.dumps_bytes(quantized, compact=True)) - len(
+        json_io.dumps_bytes(transform, compact=True)
+    )
+
+
+def quantize_glb(
+    glb: bytes,
+    source_meshes: dict[str, trimesh.Trimesh] | None = None,
+    per_mesh: bool = True,
+    max_error: float | None = None,
+) -> tuple[bytes, float]:
+    """
+    Encode the positions of a glb file as 16-bit integers and the normals as 8-bit integers with the `KHR_mesh_quantization` extension.
+    The indices are also stored as 16-bit integers when the meshes have few enough vertices.
+
+    The positions are quantized on a uniform grid fitted to the bounds of every mesh, or of all the meshes.
+    The dequantization (a uniform scale and a translation, so that the normals are not distorted) is stored in the matrices of the nodes using the meshes.
+    The translations of the nodes instanced with `EXT_mesh_gpu_instancing` are scaled accordingly.
+    A node with both a mesh and children gets a new child holding the mesh, so that its children are not affected.
+
+    A mesh is left unchanged when its quantization error would exceed `max_error`, or when the bytes saved in the buffer do not make up for the matrices added to its nodes, which happens for the smallest meshes.
+
+    Parameters
+    ----------
+    glb : bytes
+        The content of the glb file, where every mesh has its own position accessors.
+    source_meshes : dict[str, trimesh.Trimesh] | None, optional
+        The meshes of the file by name, with their double precision vertices, to quantize the exact positions instead of the float32 ones of the file.
+        By default None.
+    per_mesh : bool, optional
+        Whether to fit a grid to every mesh, instead of a single grid to all the meshes of the file.
+        By default True.
+    max_error : float | None, optional
+        If given, the largest distance allowed between a quantized position and its exact position.
+        By default None.
+
+    Returns
+    -------
+    bytes
+        The content of the quantized glb file, or the input if nothing was quantized.
+    float
+        The largest distance between a quantized position and its exact position.
+    """
+    document = GlbDocument.from_bytes(glb)
+    gltf = document.gltf
+    meshes = gltf.get("meshes", [])
+    nodes = gltf.get("nodes", [])
+    if len(meshes) == 0:
+        return glb, 0.0
+
+    # Exact positions of every mesh, one array per primitive
+    mesh_positions: list[list[tuple[int, NDArray[np.float64]]]] = []
+    for mesh in meshes:
+        source = None if source_meshes is None else source_meshes.get(mesh.get("name"))
+        primitives_positions = []
+        for primitive in mesh["primitives"]:
+            accessor_idx = primitive["attributes"]["POSITION"]
+            positions = document.accessor_array(accessor_idx).astype(np.float64)
+            if (
+                source is not None
+                and len(mesh["primitives"]) == 1
+                and len(source.vertices) == len(positions)
+            ):
+                positions = np.asarray(source.vertices, dtype=np.float64)
+            primitives_positions.append((accessor_idx, positions))
+        mesh_positions.append(primitives_positions)
+
+    def grid(points: list[NDArray[np.float64]]) -> tuple[NDArray[np.float64], float]:
+        all_points = np.concatenate(points) if len(points) > 0 else np.zeros((0, 3))
+        if len(all_points) == 0:
+            return np.zeros(3), 1.0
+        low, high = all_points.min(axis=0), all_points.max(axis=0)
+        extent = float(np.max(high - low))
+        if extent == 0:
+            return (low + high) / 2, 1.0
+        # Round the step up to 3 significant digits, to keep the node matrices short
+        step = extent / (2 * _POSITION_RANGE)
+        exponent = math.floor(math.log10(step)) - 2
+        return (low + high) / 2, float(f"{math.ceil(step / 10**exponent)}e{exponent}")
+
+    if not per_mesh:
+        file_grid = grid(
+            [positions for primitives in mesh_positions for _, positions in primitives]
+        )
+
+    # Nodes using every mesh
+    mesh_nodes: dict[int, list[int]] = {}
+    for node_idx, node in enumerate(nodes):
+        if "mesh" in node:
+            mesh_nodes.setdefault(node["mesh"], []).append(node_idx)
+
+    arrays: dict[int, NDArray[Any]] = {}
+    dequantization: dict[int, NDArray[np.float64]] = {}
+    quantized_error = 0.0
+    for mesh_idx, (mesh, primitives) in enumerate(zip(meshes, mesh_positions)):
+        center, step = (
+            grid([positions for _, positions in primitives]) if per_mesh else file_grid
+        )
+        matrix = np.diag([step, step, step, 1.0])
+        matrix[:3, 3] = center
+
+        mesh_arrays: dict[int, NDArray[Any]] = {}
+        mesh_error = 0.0
+        # Bytes saved in the buffer: the padded positions go from 12 to 8 bytes, the normals from 12 to 4 bytes
+        saved_bytes = 0
+        for accessor_idx, positions in primitives:
+            quantized = np.clip(
+                np.rint((positions - center) / step), -_POSITION_RANGE, _POSITION_RANGE
+            )
+            if len(positions) > 0:
+                error = np.linalg.norm(quantized * step + center - positions, axis=1)
+                mesh_error = max(mesh_error, float(error.max()))
+            mesh_arrays[accessor_idx] = quantized.astype(np.int16)
+            saved_bytes += 4 * len(positions)
+        for primitive in mesh["primitives"]:
+            normal_idx = primitive["attributes"].get("NORMAL")
+            if normal_idx is not None and normal_idx not in arrays:
+                normals = document.accessor_array(normal_idx)
+                mesh_arrays[normal_idx] = np.rint(
+                    np.clip(normals, -1.0, 1.0) * _NORMAL_RANGE
+                ).astype(np.int8)
+                saved_bytes += 8 * len(normals) - len(b',"normalized":true')
+            # The indices do not need the extension, and are always narrowed
+            indices_idx = primitive.get("indices")
+            if indices_idx is not None and indices_idx not in arrays:
+                indices = document.accessor_array(indices_idx)
+                if len(indices) > 0 and indices.max() < np.iinfo(np.uint16).max:
+                    arrays[indices_idx] = indices.astype(np.uint16)
+
+        if max_error is not None and mesh_error > max_error:
+            continue
+        overhead = sum(
+            _quantization_overhead(nodes[node_idx], matrix)
+            for node_idx in mesh_nodes.get(mesh_idx, [])
+        )
+        if saved_bytes <= overhead:
+            continue
+        arrays.update(mesh_arrays)
+        dequantization[mesh_idx] = matrix
+        quantized_error = max(quantized_error, mesh_error)
+        for primitive in mesh["primitives"]:
+            normal_idx = primitive["attributes"].get("NORMAL")
+            if normal_idx is not None:
+                gltf["accessors"][normal_idx]["normalized"] = True
+
+    if len(dequantization) == 0:
+        logging.debug("No mesh was worth quantizing")
+        if len(arrays) == 0:
+            return glb, 0.0
+
+    # Move the dequantization to the nodes
+    for node_idx in range(len(nodes)):
+        node = nodes[node_idx]
+        if node.get("mesh") not in dequantization:
+            continue
+        mesh_idx = node["mesh"]
+        instancing = node.get("extensions", {}).get(INSTANCING_EXTENSION)
+        if instancing is not None:
+            if set(instancing["attributes"]) != {"TRANSLATION"}:
+                raise NotImplementedError(
+                    "Only instances with a translation can be quantized."
+                )
+            # The translations of the instances are applied before the node matrix, in the quantized units
+            translation_idx = instancing["attributes"]["TRANSLATION"]
+            translations = document.accessor_array(translation_idx).astype(np.float64)
+            arrays[translation_idx] = (
+                translations / dequantization[mesh_idx][0, 0]
+            ).astype(np.float32)
+        if len(node.get("children", [])) > 0:
+            node.pop("mesh")
+            node["children"].append(len(nodes))
+            node = {"name": f"{node.get('name', node_idx)}-mesh", "mesh": mesh_idx}
+            nodes.append(node)
+        _set_node_matrix(node, _node_matrix(node) @ dequantization[mesh_idx])
+
+    buffer_bytes = len(document.binary)
+    document.rebuild_buffer(arrays)
+    if len(dequantization) > 0:
+        document.add_extension(QUANTIZATION_EXTENSION, required=True)
+    logging.debug(
+        f"Quantized {len(dequantization)} of {len(meshes)} meshes: {buffer_bytes} -> {len(document.binary)} bytes of buffer"
+    )
+    return document.to_bytes(), quantized_error
+
+
+def _world_matrices(gltf: dict[str, Any]) -> dict[int, NDArray[np.float64]]:
+    """
+    Compute the world transformation of the nodes of the default scene of a glTF file.
+
+    Parameters
+    ----------
+    gltf : dict[str, Any]
+        The glTF JSON.
+
+    Returns
+    -------
+    dict[int, NDArray[np.float64]]
+        The 4x4 world matrix of every node of the scene.
+    """
+    nodes = gltf.get("nodes", [])
+    scenes = gltf.get("scenes", [])
+    if len(scenes) == 0:
+        return {}
+    world: dict[int, NDArray[np.float64]] = {}
+    stack = [
+        (node_idx, np.eye(4)) for node_idx in scenes[gltf.get("scene", 0)]["nodes"]
+    ]
+    while len(stack) > 0:
+        node_idx, parent_matrix = stack.pop()
+        world[node_idx] = parent_matrix @ _node_matrix(nodes[node_idx])
+        for child_idx in nodes[node_idx].get("children", []):
+            stack.append((child_idx, world[node_idx]))
+    return world
+
+
+def instance_glb(glb: bytes, tolerance: float = 1e-9) -> tuple[bytes, int]:
+    """
+    Draw the meshes used by several nodes in a single call with the `EXT_mesh_gpu_instancing` extension.
+    The meshes are moved to a new root node `<mesh_name>-instances`, with the translation of every node as an instance.
+    The nodes keep their names and transformations but lose their mesh, and the names of the nodes of the instances are stored in the `INSTANCE_NODES_EXTRAS` extras of the new node, in the order of the instances, so that a viewer can find the geometry of every node.
+    Only the nodes whose world transformation is a translation are instanced, the others keep their mesh.
+
+    Parameters
+    ----------
+    glb : bytes
+        The content of the glb file.
+    tolerance : float, optional
+        The tolerance to consider that the world transformation of a node is a translation.
+        By default 1e-9.
+
+    Returns
+    -------
+    bytes
+        The content of the instanced glb file.
+    int
+        The number of instanced meshes.
+    """
+    document = GlbDocument.from_bytes(glb)
+    gltf = document.gltf
+    nodes = gltf.get("nodes", [])
+    world = _world_matrices(gltf)
+
+    mesh_nodes: dict[int, list[int]] = {}
+    for node_idx, matrix in world.items():
+        node = nodes[node_idx]
+        if "mesh" in node and np.allclose(matrix[:3, :3], np.eye(3), atol=tolerance):
+            mesh_nodes.setdefault(node["mesh"], []).append(node_idx)
+
+    accessors = gltf.setdefault("accessors", [])
+    arrays: dict[int, NDArray[Any]] = {}
+    scene_nodes = gltf["scenes"][gltf.get("scene", 0)]["nodes"] if world else []
+    for mesh_idx, instance_nodes in mesh_nodes.items():
+        if len(instance_nodes) < 2:
+            continue
+        instance_nodes.sort()
+        translations = np.array(
+            [world[node_idx][:3, 3] for node_idx in instance_nodes], dtype=np.float32
+        )
+        accessors.append(
+            {"componentType": 5126, "type": "VEC3", "count": len(translations)}
+        )
+        arrays[len(accessors) - 1] = translations
+        for node_idx in instance_nodes:
+            nodes[node_idx].pop("mesh")
+        mesh_name = gltf["meshes"][mesh_idx].get("name", str(mesh_idx))
+        nodes.append(
+            {
+                "name": f"{mesh_name}-instances",
+                "mesh": mesh_idx,
+                "extras": {
+                    INSTANCE_NODES_EXTRAS: [
+                        nodes[node_idx].get("name", str(node_idx))
+                        for node_idx in instance_nodes
+                    ]
+                },
+                "extensions": {
+                    INSTANCING_EXTENSION: {
+                        "attributes": {"TRANSLATION": len(accessors) - 1}
+                    }
+                },
+            }
+        )
+        scene_nodes.append(len(nodes) - 1)
+
+    if len(arrays) == 0:
+        return glb, 0
+    document.rebuild_buffer(arrays)
+    # Without the extension, the instanced meshes would not be drawn at their nodes
+    document.add_extension(INSTANCING_EXTENSION, required=True)
+    return document.to_bytes(), len(arrays)
+
+
+def add_feature_ids(glb: bytes) -> bytes:
+    """
+    Declare the `_FEATURE_ID_0` vertex attributes of the primitives as feature ids, with the `EXT_mesh_features` extension.
+    The number of features of every primitive is the number of distinct ids.
+
+    Parameters
+    ----------
+    glb : bytes
+        The content of the glb file.
+
+    Returns
+    -------
+    bytes
+        The content of the glb file with the extension.
+    """
+    document = GlbDocument.from_bytes(glb)
+    found = False
+    for mesh in document.gltf.get("meshes", []):
+        for primitive in mesh["primitives"]:
+            accessor_idx = primitive["attributes"].get(FEATURE_ID_ATTRIBUTE)
+            if accessor_idx is None:
+                continue
+            feature_count = len(np.unique(document.accessor_array(accessor_idx)))
+            primitive.setdefault("extensions", {})[FEATURES_EXTENSION] = {
+                "featureIds": [{"featureCount": feature_count, "attribute": 0}]
+            }
+            found = True
+    if not found:
+        return glb
+    # The meshes are still drawn correctly without the extension
+    document.add_extension(FEATURES_EXTENSION, required=False)
+    return document.to_bytes()
@@ -0,0 +1,207 @@
+"""
+Single entry point to read and write JSON files in the whole pipeline, with the fastest available backend.
+
+The backend used to parse JSON is chosen automatically between `orjson`, `msgspec` and the standard library `json`, in this order, depending on what is installed.
+It can also be selected manually with `set_backend`, for example to compare them.
+
+The files are always written with the encoder of the standard library, in the layout of `json.dump` (spaces after the separators, non-ASCII characters escaped), so that they are byte-identical whatever the backend.
+The other libraries cannot write this layout, and also write some floats differently (for example `0.00001` instead of `1e-05`).
+NumPy scalars and arrays are serialised as the equivalent numbers and lists.
+"""
+
+import importlib.util
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+# Separators of the default layout, for the writers streaming a document piece by piece
+ITEM_SEPARATOR = b", "
+KEY_SEPARATOR = b": "
+
+
+def available_backends() -> list[str]:
+    """
+    List the JSON backends that can be used in the current environment.
+
+    Returns
+    -------
+    list[str]
+        The names of the available backends, from the fastest to the slowest.
+    """
+    return [
+        backend
+        for backend in BACKENDS
+        if backend == "json" or importlib.util.find_spec(backend) is not None
+    ]
+
+
+_backend: str = available_backends()[0]
+
+
+def get_backend() -> str:
+    """
+    Return the name of the JSON backend currently in use.
+
+    Returns
+    -------
+    str
+        The name of the backend.
+    """
+    return _backend
+
+
+def set_backend(backend: str) -> None:
+    """
+    Select the JSON backend used by all the readers of the pipeline.
+
+    Parameters
+    ----------
+    backend : str
+        The name of the backend, one of `BACKENDS`, or "auto" to use the fastest available one.
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown or not installed.
+    """
+    global _backend
+    available = available_backends()
+    if backend == "auto":
+        _backend = available[0]
+    elif backend in available:
+        _backend = backend
+    elif backend in BACKENDS:
+        raise ValueError(f"The JSON backend '{backend}' is not installed.")
+    else:
+        raise ValueError(
+            f"Unknown JSON backend '{backend}', expected 'auto' or one of {BACKENDS}."
+        )
+
+
+def _default(obj: Any) -> Any:
+    """
+    Convert the NumPy objects that the backends cannot serialise natively to Python objects.
+
+    Parameters
+    ----------
+    obj : Any
+        The object that could not be serialised.
+
+    Returns
+    -------
+    Any
+        The equivalent Python number or list.
+
+    Raises
+    ------
+    TypeError
+        If the object is not a NumPy scalar or array.
+    """
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def loads(data: str | bytes) -> Any:
+    """
+    Parse a JSON document.
+
+    Parameters
+    ----------
+    data : str | bytes
+        The JSON document.
+
+    Returns
+    -------
+    Any
+        The parsed content.
+    """
+    if _backend == "orjson":
+        import orjson
+
+        return orjson.loads(data)
+    elif _backend == "msgspec":
+        import msgspec
+
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, compact: bool = False) -> str:
+    """
+    Serialise an object to JSON, as `json.dumps` does by default.
+
+    Parameters
+    ----------
+    obj : Any
+        The object to serialise, made of dictionaries with string keys, lists, strings, numbers, booleans, None and NumPy scalars and arrays.
+    compact : bool, optional
+        Whether to remove the spaces after the separators, as in the JSON chunk of glb files.
+        By default False.
+
+    Returns
+    -------
+    str
+        The JSON document, only made of ASCII characters.
+    """
+    if compact:
+        return json.dumps(obj, separators=(",", ":"), default=_default)
+    return json.dumps(obj, default=_default)
+
+
+def dumps_bytes(obj: Any, compact: bool = False) -> bytes:
+    """
+    Serialise an object to JSON encoded in bytes, as `json.dumps` does by default.
+
+    Parameters
+    ----------
+    obj : Any
+        The object to serialise, made of dictionaries with string keys, lists, strings, numbers, booleans, None and NumPy scalars and arrays.
+    compact : bool, optional
+        Whether to remove the spaces after the separators, as in the JSON chunk of glb files.
+        By default False.
+
+    Returns
+    -------
+    bytes
+        The JSON document.
+    """
+    # Only made of ASCII characters
+    return dumps(obj, compact=compact).encode("ascii")
+
+
+def load(path: Path) -> Any:
+    """
+    Read and parse a JSON file.
+
+    Parameters
+    ----------
+    path : Path
+        The path of the file.
+
+    Returns
+    -------
+    Any
+        The parsed content.
+    """
+    with open(path, "rb") as json_file:
+        return loads(json_file.read())
+
+
+def dump(obj: Any, path: Path) -> None:
+    """
+    Serialise an object and write it to a JSON file.
+
+    Parameters
+    ----------
+    obj : Any
+        The object to serialise, made of dictionaries with string keys, lists, strings, numbers, booleans, None and NumPy scalars and arrays.
+    path : Path
+        The path of the file.
+    """
+    with open(path, "wb") as json_file:
+        json_file.write(dumps_bytes(obj))
@@ -0,0 +1,44 @@
+"""
+Utilities to monitor the memory used by the pipeline.
+"""
+
+import logging
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def peak_rss_bytes() -> int | None:
+    """
+    Get the peak resident set size of the current process since it started.
+
+    Returns
+    -------
+    int | None
+        The peak resident set size in bytes, or None if it cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+
+def log_peak_rss(step: str) -> None:
+    """
+    Log the peak resident set size of the current process, at the INFO level.
+
+    Parameters
+    ----------
+    step : str
+        A description of the step of the pipeline that was just completed.
+    """
+    peak_rss = peak_rss_bytes()
+    if peak_rss is not None:
+        logging.info(f"Peak RSS after {step}: {peak_rss / 1024**2:.1f} MB")
@@ -0,0 +1,251 @@
+"""
+Utilities to simplify meshes with quadric edge collapses, to render far away objects with fewer triangles.
+"""
+
+from __future__ import annotations
+
+import heapq
+import importlib.util
+
+import numpy as np
+import trimesh
+from numpy.typing import NDArray
+
+DEFAULT_MAX_FACES = 128
+# Above this condition number, the optimal position of a collapse is not computed
+_MAX_CONDITION = 1e8
+
+
+def _plane_quadrics(
+    normals: NDArray[np.float64], points: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    """
+    Compute the quadrics measuring the squared distance to planes.
+
+    Parameters
+    ----------
+    normals : NDArray[np.float64]
+        The unit normals (n, 3) of the planes.
+    points : NDArray[np.float64]
+        A point (n, 3) on every plane.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The quadrics (n, 4, 4).
+    """
+    planes = np.concatenate(
+        (normals, -np.einsum("ij,ij->i", normals, points)[:, None]), axis=1
+    )
+    return planes[:, :, None] * planes[:, None, :]
+
+
+def _collapse_targets(
+    quadrics: NDArray[np.float64], p0: NDArray[np.float64], p1: NDArray[np.float64]
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Find the positions of the vertices replacing edges that minimise the quadric error.
+    The candidates are the two vertices of the edge, its middle and the optimal position of the quadric, if it is well defined.
+
+    Parameters
+    ----------
+    quadrics : NDArray[np.float64]
+        The sums (n, 4, 4) of the quadrics of the two vertices of every edge.
+    p0 : NDArray[np.float64]
+        The positions (n, 3) of the first vertices.
+    p1 : NDArray[np.float64]
+        The positions (n, 3) of the second vertices.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The quadric errors (n,) of the new vertices.
+    NDArray[np.float64]
+        The positions (n, 3) of the new vertices.
+    """
+    candidates = np.stack((p0, p1, (p0 + p1) / 2, (p0 + p1) / 2), axis=1)
+    well_defined = np.linalg.cond(quadrics[:, :3, :3]) < _MAX_CONDITION
+    if np.any(well_defined):
+        candidates[well_defined, 3] = np.linalg.solve(
+            quadrics[well_defined, :3, :3], -quadrics[well_defined, :3, 3:]
+        )[:, :, 0]
+    homogeneous = np.concatenate(
+        (candidates, np.ones(candidates.shape[:2] + (1,))), axis=2
+    )
+    costs = np.einsum("nci,nij,ncj->nc", homogeneous, quadrics, homogeneous)
+    best = np.argmin(costs, axis=1)
+    rows = np.arange(len(best))
+    return np.maximum(costs[rows, best], 0.0), candidates[rows, best]
+
+
+def simplify_quadric(
+    mesh: trimesh.Trimesh,
+    max_faces: int = DEFAULT_MAX_FACES,
+    max_error: float | None = None,
+) -> trimesh.Trimesh:
+    """
+    Simplify a mesh by collapsing its edges in the order of their quadric error, as described by Garland and Heckbert in "Surface Simplification Using Quadric Error Metrics", 1997.
+    The error of a vertex is the sum of its squared distances to the planes of its original triangles, and to planes perpendicular to the original boundary edges to preserve the borders.
+    The collapses that would flip a triangle or make the mesh non-manifold are skipped.
+
+    Parameters
+    ----------
+    mesh : trimesh.Trimesh
+        The mesh to simplify, whose duplicate vertices are merged first.
+    max_faces : int, optional
+        The number of triangles to reach.
+        By default `DEFAULT_MAX_FACES`.
+    max_error : float | None, optional
+        If given, the collapses are stopped before the square root of the quadric error of a vertex exceeds this distance, even if `max_faces` is not reached.
+        By default None.
+
+    Returns
+    -------
+    trimesh.Trimesh
+        The simplified mesh.
+    """
+    merged = trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.faces, process=False)
+    merged.merge_vertices()
+    merged.update_faces(merged.nondegenerate_faces())
+    if len(merged.faces) <= max_faces:
+        return merged
+
+    # Centered to keep the quadrics accurate with large coordinates
+    center = merged.vertices.mean(axis=0)
+    positions = np.array(merged.vertices - center, dtype=np.float64)
+    faces = np.array(merged.faces, dtype=np.int64)
+    n_vertices = len(positions)
+
+    quadrics = np.zeros((n_vertices, 4, 4))
+    face_normals = np.asarray(merged.face_normals)
+    face_quadrics = _plane_quadrics(face_normals, positions[faces[:, 0]])
+    for corner in range(3):
+        np.add.at(quadrics, faces[:, corner], face_quadrics)
+    # Boundary edges, used by a single triangle
+    edges = np.sort(merged.edges, axis=1)
+    edge_faces = np.repeat(np.arange(len(faces)), 3)
+    _, inverse, counts = np.unique(
+        edges, axis=0, return_inverse=True, return_counts=True
+    )
+    boundary = counts[inverse.reshape(-1)] == 1
+    if np.any(boundary):
+        boundary_edges = edges[boundary]
+        directions = positions[boundary_edges[:, 1]] - positions[boundary_edges[:, 0]]
+        normals = np.cross(directions, face_normals[edge_faces[boundary]])
+        lengths = np.linalg.norm(normals, axis=1)
+        valid = lengths > 0
+        boundary_quadrics = _plane_quadrics(
+            normals[valid] / lengths[valid, None],
+            positions[boundary_edges[valid, 0]],
+        )
+        for corner in range(2):
+            np.add.at(quadrics, boundary_edges[valid, corner], boundary_quadrics)
+
+    vertex_faces: list[set[int]] = [set() for _ in range(n_vertices)]
+    for face_idx, face in enumerate(faces.tolist()):
+        for vertex in face:
+            vertex_faces[vertex].add(face_idx)
+    alive_faces = np.ones(len(faces), dtype=bool)
+    n_faces = len(faces)
+    # The entries of the heap are outdated when the version of a vertex changed
+    versions = [0] * n_vertices
+    heap: list[tuple[float, int, int, int, int]] = []
+
+    def neighbours(vertex: int) -> set[int]:
+        return {v for face in vertex_faces[vertex] for v in faces[face].tolist()} - {
+            vertex
+        }
+
+    def push_edges(v0: NDArray[np.int64], v1: NDArray[np.int64]) -> None:
+        costs, _ = _collapse_targets(
+            quadrics[v0] + quadrics[v1], positions[v0], positions[v1]
+        )
+        for cost, vertex, other in zip(costs.tolist(), v0.tolist(), v1.tolist()):
+            heapq.heappush(
+                heap, (cost, vertex, other, versions[vertex], versions[other])
+            )
+
+    unique_edges = np.unique(edges, axis=0)
+    push_edges(unique_edges[:, 0], unique_edges[:, 1])
+
+    max_cost = np.inf if max_error is None else max_error**2
+    while n_faces > max_faces and len(heap) > 0:
+        cost, v0, v1, version0, version1 = heapq.heappop(heap)
+        if version0 != versions[v0] or version1 != versions[v1]:
+            continue
+        if cost > max_cost:
+            break
+        # Link condition: the only common neighbours are the opposite vertices of the shared triangles
+        shared_faces = vertex_faces[v0] & vertex_faces[v1]
+        if len(neighbours(v0) & neighbours(v1)) != len(shared_faces):
+            continue
+        quadric = quadrics[v0] + quadrics[v1]
+        _, targets = _collapse_targets(
+            quadric[None], positions[v0][None], positions[v1][None]
+        )
+        position = targets[0]
+
+        # Skip the collapses flipping a triangle
+        moved_faces = faces[list((vertex_faces[v0] | vertex_faces[v1]) - shared_faces)]
+        corners = positions[moved_faces]
+        moved = corners.copy()
+        moved[(moved_faces == v0) | (moved_faces == v1)] = position
+        before = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        after = np.cross(moved[:, 1] - moved[:, 0], moved[:, 2] - moved[:, 0])
+        if np.any(np.einsum("ij,ij->i", before, after) <= 0):
+            continue
+
+        # Collapse v1 into v0
+        for face in shared_faces:
+            alive_faces[face] = False
+            for vertex in faces[face]:
+                vertex_faces[vertex].discard(face)
+        n_faces -= len(shared_faces)
+        for face in vertex_faces[v1]:
+            faces[face][faces[face] == v1] = v0
+            vertex_faces[v0].add(face)
+        vertex_faces[v1] = set()
+        positions[v0] = position
+        quadrics[v0] = quadric
+        versions[v0] += 1
+        versions[v1] += 1
+        others = np.array(sorted(neighbours(v0)), dtype=np.int64)
+        push_edges(np.full(len(others), v0), others)
+
+    simplified = trimesh.Trimesh(
+        vertices=positions + center, faces=faces[alive_faces], process=False
+    )
+    simplified.remove_unreferenced_vertices()
+    return simplified
+
+
+def simplify_mesh(
+    mesh: trimesh.Trimesh,
+    max_faces: int = DEFAULT_MAX_FACES,
+    max_error: float | None = None,
+) -> trimesh.Trimesh:
+    """
+    Simplify a mesh to a number of triangles.
+    Without `max_error`, the simplification of trimesh is used if `fast_simplification` is installed, and `simplify_quadric` otherwise.
+
+    Parameters
+    ----------
+    mesh : trimesh.Trimesh
+        The mesh to simplify.
+    max_faces : int, optional
+        The number of triangles to reach.
+        By default `DEFAULT_MAX_FACES`.
+    max_error : float | None, optional
+        If given, the distance that the simplification cannot exceed, even if `max_faces` is not reached, see `simplify_quadric`.
+        By default None.
+
+    Returns
+    -------
+    trimesh.Trimesh
+        The simplified mesh.
+    """
+    if len(mesh.faces) <= max_faces:
+        return mesh
+    if max_error is None and importlib.util.find_spec("fast_simplification"):
+        return mesh.simplify_quadric_decimation(face_count=max_faces)
+    return simplify_quadric(mesh, max_faces=max_faces, max_error=max_error)
@@ -0,0 +1,300 @@
+"""
+Persistent cache of the triangulations of 3D surfaces, shared between the runs of the pipeline.
+
+The triangulations are stored in a single SQLite file, keyed by a hash of the exact coordinates of their rings (exterior and holes).
+Since the key only depends on the coordinates, unchanged surfaces are found again even if the file or the order of the vertices changed.
+The coordinates are not rounded, since the triangulation of surfaces closer than any tolerance can still differ, and a hit must give the same triangles as a new triangulation.
+When the stored triangulations exceed the size budget, the least recently used ones are evicted.
+
+The cache is disabled by default, and enabled for the whole process with `enable`.
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+
+DEFAULT_MAX_BYTES = 1024**3
+# Number of new entries kept in memory before writing them to the file
+_FLUSH_EVERY = 1000
+
+
+def default_cache_path() -> Path:
+    """
+    Get the default path of the cache file, in the cache directory of the user: `$XDG_CACHE_HOME/data-pipeline/triangulations.sqlite`, or `~/.cache/data-pipeline/triangulations.sqlite` if `XDG_CACHE_HOME` is not set.
+
+    Returns
+    -------
+    Path
+        The path of the cache file.
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache_dir) / "data-pipeline" / "triangulations.sqlite"
+
+
+def surface_key(
+    outer_boundary: NDArray[np.int64],
+    holes: list[NDArray[np.int64]],
+    vertices: NDArray[np.float64],
+) -> bytes:
+    """
+    Compute the key of a surface from the exact coordinates of its rings.
+
+    Parameters
+    ----------
+    outer_boundary : NDArray[np.int64]
+        Outer boundary of the Surface, referring to `vertices`.
+    holes : list[NDArray[np.int64]]
+        Holes of the Surface, referring to `vertices`.
+    vertices : NDArray[np.float64]
+        The vertices the boundaries refer to.
+
+    Returns
+    -------
+    bytes
+        The key of the surface.
+    """
+    rings = [outer_boundary] + holes
+    lengths = np.array([len(ring) for ring in rings], dtype=np.int64)
+    # Adding 0 turns -0.0 into 0.0, which are the same coordinates
+    coordinates = (
+        np.ascontiguousarray(vertices[np.concatenate(rings)], dtype=np.float64) + 0.0
+    )
+    digest = hashlib.blake2b(lengths.tobytes(), digest_size=20)
+    digest.update(coordinates.tobytes())
+    return digest.digest()
+
+
+class TriangulationCache:
+    """
+    Triangulations of 3D surfaces stored in a SQLite file, with a size budget.
+    New triangulations and access times are buffered in memory and written in batches with `flush`.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """
+        Open the cache file, and create it if needed.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the SQLite file.
+        max_bytes : int, optional
+            The maximum total size in bytes of the stored triangulations.
+            By default `DEFAULT_MAX_BYTES`.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Connections cannot be shared with forked processes
+        self._pid = os.getpid()
+        self._connection: sqlite3.Connection | None = None
+        self._pending: dict[
+            bytes, tuple[NDArray[np.float64], NDArray[np.int64], bool]
+        ] = {}
+        self._used: set[bytes] = set()
+
+    def __repr__(self) -> str:
+        return f"TriangulationCache(path={self.path}, hits={self.hits}, misses={self.misses})"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            if self._pid != os.getpid():
+                # Forget the state inherited from the parent process
+                self._pid = os.getpid()
+                self._pending = {}
+                self._used = set()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS triangulations ("
+                "key BLOB PRIMARY KEY, vertices BLOB, faces BLOB, valid INTEGER, "
+                "size INTEGER, last_used INTEGER)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS last_used_index ON triangulations (last_used)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(
+        self, key: bytes
+    ) -> tuple[NDArray[np.float64], NDArray[np.int64], bool] | None:
+        """
+        Get a triangulation from the cache.
+
+        Parameters
+        ----------
+        key : bytes
+            The key of the surface, computed with `surface_key`.
+
+        Returns
+        -------
+        tuple[NDArray[np.float64], NDArray[np.int64], bool] | None
+            The vertices, triangles and validity of the triangulation, as returned by `triangulate_surface_3d`, or None if it is not in the cache.
+        """
+        connection = self._connect()
+        if key in self._pending:
+            self.hits += 1
+            return self._pending[key]
+        row = connection.execute(
+            "SELECT vertices, faces, valid FROM triangulations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.add(key)
+        vertices = np.frombuffer(row[0], dtype=np.float64).reshape(-1, 3)
+        faces = np.frombuffer(row[1], dtype=np.int64).reshape(-1, 3)
+        return vertices, faces, bool(row[2])
+
+    def put(
+        self,
+        key: bytes,
+        vertices: NDArray[np.float64],
+        faces: NDArray[np.int64],
+        valid: bool,
+    ) -> None:
+        """
+        Add a triangulation to the cache.
+        It is only written to the file at the next `flush`.
+
+        Parameters
+        ----------
+        key : bytes
+            The key of the surface, computed with `surface_key`.
+        vertices : NDArray[np.float64]
+            The vertices of the triangulation.
+        faces : NDArray[np.int64]
+            The triangles of the triangulation, referring to `vertices`.
+        valid : bool
+            Whether the triangulation is valid.
+        """
+        self._connect()
+        self._pending[key] = (
+            np.ascontiguousarray(vertices, dtype=np.float64),
+            np.ascontiguousarray(faces, dtype=np.int64),
+            valid,
+        )
+        if len(self._pending) >= _FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the new triangulations and the access times to the file, and evict the least recently used triangulations if the file is over budget.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            return
+        if len(self._pending) == 0 and len(self._used) == 0:
+            return
+        now = time.time_ns()
+        connection = self._connection
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO triangulations VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        key,
+                        vertices.tobytes(),
+                        faces.tobytes(),
+                        int(valid),
+                        vertices.nbytes + faces.nbytes,
+                        now,
+                    )
+                    for key, (vertices, faces, valid) in self._pending.items()
+                ),
+            )
+            connection.executemany(
+                "UPDATE triangulations SET last_used = ? WHERE key = ?",
+                ((now, key) for key in self._used),
+            )
+            self._evict(connection)
+        self._pending = {}
+        self._used = set()
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        total_bytes = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM triangulations"
+        ).fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        # Free a bit more than needed, to avoid evicting at every flush
+        to_free = total_bytes - int(0.9 * self.max_bytes)
+        evicted = []
+        for key, size in connection.execute(
+            "SELECT key, size FROM triangulations ORDER BY last_used"
+        ):
+            evicted.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        connection.executemany("DELETE FROM triangulations WHERE key = ?", evicted)
+        logging.debug(f"Evicted {len(evicted)} triangulations from {self.path}")
+
+    def close(self) -> None:
+        """
+        Flush the cache and close the file.
+        """
+        self.flush()
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+_cache: TriangulationCache | None = None
+
+
+def get_cache() -> TriangulationCache | None:
+    """
+    Get the cache used by `triangulate_surface_3d`.
+
+    Returns
+    -------
+    TriangulationCache | None
+        The cache, or None if it is disabled.
+    """
+    return _cache
+
+
+def enable(path: Path | None = None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    """
+    Enable the cache for all the triangulations of the process.
+    It is flushed and closed automatically at exit.
+
+    Parameters
+    ----------
+    path : Path | None, optional
+        The path of the SQLite file.
+        By default None, to use `default_cache_path()`.
+    max_bytes : int, optional
+        The maximum total size in bytes of the stored triangulations.
+        By default `DEFAULT_MAX_BYTES`.
+    """
+    global _cache
+    disable()
+    _cache = TriangulationCache(
+        path=default_cache_path() if path is None else path, max_bytes=max_bytes
+    )
+
+
+def disable() -> None:
+    """
+    Flush, close and disable the cache.
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+atexit.register(disable)
@@ -0,0 +1,193 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from data_pipeline.utils import json_io, triangulation_cache
+
+
+def _box(origin: tuple[float, float, float], size: float, first: int) -> tuple:
+    x, y, z = origin
+    vertices = [
+        [x, y, z],
+        [x + size, y, z],
+        [x + size, y + size, z],
+        [x, y + size, z],
+        [x, y, z + size],
+        [x + size, y, z + size],
+        [x + size, y + size, z + size],
+        [x, y + size, z + size],
+    ]
+    v = list(range(first, first + 8))
+    shell = [
+        [[v[3], v[2], v[1], v[0]]],
+        [[v[0], v[1], v[5], v[4]]],
+        [[v[1], v[2], v[6], v[5]]],
+        [[v[2], v[3], v[7], v[6]]],
+        [[v[3], v[0], v[4], v[7]]],
+        [[v[4], v[5], v[6], v[7]]],
+    ]
+    return vertices, shell
+
+
+def make_city(n_buildings: int = 2) -> tuple[dict[str, Any], list[list[str]]]:
+    """
+    Build a small CityJSON city model of buildings made of two storeys of two rooms.
+    The geometries are boxes in real coordinates, with a transform of 1 mm.
+
+    Returns the city model and, for every building, the ids of its objects, to write one CityJSONSeq feature per building.
+    """
+    scale = 0.001
+    objects: dict[str, Any] = {}
+    vertices: list[list[int]] = []
+    features = []
+
+    def add_box(origin: tuple[float, float, float], size: float) -> list:
+        box_vertices, shell = _box(origin, size, len(vertices))
+        vertices.extend([[round(c / scale) for c in vertex] for vertex in box_vertices])
+        return [shell]
+
+    for b in range(n_buildings):
+        building = f"B{b}"
+        first_object = len(objects)
+        origin = (20.0 * b, 0.0, 0.0)
+        objects[building] = {
+            "type": "Building",
+            "geometry": [
+                {"type": "Solid", "lod": "2", "boundaries": add_box(origin, 10.0)}
+            ],
+            "children": [],
+        }
+        for s in range(2):
+            storey = f"{building}-S{s}"
+            objects[building]["children"].append(storey)
+            objects[storey] = {
+                "type": "BuildingStorey",
+                "parents": [building],
+                "children": [],
+            }
+            for r in range(2):
+                room = f"{storey}-R{r}"
+                objects[storey]["children"].append(room)
+                room_origin = (origin[0] + 5.0 * r, 0.0, 5.0 * s)
+                objects[room] = {
+                    "type": "BuildingRoom",
+                    "parents": [storey],
+                    "geometry": [
+                        {
+                            "type": "Solid",
+                            "lod": "2",
+                            "boundaries": add_box(room_origin, 4.0),
+                        }
+                    ],
+                }
+        features.append(list(objects)[first_object:])
+
+    city = {
+        "type": "CityJSON",
+        "version": "2.0",
+        "transform": {"scale": [scale] * 3, "translate": [0.0, 0.0, 0.0]},
+        "CityObjects": objects,
+        "vertices": vertices,
+    }
+    return city, features
+
+
+def _scaling_matrix(sx: float, sy: float, sz: float) -> list[float]:
+    return [sx, 0.0, 0.0, 0.0, 0.0, sy, 0.0, 0.0, 0.0, 0.0, sz, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+
+def add_templates(city: dict[str, Any], n_instances: int = 2) -> list[str]:
+    """
+    Add a geometry template, a unit box, to a city model, with trees instancing it along y.
+
+    Returns the ids of the trees.
+    """
+    vertices, shell = _box((0.0, 0.0, 0.0), 1.0, 0)
+    city["geometry-templates"] = {
+        "templates": [{"type": "Solid", "lod": "1", "boundaries": [shell]}],
+        "vertices-templates": vertices,
+    }
+    scale = city["transform"]["scale"][0]
+    tree_ids = []
+    for i in range(n_instances):
+        tree_id = f"T{i}"
+        city["vertices"].append([0, round((50.0 + 10.0 * i) / scale), 0])
+        city["CityObjects"][tree_id] = {
+            "type": "SolitaryVegetationObject",
+            "attributes": {"species": "Tilia × europaea", "height": 1e-05 + i},
+            "geometry": [
+                {
+                    "type": "GeometryInstance",
+                    "template": 0,
+                    "boundaries": [len(city["vertices"]) - 1],
+                    "transformationMatrix": _scaling_matrix(2.0, 2.0, 3.0),
+                }
+            ],
+        }
+        tree_ids.append(tree_id)
+    return tree_ids
+
+
+def write_city(city: dict[str, Any], path: Path) -> Path:
+    with open(path, "w") as cj_file:
+        json.dump(city, cj_file)
+    return path
+
+
+def write_city_seq(city: dict[str, Any], features: list[list[str]], path: Path) -> Path:
+    """
+    Write a city model as CityJSONSeq, with one feature per building, whose vertices are reindexed.
+    """
+    header = {key: value for key, value in city.items() if key != "CityObjects"}
+    header["vertices"] = []
+    lines = [json.dumps(header)]
+    for obj_ids in features:
+        mapping: dict[int, int] = {}
+        feature_vertices: list[list[int]] = []
+
+        def remap(boundaries: Any) -> Any:
+            if isinstance(boundaries, int):
+                if boundaries not in mapping:
+                    mapping[boundaries] = len(feature_vertices)
+                    feature_vertices.append(city["vertices"][boundaries])
+                return mapping[boundaries]
+            return [remap(child) for child in boundaries]
+
+        objects = {}
+        for obj_id in obj_ids:
+            obj = json.loads(json.dumps(city["CityObjects"][obj_id]))
+            for geom in obj.get("geometry", []):
+                geom["boundaries"] = remap(geom["boundaries"])
+            objects[obj_id] = obj
+        lines.append(
+            json.dumps(
+                {
+                    "type": "CityJSONFeature",
+                    "id": obj_ids[0],
+                    "CityObjects": objects,
+                    "vertices": feature_vertices,
+                }
+            )
+        )
+    with open(path, "w") as cj_file:
+        cj_file.write("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture
+def city() -> tuple[dict[str, Any], list[list[str]]]:
+    return make_city()
+
+
+@pytest.fixture
+def cli_state(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """
+    Restore the global state set by the options of the CLI, and keep its caches out of the user folder.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    previous = json_io.get_backend()
+    yield
+    triangulation_cache.disable()
+    json_io.set_backend(previous)
@@ -0,0 +1,87 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import _box
+from data_pipeline.cj_loading.cj_boundaries import FlatBoundaries
+
+
+def _objects() -> dict:
+    _, shell = _box((0.0, 0.0, 0.0), 1.0, 0)
+    _, other_shell = _box((2.0, 0.0, 0.0), 1.0, 8)
+    # A surface with a hole
+    surface = [[[0, 1, 2, 3], [4, 5, 6], [7, 6, 5]]]
+    return {
+        "surface": {
+            "geometry": [{"type": "MultiSurface", "lod": "1", "boundaries": surface}]
+        },
+        "solid": {
+            "geometry": [
+                {"type": "Solid", "lod": "2", "boundaries": [shell, other_shell]}
+            ]
+        },
+        "multi_solid": {
+            "geometry": [
+                {
+                    "type": "MultiSolid",
+                    "lod": "2",
+                    # The second solid has an inner shell
+                    "boundaries": [[shell], [other_shell, shell], [other_shell]],
+                },
+                {
+                    "type": "CompositeSolid",
+                    "lod": "3",
+                    "boundaries": [[shell], [other_shell]],
+                },
+            ]
+        },
+        "instance": {
+            "geometry": [
+                {
+                    "type": "GeometryInstance",
+                    "template": 0,
+                    "boundaries": [3],
+                    "transformationMatrix": np.eye(4).ravel().tolist(),
+                }
+            ]
+        },
+        "no_geometry": {},
+    }
+
+
+@pytest.mark.parametrize("release", [False, True])
+def test_nested(release: bool) -> None:
+    objects = _objects()
+    expected = copy.deepcopy(objects)
+    boundaries = FlatBoundaries.from_cityobjects(objects, release=release)
+    assert boundaries.object_ids == list(expected)
+
+    geom_idx = 0
+    for obj_id, obj in expected.items():
+        for geom, flat_geom in zip(
+            obj.get("geometry", []), objects[obj_id].get("geometry", [])
+        ):
+            if geom["type"] == "GeometryInstance":
+                assert boundaries.instances[geom_idx] == (
+                    0,
+                    3,
+                    geom["transformationMatrix"],
+                )
+                # Instances are not flattened, and always keep their boundaries
+                assert flat_geom == geom
+                with pytest.raises(NotImplementedError):
+                    boundaries.nested(geom_idx)
+            else:
+                assert boundaries.nested(geom_idx) == geom["boundaries"]
+                assert ("boundaries" in flat_geom) != release
+                # The other members are kept
+                assert flat_geom["lod"] == geom["lod"]
+            geom_idx += 1
+    assert geom_idx == len(boundaries.geometry_types)
+
+    # The vertex indices can be remapped
+    mapping = np.arange(16)[::-1]
+    assert boundaries.nested(0, mapping=mapping) == [
+        [[15, 14, 13, 12], [11, 10, 9], [8, 9, 10]]
+    ]
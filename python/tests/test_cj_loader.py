@@ -0,0 +1,213 @@
+import os
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+import trimesh
+
+from conftest import add_templates, write_city, write_city_seq
+from data_pipeline.cj_loading.cj_loader import (
+    VERTEX_CACHE_SUFFIX,
+    CityjsonFeature,
+    CityjsonLoader,
+    MeshCache,
+)
+
+
+def _sidecars(cj_path: Path) -> list[Path]:
+    return list(cj_path.parent.glob(f"{cj_path.name}.*{VERTEX_CACHE_SUFFIX}"))
+
+
+def test_vertex_cache(city, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    city_model, _ = city
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    expected = CityjsonLoader(cj_path).vertices
+
+    first = CityjsonLoader(cj_path, vertex_cache=True)
+    np.testing.assert_array_equal(first.vertices, expected)
+    assert len(_sidecars(cj_path)) == 1
+
+    # On a cache hit, the vertices of the file are never parsed
+    def fail_load(self: CityjsonLoader) -> None:
+        raise AssertionError("The whole file was parsed.")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(CityjsonLoader, "_cj_load", fail_load)
+        second = CityjsonLoader(cj_path, vertex_cache=True)
+    assert isinstance(second.vertices, np.memmap)
+    np.testing.assert_array_equal(second.vertices, expected)
+    assert second.data["vertices"] == []
+    assert list(second.data["CityObjects"]) == list(city_model["CityObjects"])
+    room = second.mesh("B0-S0-R0", "2")
+    assert room is not None
+    np.testing.assert_allclose(room.bounds, [[0.0, 0.0, 0.0], [4.0, 4.0, 4.0]])
+
+    # A modified input gets a new cache, and the outdated one is removed
+    city_model["vertices"][0] = [1, 2, 3000]
+    write_city(city_model, cj_path)
+    third = CityjsonLoader(cj_path, vertex_cache=True)
+    np.testing.assert_array_equal(third.vertices[0], [0.001, 0.002, 3.0])
+    assert len(_sidecars(cj_path)) == 1
+
+    # Even if it is rewritten with the same size and modification time
+    stat = cj_path.stat()
+    city_model["vertices"][0] = [4, 5, 6000]
+    write_city(city_model, cj_path)
+    os.utime(cj_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cj_path.stat().st_size == stat.st_size
+    fourth = CityjsonLoader(cj_path, vertex_cache=True)
+    np.testing.assert_array_equal(fourth.vertices[0], [0.004, 0.005, 6.0])
+    assert len(_sidecars(cj_path)) == 1
+
+
+@pytest.mark.parametrize("member", ["attribute", "deep_attribute", "template"])
+def test_vertex_cache_other_vertices(city, tmp_path: Path, member: str) -> None:
+    city_model, _ = city
+    add_templates(city_model)
+    # Another "vertices" member with arrays, after the top-level one in the file
+    objects = city_model.pop("CityObjects")
+    templates = city_model.pop("geometry-templates")
+    if member == "attribute":
+        objects["B0"]["attributes"] = {"vertices": [[1, 2, 3]]}
+    elif member == "deep_attribute":
+        objects["B0"]["attributes"] = {"vertices": [[[1, 2]], [[3, 4]]]}
+    else:
+        templates["vertices"] = [[0.0, 0.0, 0.0]]
+    city_model["CityObjects"] = objects
+    city_model["geometry-templates"] = templates
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    expected = CityjsonLoader(cj_path)
+
+    for cj_data in (
+        CityjsonLoader(cj_path, vertex_cache=True),
+        CityjsonLoader(cj_path, vertex_cache=True),
+        CityjsonLoader(cj_path, geometry=False),
+    ):
+        b0 = cj_data.data["CityObjects"]["B0"]
+        assert b0.get("attributes") == objects["B0"].get("attributes")
+        assert cj_data.data["geometry-templates"] == templates
+        if cj_data.geometry:
+            np.testing.assert_array_equal(cj_data.vertices, expected.vertices)
+    assert len(_sidecars(cj_path)) == 1
+
+
+@pytest.mark.parametrize("suffix", [".city.json", ".city.jsonl"])
+def test_geometry_kept(city, tmp_path: Path, suffix: str) -> None:
+    city_model, features = city
+    cj_path = tmp_path / f"city{suffix}"
+    if suffix == ".city.jsonl":
+        write_city_seq(city_model, features, cj_path)
+    else:
+        write_city(city_model, cj_path)
+
+    def room_geometry(cj_data: CityjsonLoader) -> dict[str, Any]:
+        if cj_data.is_sequence:
+            objects = cj_data.get_feature("B0").objects
+        else:
+            objects = cj_data.data["CityObjects"]
+        return objects["B0-S0-R0"]["geometry"][0]
+
+    # The flat boundaries do not alter the loaded objects
+    cj_data = CityjsonLoader(cj_path)
+    geometry = room_geometry(cj_data)
+    assert geometry["type"] == "Solid"
+    # One shell of six faces
+    assert [len(shell) for shell in geometry["boundaries"]] == [6]
+
+    # They are only released in low-memory mode
+    low_memory = CityjsonLoader(cj_path, low_memory=True)
+    assert "boundaries" not in room_geometry(low_memory)
+    room = low_memory.mesh("B0-S0-R0", "2")
+    assert room is not None
+    np.testing.assert_allclose(room.bounds, [[0.0, 0.0, 0.0], [4.0, 4.0, 4.0]])
+
+
+def test_mesh_cache_lru() -> None:
+    box = {"2": trimesh.creation.box()}
+    box_bytes = box["2"].vertices.nbytes + box["2"].faces.nbytes
+    cache = MeshCache(max_bytes=2 * box_bytes)
+    cache.put("a", box)
+    cache.put("b", box)
+    cache.put("empty", None)
+    assert cache.get("a") is box
+    # The least recently used object is evicted
+    cache.put("c", box)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache and "empty" in cache
+    assert cache.current_bytes == 2 * box_bytes
+    # Meshes larger than the budget are never cached
+    cache.put("large", {"2": trimesh.creation.icosphere(subdivisions=4)})
+    assert "large" not in cache
+    assert (cache.hits, cache.misses) == (1, 5)
+
+    cache.clear()
+    assert len(cache) == 0 and cache.current_bytes == 0
+    assert (cache.hits, cache.misses) == (1, 5)
+
+
+def test_mesh_cache_loader(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+
+    # Disabled by default, but the misses are counted
+    cj_data = CityjsonLoader(cj_path)
+    assert cj_data.mesh("B0-S0-R0", "2") is not cj_data.mesh("B0-S0-R0", "2")
+    assert len(cj_data.mesh_cache) == 0
+    assert (cj_data.mesh_cache.hits, cj_data.mesh_cache.misses) == (0, 2)
+
+    cj_data = CityjsonLoader(cj_path, mesh_cache_bytes=1024**2)
+    assert cj_data.mesh("B0-S0-R0", "2") is cj_data.mesh("B0-S0-R0", "2")
+    assert (cj_data.mesh_cache.hits, cj_data.mesh_cache.misses) == (1, 1)
+
+
+def test_sequence(city, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    city_model, features = city
+    # The vertices of every feature are transformed with the transform of the header
+    city_model["transform"]["translate"] = [100.0, 200.0, 5.0]
+    cj_data = CityjsonLoader(write_city(city_model, tmp_path / "city.city.json"))
+    cj_seq = CityjsonLoader(
+        write_city_seq(city_model, features, tmp_path / "city.city.jsonl")
+    )
+    assert cj_seq.is_sequence
+    assert cj_seq.n_features == cj_data.n_features == 2
+    # The attributes and hierarchy are loaded, but not the geometry
+    assert list(cj_seq.data["CityObjects"]) == list(city_model["CityObjects"])
+    assert cj_seq.data["CityObjects"]["B0-S0"]["children"] == ["B0-S0-R0", "B0-S0-R1"]
+    assert all("geometry" not in obj for obj in cj_seq.data["CityObjects"].values())
+
+    seq_features = list(cj_seq.iter_features())
+    assert [feature.id for feature in seq_features] == ["B0", "B1"]
+    assert [list(feature.objects) for feature in seq_features] == features
+    for obj_key in city_model["CityObjects"]:
+        expected = cj_data.mesh(obj_key, "2")
+        mesh = cj_seq.mesh(obj_key, "2")
+        if expected is None:
+            assert mesh is None
+            continue
+        assert mesh is not None
+        np.testing.assert_allclose(mesh.bounds, expected.bounds)
+        assert len(mesh.faces) == len(expected.faces)
+    room = cj_seq.mesh("B1-S1-R1", "2")
+    assert room is not None
+    np.testing.assert_allclose(
+        room.bounds, [[125.0, 200.0, 10.0], [129.0, 204.0, 14.0]]
+    )
+
+    # The objects of the same feature are read from the file only once
+    reads: list[str] = []
+    read_feature = CityjsonLoader._cj_read_feature
+
+    def count_reads(self: CityjsonLoader, feature_id: str) -> CityjsonFeature:
+        reads.append(feature_id)
+        return read_feature(self, feature_id)
+
+    monkeypatch.setattr(CityjsonLoader, "_cj_read_feature", count_reads)
+    cj_seq = CityjsonLoader(tmp_path / "city.city.jsonl")
+    feature = cj_seq.get_feature("B0-S0-R0")
+    assert cj_seq.get_feature("B0-S1-R1") is feature
+    assert cj_seq.get_feature("B0") is feature
+    assert cj_seq.get_feature("B1-S0") is not feature
+    assert reads == ["B0", "B1"]
+    with pytest.raises(KeyError):
+        cj_seq.get_feature("missing")
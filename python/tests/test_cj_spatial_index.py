@@ -0,0 +1,108 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import shapely
+
+from conftest import add_templates, write_city, write_city_seq
+from data_pipeline.cj_loading.cj_loader import SPATIAL_INDEX_SUFFIX, CityjsonLoader
+from data_pipeline.cj_loading.cj_spatial_index import SpatialIndex
+
+OBJECT_IDS = ["low", "high", "empty", "far"]
+BOUNDS = np.array(
+    [
+        [0.0, 0.0, 0.0, 1.0, 1.0, 1.0],
+        [5.0, 5.0, 10.0, 6.0, 6.0, 12.0],
+        [np.nan] * 6,
+        [10.0, 0.0, 0.0, 12.0, 2.0, 1.0],
+    ]
+)
+
+
+@pytest.fixture
+def spatial_index() -> SpatialIndex:
+    return SpatialIndex(object_ids=OBJECT_IDS, bounds=BOUNDS)
+
+
+def test_query_bbox(spatial_index: SpatialIndex) -> None:
+    assert spatial_index.query_bbox((-1.0, -1.0, -1.0, 13.0, 13.0, 13.0)) == [
+        "low",
+        "high",
+        "far",
+    ]
+    assert spatial_index.query_bbox((4.5, 4.5, 0.0, 5.5, 5.5, 1.0)) == []
+    assert spatial_index.query_bbox((4.5, 4.5, 11.0, 5.5, 5.5, 11.5)) == ["high"]
+    with pytest.raises(ValueError):
+        spatial_index.query_bbox((0.0, 0.0, 1.0, 1.0, 1.0))
+
+
+def test_query_bbox_2d(spatial_index: SpatialIndex) -> None:
+    # The altitudes span all the objects, whatever their height
+    assert spatial_index.query_bbox((4.5, 4.5, 5.5, 5.5)) == ["high"]
+    assert spatial_index.query_bbox((0.5, 0.5, 11.0, 1.0)) == ["low", "far"]
+    assert spatial_index.query_bbox((2.0, 2.0, 3.0, 3.0)) == []
+
+
+def test_query_empty() -> None:
+    spatial_index = SpatialIndex(object_ids=["empty"], bounds=np.full((1, 6), np.nan))
+    assert spatial_index.query_bbox((-1.0, -1.0, 1.0, 1.0)) == []
+    assert spatial_index.query_bbox((-1.0, -1.0, -1.0, 1.0, 1.0, 1.0)) == []
+    assert spatial_index.query_polygon(shapely.box(-1.0, -1.0, 1.0, 1.0)) == []
+
+
+def test_query_polygon(spatial_index: SpatialIndex) -> None:
+    polygon = shapely.MultiPolygon(
+        [shapely.box(0.5, 0.5, 2.0, 2.0), shapely.box(11.0, 1.0, 13.0, 7.0)]
+    )
+    # "high" is in the bounding box of the polygon, but does not intersect it
+    assert spatial_index.query_bbox(polygon.bounds) == ["low", "high", "far"]
+    assert spatial_index.query_polygon(polygon) == ["low", "far"]
+    assert spatial_index.query_polygon(shapely.box(3.0, 3.0, 4.0, 4.0)) == []
+
+
+def test_save_load(spatial_index: SpatialIndex, tmp_path: Path) -> None:
+    index_path = tmp_path / "index.npz"
+    spatial_index.save(index_path)
+    loaded = SpatialIndex.load(index_path)
+    assert loaded.object_ids == OBJECT_IDS
+    np.testing.assert_array_equal(loaded.bounds, BOUNDS)
+    assert loaded._z_range == spatial_index._z_range == (0.0, 12.0)
+    for bbox in [(4.5, 4.5, 5.5, 5.5), (-1.0, -1.0, -1.0, 13.0, 13.0, 0.5)]:
+        assert loaded.query_bbox(bbox) == spatial_index.query_bbox(bbox)
+
+
+@pytest.mark.parametrize("suffix", [".city.json", ".city.jsonl"])
+def test_loader_query(
+    city, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, suffix: str
+) -> None:
+    city_model, features = city
+    features.append(add_templates(city_model))
+    if suffix == ".city.json":
+        cj_path = write_city(city_model, tmp_path / f"city{suffix}")
+    else:
+        cj_path = write_city_seq(city_model, features, tmp_path / f"city{suffix}")
+
+    cj_data = CityjsonLoader(cj_path, spatial_index_cache=True)
+    # The objects without geometry, like the storeys, are not indexed
+    assert cj_data.query_bbox((1.0, 1.0, 2.0, 2.0)) == [
+        "B0",
+        "B0-S0-R0",
+        "B0-S1-R0",
+    ]
+    assert cj_data.query_bbox((1.0, 1.0, 6.0, 2.0, 2.0, 8.0)) == ["B0", "B0-S1-R0"]
+    # The instances are indexed with the bounds of their transformed template
+    assert cj_data.query_polygon(shapely.Point(1.0, 61.0).buffer(0.5)) == ["T1"]
+    np.testing.assert_allclose(
+        cj_data.spatial_index.bounds[-2], [0.0, 50.0, 0.0, 2.0, 52.0, 3.0]
+    )
+    index_paths = list(tmp_path.glob(f"*{SPATIAL_INDEX_SUFFIX}"))
+    assert len(index_paths) == 1
+
+    # The next loader reads the sidecar file instead of computing the bounds
+    def fail(self: CityjsonLoader) -> None:
+        raise AssertionError("The spatial index was built again")
+
+    monkeypatch.setattr(CityjsonLoader, "object_bounds", fail)
+    cj_data = CityjsonLoader(cj_path, spatial_index_cache=True)
+    assert cj_data.query_bbox((1.0, 1.0, 6.0, 2.0, 2.0, 8.0)) == ["B0", "B0-S1-R0"]
+    assert cj_data.query_polygon(shapely.Point(1.0, 61.0).buffer(0.5)) == ["T1"]
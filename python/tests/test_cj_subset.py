@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from conftest import write_city, write_city_seq
+from data_pipeline.cj_loading.cj_subset import CityjsonSubset
+
+
+@pytest.fixture(params=["json", "jsonl"])
+def city_path(request: pytest.FixtureRequest, city, tmp_path: Path) -> Path:
+    city_model, features = city
+    # A dangling reference must not break the selection
+    city_model["CityObjects"]["B1"]["children"].append("B1-missing")
+    if request.param == "json":
+        return write_city(city_model, tmp_path / "city.city.json")
+    return write_city_seq(city_model, features, tmp_path / "city.city.jsonl")
+
+
+def test_select_room(city_path: Path) -> None:
+    selected = CityjsonSubset(city_path).select(obj_ids=["B0-S0-R1"])
+    # The ancestors are selected, but not the siblings of the room or of its storey
+    assert selected == ["B0", "B0-S0", "B0-S0-R1"]
+
+
+def test_select_storey(city_path: Path) -> None:
+    selected = CityjsonSubset(city_path).select(obj_ids=["B0-S1"])
+    assert selected == ["B0", "B0-S1", "B0-S1-R0", "B0-S1-R1"]
+
+
+def test_select_dangling_reference(city_path: Path) -> None:
+    selected = CityjsonSubset(city_path).select(obj_ids=["B1"])
+    assert selected == [
+        "B1",
+        "B1-S0",
+        "B1-S0-R0",
+        "B1-S0-R1",
+        "B1-S1",
+        "B1-S1-R0",
+        "B1-S1-R1",
+    ]
+
+
+def test_export_room(city_path: Path, tmp_path: Path) -> None:
+    cj_subset = CityjsonSubset(city_path)
+    output_path = tmp_path / "subset.city.json"
+    cj_subset.export(output_path, cj_subset.select(obj_ids=["B0-S0-R1"]))
+    with open(output_path) as cj_file:
+        objects = json.load(cj_file)["CityObjects"]
+    assert set(objects) == {"B0", "B0-S0", "B0-S0-R1"}
+    # The references to the objects that were not exported are removed
+    assert objects["B0"]["children"] == ["B0-S0"]
+    assert objects["B0-S0"]["children"] == ["B0-S0-R1"]
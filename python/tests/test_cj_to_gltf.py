@@ -0,0 +1,201 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+import trimesh
+
+from conftest import add_templates, make_city, write_city, write_city_seq
+from data_pipeline.cj_loading.cj_to_gltf import FAR_LOD, Cityjson2Gltf
+from data_pipeline.utils.gltf_utils import GlbDocument
+
+
+@pytest.fixture
+def exporter(city, tmp_path: Path) -> Cityjson2Gltf:
+    city_model, _ = city
+    cj_data = Cityjson2Gltf(write_city(city_model, tmp_path / "city.city.json"))
+    cj_data.make_gltf_scene()
+    return cj_data
+
+
+def test_tiles_overwrite(exporter: Cityjson2Gltf, tmp_path: Path) -> None:
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    tiles_folder = output_folder / "tiles"
+    tiles_folder.mkdir()
+    user_tile = tiles_folder / "user.glb"
+    user_tile.write_bytes(b"user data")
+
+    # The existing tiles are never removed without `overwrite`
+    with pytest.raises(RuntimeError):
+        exporter.export_tiles(output_folder, max_features=1)
+    assert user_tile.read_bytes() == b"user data"
+    assert not (output_folder / "tileset.json").exists()
+
+    exporter.export(output_folder, overwrite=True, max_tile_features=1)
+    assert not user_tile.exists()
+    assert len(list(tiles_folder.glob("*.glb"))) == 2
+
+
+def test_shards_overwrite(exporter: Cityjson2Gltf, tmp_path: Path) -> None:
+    output_folder = tmp_path / "output"
+    shards_folder = output_folder / "attributes"
+    shards_folder.mkdir(parents=True)
+    user_shard = shards_folder / "user.city.json"
+    user_shard.write_bytes(b"user data")
+
+    # The existing shards are never removed without `overwrite`
+    with pytest.raises(RuntimeError):
+        exporter.write_attribute_shards(output_folder)
+    assert user_shard.read_bytes() == b"user data"
+    assert not (output_folder / "attributes-manifest.json").exists()
+
+    exporter.export(output_folder, overwrite=True, shard_attributes=True)
+    assert not user_shard.exists()
+    # One shard per building, and the index
+    assert len(list(shards_folder.glob("*.city.json"))) == 3
+
+
+@pytest.mark.parametrize("quantization", ["mesh", "file"])
+def test_quantization_not_larger(tmp_path: Path, quantization: str) -> None:
+    # Many small meshes, for which the dequantization matrices cost more than int16 saves
+    city_model, _ = make_city(20)
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    sizes = {}
+    for mode in (None, quantization):
+        cj_data = Cityjson2Gltf(cj_path)
+        cj_data.make_gltf_scene()
+        output_folder = tmp_path / str(mode)
+        cj_data.export(output_folder, quantization=mode)
+        sizes[mode] = (output_folder / "geometry.glb").stat().st_size
+    assert sizes[quantization] <= sizes[None]
+
+
+@pytest.mark.parametrize("suffix", [".city.json", ".city.jsonl"])
+def test_workers_same_output(city, tmp_path: Path, suffix: str) -> None:
+    city_model, features = city
+    cj_path = tmp_path / f"city{suffix}"
+    if suffix == ".city.jsonl":
+        write_city_seq(city_model, features, cj_path)
+    else:
+        write_city(city_model, cj_path)
+    outputs = {}
+    for workers in (1, 2):
+        cj_data = Cityjson2Gltf(cj_path)
+        cj_data.make_gltf_scene(workers=workers)
+        output_folder = tmp_path / f"workers_{workers}"
+        cj_data.export(output_folder)
+        outputs[workers] = {
+            path.name: path.read_bytes() for path in output_folder.iterdir()
+        }
+    assert outputs[1] == outputs[2]
+
+
+def test_attributes_same_as_copy(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    add_templates(city_model)
+    city_model["metadata"] = {"title": "Campus Hoogvliet – ß", "referenceDate": "2024"}
+    city_model["CityObjects"]["B0"]["attributes"] = {"name": "Gebäude", "area": 0.0001}
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    cj_data = Cityjson2Gltf(cj_path)
+    cj_data.make_gltf_scene()
+    cj_data.export(tmp_path / "output")
+
+    # The file written before the streaming writer, from a copy of the data without geometry
+    with open(cj_path) as cj_file:
+        expected = json.load(cj_file)
+    for obj in expected["CityObjects"].values():
+        if "geometry" in obj:
+            obj.pop("geometry")
+    expected["vertices"] = []
+    with open(tmp_path / "expected.city.json", "w") as cj_file:
+        json.dump(expected, cj_file)
+
+    attributes_path = tmp_path / "output" / "attributes.city.json"
+    expected_bytes = (tmp_path / "expected.city.json").read_bytes()
+    assert attributes_path.read_bytes() == expected_bytes
+
+
+def test_far_lod_non_numeric(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    objects = city_model["CityObjects"]
+    # B0 has an additional LoD without number, B1 only has LoDs without number
+    objects["B0"]["geometry"].append(dict(objects["B0"]["geometry"][0], lod=""))
+    for obj_key, obj in objects.items():
+        if obj_key.startswith("B1"):
+            for geom in obj.get("geometry", []):
+                geom["lod"] = ""
+    cj_data = Cityjson2Gltf(write_city(city_model, tmp_path / "city.city.json"))
+    cj_data.make_gltf_scene()
+    cj_data.add_far_lod()
+
+    assert cj_data.lod_nodes[FAR_LOD] == ["B0-lod_far", "B1-lod_far"]
+    # The numeric LoD is preferred: the building and its four rooms, not only the building
+    far_mesh = cj_data.scene.geometry[cj_data.scene.graph["B0-lod_far"][1]]
+    assert len(far_mesh.faces) == 5 * 12
+    far_mesh = cj_data.scene.geometry[cj_data.scene.graph["B1-lod_far"][1]]
+    assert len(far_mesh.faces) == 5 * 12
+
+
+@pytest.mark.parametrize("method", ["optimize_meshes", "deduplicate_meshes"])
+def test_mesh_cache_cleared(city, tmp_path: Path, method: str) -> None:
+    city_model, _ = city
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    cj_data = Cityjson2Gltf(cj_path, mesh_cache_bytes=1024**2)
+    cj_data.make_gltf_scene()
+    assert len(cj_data.mesh_cache) == len(city_model["CityObjects"])
+
+    # The cached meshes are not the ones of the scene anymore
+    getattr(cj_data, method)()
+    assert len(cj_data.mesh_cache) == 0
+
+
+@pytest.mark.parametrize("suffix", [".city.json", ".city.jsonl"])
+def test_template_instances(city, tmp_path: Path, suffix: str) -> None:
+    city_model, features = city
+    tree_ids = add_templates(city_model)
+    features.append(tree_ids)
+    cj_path = tmp_path / f"city{suffix}"
+    if suffix == ".city.jsonl":
+        write_city_seq(city_model, features, cj_path)
+    else:
+        write_city(city_model, cj_path)
+    cj_data = Cityjson2Gltf(cj_path)
+
+    # The template is meshed once, in its own coordinates
+    template_mesh = cj_data.template_mesh(0)
+    assert template_mesh is not None
+    assert cj_data.template_mesh(0) is template_mesh
+    np.testing.assert_allclose(template_mesh.bounds, [[0, 0, 0], [1, 1, 1]])
+    assert len(template_mesh.faces) == 12
+    # The instances are not meshed, only placed
+    assert cj_data.mesh("T1", "1") is None
+    instances = cj_data.instances("T1")
+    assert list(instances) == ["1"]
+    assert instances["1"].template == 0
+    expected_matrix = trimesh.transformations.translation_matrix([0.0, 60.0, 0.0])
+    expected_matrix[:3, :3] = np.diag([2.0, 2.0, 3.0])
+    np.testing.assert_allclose(instances["1"].matrix, expected_matrix)
+    assert cj_data.instances("B0") == {}
+
+    cj_data.make_gltf_scene()
+    assert cj_data.lod_nodes["1"] == ["T0-lod_1", "T1-lod_1"]
+    assert [name for name in cj_data.scene.geometry if "template" in name] == [
+        "template_0"
+    ]
+    for i, node_name in enumerate(cj_data.lod_nodes["1"]):
+        matrix, geom_name = cj_data.scene.graph[node_name]
+        assert geom_name == "template_0"
+        bounds = trimesh.transform_points(template_mesh.bounds, matrix)
+        np.testing.assert_allclose(
+            bounds, [[0.0, 50.0 + 10.0 * i, 0.0], [2.0, 52.0 + 10.0 * i, 3.0]]
+        )
+
+    # The glTF nodes of the instances share the mesh of the template
+    cj_data.export(tmp_path / "output")
+    gltf = GlbDocument.from_bytes(
+        (tmp_path / "output" / "geometry.glb").read_bytes()
+    ).gltf
+    nodes = {node["name"]: node for node in gltf["nodes"]}
+    assert nodes["T0-lod_1"]["mesh"] == nodes["T1-lod_1"]["mesh"]
+    assert nodes["T0-lod_1"]["mesh"] != nodes["B0-lod_2"]["mesh"]
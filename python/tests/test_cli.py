@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from data_pipeline import cli
+from data_pipeline.utils import triangulation_cache
+
+pytestmark = pytest.mark.usefixtures("cli_state")
+
+
+def test_triangulation_cache_disabled_by_default() -> None:
+    result = CliRunner().invoke(cli.app, ["format_codelist", "--help"])
+    assert result.exit_code == 0
+    assert triangulation_cache.get_cache() is None
+
+
+def test_triangulation_cache_path(tmp_path: Path) -> None:
+    cache_path = tmp_path / "triangulations.sqlite"
+    result = CliRunner().invoke(
+        cli.app,
+        [
+            "--triangulation-cache",
+            "--triangulation-cache-path",
+            str(cache_path),
+            "format_codelist",
+            "--help",
+        ],
+    )
+    assert result.exit_code == 0
+    cache = triangulation_cache.get_cache()
+    assert cache is not None
+    assert cache.path == cache_path
@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+import trimesh
+from numpy.typing import NDArray
+
+from data_pipeline.utils.geometry_utils import (
+    MeshAssembler,
+    _triangulate_surface_3d,
+    classify_convex_planar_rings,
+    fan_triangulate_rings,
+    merge_trimeshes,
+)
+
+# Rings in the XY plane, with whether they can be fan-triangulated
+RINGS = {
+    "triangle": ([[0, 0, 0], [2, 0, 0], [0, 1, 0]], True),
+    "convex_quad": ([[0, 0, 0], [2, 0, 0], [3, 2, 0], [0, 1, 0]], True),
+    # Starts on a vertex from which the fan goes outside of the ring
+    "concave_l": (
+        [[2, 1, 0], [1, 1, 0], [1, 2, 0], [0, 2, 0], [0, 0, 0], [2, 0, 0]],
+        False,
+    ),
+    "non_planar": ([[0, 0, 0], [2, 0, 0], [2, 2, 1], [0, 2, 0]], False),
+    "collinear": ([[0, 0, 0], [1, 0, 0], [2, 0, 0], [2, 2, 0], [0, 2, 0]], False),
+    "self_intersecting": ([[0, 0, 0], [2, 2, 0], [2, 0, 0], [0, 2, 0]], False),
+}
+
+
+def _open_boxes() -> list[trimesh.Trimesh]:
+    # Inverted boxes without their top faces, so that filling the holes adds faces and closes them
+    meshes = []
+    for i in range(2):
+        box = trimesh.creation.box(extents=(1.0, 1.0, 1.0))
+        box.apply_translation((2.0 * i, 0.0, 0.0))
+        top = box.face_normals[:, 2] > 0.5
+        meshes.append(
+            trimesh.Trimesh(
+                vertices=box.vertices, faces=box.faces[~top][:, ::-1], process=False
+            )
+        )
+    return meshes
+
+
+def _baseline_merge(meshes: list[trimesh.Trimesh]) -> trimesh.Trimesh:
+    # The repair sequence of `merge_trimeshes` before the meshes were assembled
+    full_mesh = trimesh.util.concatenate(meshes)
+    full_mesh.process(validate=True)
+    full_mesh.update_faces(full_mesh.unique_faces())
+    full_mesh.fix_normals()
+    full_mesh.fill_holes()
+    return full_mesh
+
+
+def test_fix_geometry_unchanged() -> None:
+    expected = _baseline_merge(_open_boxes())
+    merged = merge_trimeshes(_open_boxes(), fix_geometry=True)
+    assembler = MeshAssembler()
+    for mesh in _open_boxes():
+        assembler.add(np.asarray(mesh.vertices), np.asarray(mesh.faces))
+    assembled = assembler.to_trimesh(fix_geometry=True)
+    for mesh in (merged, assembled):
+        assert np.array_equal(mesh.vertices, expected.vertices)
+        assert np.array_equal(mesh.faces, expected.faces)
+
+
+def _to_3d(points: list[list[int]]) -> NDArray[np.float64]:
+    # Tilt the ring and move it far from the origin, like real coordinates
+    a, b = 0.3, 0.7
+    rotation_x = np.array(
+        [[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]]
+    )
+    rotation_y = np.array(
+        [[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]]
+    )
+    return np.asarray(points, dtype=np.float64) @ (rotation_y @ rotation_x).T + [
+        85000.0,
+        446000.0,
+        5.0,
+    ]
+
+
+def _triangle_normals(
+    vertices: NDArray[np.float64], faces: NDArray[np.int64]
+) -> NDArray[np.float64]:
+    triangles = vertices[faces]
+    return np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+
+
+def _same_surface(
+    vertices: NDArray[np.float64],
+    faces: NDArray[np.int64],
+    expected_vertices: NDArray[np.float64],
+    expected_faces: NDArray[np.int64],
+) -> bool:
+    # Same area, no degenerate triangles and all the triangles in the same plane.
+    # The orientation is not compared, as the projection of `_triangulate_surface_3d` can flip it.
+    normals = _triangle_normals(vertices, faces)
+    expected_normals = _triangle_normals(expected_vertices, expected_faces)
+    areas = np.linalg.norm(normals, axis=1)
+    if np.any(areas < 1e-9):
+        return False
+    if not np.isclose(areas.sum(), np.linalg.norm(expected_normals, axis=1).sum()):
+        return False
+    direction = expected_normals[0] / np.linalg.norm(expected_normals[0])
+    return bool(np.allclose(np.abs(normals / areas[:, None] @ direction), 1.0))
+
+
+def test_classify_convex_planar_rings() -> None:
+    ring_vertices = [_to_3d(points) for points, _ in RINGS.values()]
+    vertices = np.concatenate(ring_vertices)
+    lengths = [len(ring) for ring in ring_vertices]
+    ring_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    ring_indices = np.arange(ring_offsets[-1])
+
+    is_convex = classify_convex_planar_rings(ring_indices, ring_offsets, vertices)
+    assert is_convex.tolist() == [convex for _, convex in RINGS.values()]
+
+    # A ring with too few vertices is rejected
+    assert not classify_convex_planar_rings(
+        np.arange(2), np.array([0, 2]), vertices
+    ).any()
+    assert classify_convex_planar_rings(
+        np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), vertices
+    ).shape == (0,)
+
+
+@pytest.mark.parametrize("name", list(RINGS))
+def test_fan_triangulate_rings(name: str) -> None:
+    points, convex = RINGS[name]
+    vertices = _to_3d(points)
+    ring_indices = np.arange(len(vertices))
+    ring_offsets = np.array([0, len(vertices)])
+    faces = fan_triangulate_rings(ring_indices, ring_offsets)
+    assert faces.shape == (len(vertices) - 2, 3)
+
+    tri_vertices, tri_faces, worked = _triangulate_surface_3d(
+        ring_indices, [], vertices
+    )
+    if name == "non_planar":
+        assert not worked
+        return
+    assert worked
+    # The fan is only right for the rings classified as convex and planar
+    assert _same_surface(vertices, faces, tri_vertices, tri_faces) == convex
+    if convex:
+        # The triangles keep the orientation of the ring
+        ring_normal = np.cross(vertices, np.roll(vertices, -1, axis=0)).sum(axis=0)
+        assert np.all(_triangle_normals(vertices, faces) @ ring_normal > 0)
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+import trimesh
+
+from data_pipeline.utils.gltf_utils import (
+    INSTANCE_NODES_EXTRAS,
+    INSTANCING_EXTENSION,
+    GlbDocument,
+    _world_matrices,
+    instance_glb,
+    quantize_glb,
+)
+
+
+def _scene() -> trimesh.Scene:
+    """
+    Build a scene of buildings whose LoD nodes share a box mesh at different positions, and one building with its own mesh.
+    """
+    scene = trimesh.Scene()
+    scene.geometry["box"] = trimesh.creation.box(extents=(4.0, 3.0, 2.0))
+    for b in range(4):
+        scene.graph.update(frame_to=f"B{b}", frame_from=scene.graph.base_frame)
+        scene.graph.update(
+            frame_to=f"B{b}-lod_2",
+            frame_from=f"B{b}",
+            matrix=trimesh.transformations.translation_matrix(
+                [85000.0 + 10.0 * b, 445000.0, 1.5 * b]
+            ),
+            geometry="box",
+        )
+    scene.graph.update(frame_to="B4", frame_from=scene.graph.base_frame)
+    scene.add_geometry(
+        trimesh.creation.icosphere(),
+        geom_name="sphere",
+        node_name="B4-lod_2",
+        parent_node_name="B4",
+        transform=trimesh.transformations.translation_matrix([85050.0, 445000.0, 0]),
+    )
+    return scene
+
+
+def _node_geometry(glb: bytes) -> dict[str, np.ndarray]:
+    """
+    Find the world positions of the geometry of every named node, through the instances if it was instanced.
+    """
+    document = GlbDocument.from_bytes(glb)
+    gltf = document.gltf
+    nodes = gltf["nodes"]
+    world = _world_matrices(gltf)
+
+    def positions(mesh_idx: int, matrix: np.ndarray) -> np.ndarray:
+        primitive = gltf["meshes"][mesh_idx]["primitives"][0]
+        local = document.accessor_array(primitive["attributes"]["POSITION"])
+        homogeneous = np.column_stack((local.astype(np.float64), np.ones(len(local))))
+        return (homogeneous @ matrix.T)[:, :3]
+
+    geometry: dict[str, np.ndarray] = {}
+    for node_idx, node in enumerate(nodes):
+        if "mesh" not in node:
+            continue
+        instancing = node.get("extensions", {}).get(INSTANCING_EXTENSION)
+        if instancing is None:
+            geometry[node["name"]] = positions(node["mesh"], world[node_idx])
+            continue
+        translations = document.accessor_array(
+            instancing["attributes"]["TRANSLATION"]
+        ).astype(np.float64)
+        names = node["extras"][INSTANCE_NODES_EXTRAS]
+        assert len(names) == len(translations)
+        for name, translation in zip(names, translations):
+            matrix = world[node_idx] @ trimesh.transformations.translation_matrix(
+                translation
+            )
+            geometry[name] = positions(node["mesh"], matrix)
+    return geometry
+
+
+@pytest.mark.parametrize("quantization", [None, "mesh", "file"])
+def test_instanced_nodes_resolve(quantization: str | None) -> None:
+    glb = _scene().export(file_type="glb")
+    expected = _node_geometry(glb)
+    node_names = {node["name"] for node in GlbDocument.from_bytes(glb).gltf["nodes"]}
+
+    instanced, n_instanced = instance_glb(glb)
+    assert n_instanced == 1
+    if quantization is not None:
+        instanced, _ = quantize_glb(instanced, per_mesh=quantization == "mesh")
+
+    # The nodes are kept, and every original object key still resolves to its geometry
+    document = GlbDocument.from_bytes(instanced)
+    assert node_names <= {node["name"] for node in document.gltf["nodes"]}
+    resolved = _node_geometry(instanced)
+    assert set(expected) == {f"B{b}-lod_2" for b in range(5)}
+    for name, world_positions in expected.items():
+        assert name in resolved
+        np.testing.assert_allclose(resolved[name], world_positions, atol=2e-3)
+
+
+def _sphere_scene() -> trimesh.Scene:
+    scene = trimesh.Scene()
+    for b in range(3):
+        sphere = trimesh.creation.icosphere(subdivisions=4, radius=10.0)
+        scene.add_geometry(
+            sphere,
+            geom_name=f"sphere_{b}",
+            node_name=f"B{b}-lod_2",
+            transform=trimesh.transformations.translation_matrix(
+                [85000.0 + 30.0 * b, 445000.0, 0.0]
+            ),
+        )
+    return scene
+
+
+@pytest.mark.parametrize("per_mesh", [True, False])
+def test_quantize_large_meshes(per_mesh: bool) -> None:
+    glb = _sphere_scene().export(file_type="glb")
+    expected = _node_geometry(glb)
+
+    quantized, max_error = quantize_glb(glb, per_mesh=per_mesh, max_error=1e-3)
+    assert len(quantized) < 0.75 * len(glb)
+    assert 0 < max_error <= 1e-3
+    gltf = GlbDocument.from_bytes(quantized).gltf
+    assert "KHR_mesh_quantization" in gltf["extensionsRequired"]
+    for name, world_positions in _node_geometry(quantized).items():
+        # The float32 positions of the input are within 1e-2 at these coordinates
+        np.testing.assert_allclose(world_positions, expected[name], atol=1e-2)
+
+
+def test_quantize_error_bound() -> None:
+    glb = _sphere_scene().export(file_type="glb")
+    # No mesh can be quantized within this error, so only the indices are narrowed
+    quantized, max_error = quantize_glb(glb, max_error=1e-9)
+    assert max_error == 0.0
+    assert "KHR_mesh_quantization" not in GlbDocument.from_bytes(quantized).gltf.get(
+        "extensionsUsed", []
+    )
@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+import trimesh
+
+from data_pipeline.utils import json_io
+from data_pipeline.utils.icon_positions import IconPosition
+
+
+@pytest.fixture(params=json_io.available_backends())
+def backend(request: pytest.FixtureRequest):
+    previous = json_io.get_backend()
+    json_io.set_backend(request.param)
+    yield request.param
+    json_io.set_backend(previous)
+
+
+def test_numpy_values(backend: str) -> None:
+    obj = {
+        "float64": np.float64(1.5),
+        "float32": np.float32(0.25),
+        "int64": np.int64(3),
+        "bool": np.bool_(True),
+        "array": np.array([[1.0, 2.0], [3.0, 4.0]]),
+        "nested": [np.float64(-2.0), {"int32": np.int32(7)}],
+    }
+    expected = {
+        "float64": 1.5,
+        "float32": 0.25,
+        "int64": 3,
+        "bool": True,
+        "array": [[1.0, 2.0], [3.0, 4.0]],
+        "nested": [-2.0, {"int32": 7}],
+    }
+    assert json.loads(json_io.dumps_bytes(obj)) == expected
+    assert json.loads(json_io.dumps(obj)) == expected
+
+
+STDLIB_CASES = [
+    {"name": "Café Ørsted – 東京", "emoji": "🏠", "escapes": 'a"b\\c\n\x1f'},
+    [1e-05, 1e-07, 0.0001, 0.1, 1.5, 1e15, 1e16, 1.5e17, 1e300, 5e-324, -0.0],
+    {"int": 12345678901234567890, "bool": False, "none": None, "empty": [{}, []]},
+]
+
+
+@pytest.mark.parametrize("obj", STDLIB_CASES)
+def test_same_bytes_as_stdlib(backend: str, obj: Any, tmp_path: Path) -> None:
+    assert json_io.dumps(obj) == json.dumps(obj)
+    assert json_io.dumps_bytes(obj) == json.dumps(obj).encode()
+    assert (
+        json_io.dumps_bytes(obj, compact=True)
+        == json.dumps(obj, separators=(",", ":")).encode()
+    )
+    json_path = tmp_path / "data.json"
+    json_io.dump(obj, json_path)
+    with open(tmp_path / "stdlib.json", "w") as json_file:
+        json.dump(obj, json_file)
+    assert json_path.read_bytes() == (tmp_path / "stdlib.json").read_bytes()
+    assert json_io.load(json_path) == obj
+
+
+def test_unknown_type(backend: str) -> None:
+    with pytest.raises(TypeError):
+        json_io.dumps({"value": object()})
+
+
+def test_icon_position(backend: str) -> None:
+    mesh = trimesh.creation.box(extents=(2.0, 2.0, 2.0))
+    icon_position = IconPosition.from_mesh(mesh, z_offset=1.0)
+    # Positions built from NumPy arrays elsewhere must serialise as well
+    raw_position = IconPosition.from_list(list(np.array([1.0, 2.0, 3.0])))
+    data = json.loads(
+        json_io.dumps(
+            {
+                "icon_position": icon_position.to_list(),
+                "raw": raw_position.to_list(),
+            }
+        )
+    )
+    assert data["icon_position"] == pytest.approx(icon_position.to_list())
+    assert data["raw"] == [1.0, 2.0, 3.0]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import trimesh
+
+from data_pipeline.utils.mesh_optimization import acmr, optimize_vertex_cache, tipsify
+
+
+def _grid(n: int) -> trimesh.Trimesh:
+    x, y = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")
+    vertices = np.column_stack((x.ravel(), y.ravel(), np.zeros(x.size)))
+    corners = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).ravel()
+    faces = np.concatenate(
+        (
+            np.column_stack((corners, corners + n + 1, corners + 1)),
+            np.column_stack((corners + 1, corners + n + 1, corners + n + 2)),
+        )
+    )
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+
+def _shuffled(mesh: trimesh.Trimesh, seed: int = 0) -> trimesh.Trimesh:
+    rng = np.random.default_rng(seed)
+    vertex_order = rng.permutation(len(mesh.vertices))
+    new_indices = np.empty_like(vertex_order)
+    new_indices[vertex_order] = np.arange(len(vertex_order))
+    return trimesh.Trimesh(
+        vertices=mesh.vertices[vertex_order],
+        faces=new_indices[mesh.faces[rng.permutation(len(mesh.faces))]],
+        process=False,
+    )
+
+
+MESHES = {
+    "box": trimesh.creation.box(),
+    "sphere": trimesh.creation.icosphere(subdivisions=3),
+    "grid": _grid(20),
+    "shuffled_sphere": _shuffled(trimesh.creation.icosphere(subdivisions=3)),
+    "shuffled_grid": _shuffled(_grid(20)),
+}
+
+
+def test_acmr() -> None:
+    assert acmr(np.zeros((0, 3), dtype=np.int64)) == 0.0
+    assert acmr(np.array([[0, 1, 2]])) == 3.0
+    assert acmr(np.array([[0, 1, 2], [2, 1, 3]])) == 2.0
+    # The first triangle is evicted from a cache of 3 vertices, but not from a cache of 6
+    faces = np.array([[0, 1, 2], [3, 4, 5], [0, 1, 2]])
+    assert acmr(faces, cache_size=3) == 3.0
+    assert acmr(faces, cache_size=6) == 2.0
+
+
+def _triangle_set(vertices: np.ndarray, faces: np.ndarray) -> list[tuple]:
+    # The triangles as coordinates, starting at their smallest vertex to keep their orientation
+    result = []
+    for triangle in vertices[faces].tolist():
+        points = [tuple(point) for point in triangle]
+        first = points.index(min(points))
+        result.append(tuple(points[first:] + points[:first]))
+    return sorted(result)
+
+
+@pytest.mark.parametrize("name", list(MESHES))
+def test_tipsify(name: str) -> None:
+    mesh = MESHES[name]
+    faces = np.asarray(mesh.faces, dtype=np.int64)
+    order = tipsify(faces, len(mesh.vertices))
+    assert np.array_equal(np.sort(order), np.arange(len(faces)))
+    if name.startswith("shuffled"):
+        assert acmr(faces[order]) < 0.75 * acmr(faces)
+
+
+@pytest.mark.parametrize("name", list(MESHES))
+@pytest.mark.parametrize("cache_size", [4, 16, 32])
+def test_optimize_vertex_cache(name: str, cache_size: int) -> None:
+    mesh = MESHES[name]
+    optimized, acmr_before, acmr_after = optimize_vertex_cache(
+        mesh, cache_size=cache_size
+    )
+    # The ACMR is never worse, and the triangles are the same
+    assert acmr_before == acmr(mesh.faces, cache_size=cache_size)
+    assert acmr_after == acmr(optimized.faces, cache_size=cache_size)
+    assert acmr_after <= acmr_before
+    assert _triangle_set(optimized.vertices, optimized.faces) == _triangle_set(
+        mesh.vertices, mesh.faces
+    )
+    if optimized is mesh:
+        assert acmr_after == acmr_before
+        return
+    # The vertices are in the order of their first use
+    _, first_use = np.unique(optimized.faces.reshape(-1), return_index=True)
+    assert np.all(np.diff(first_use) > 0)
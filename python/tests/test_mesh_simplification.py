@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import trimesh
+
+from data_pipeline.utils.mesh_simplification import simplify_mesh, simplify_quadric
+
+
+def _sphere() -> trimesh.Trimesh:
+    # Far from the origin, like real coordinates
+    sphere = trimesh.creation.icosphere(subdivisions=3, radius=10.0)
+    sphere.apply_translation([85000.0, 446000.0, 5.0])
+    return sphere
+
+
+def _grid(n: int = 12) -> trimesh.Trimesh:
+    x, y = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")
+    vertices = np.column_stack((x.ravel(), y.ravel(), np.full(x.size, 5.0)))
+    corners = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).ravel()
+    faces = np.concatenate(
+        (
+            np.column_stack((corners, corners + n + 1, corners + 1)),
+            np.column_stack((corners + 1, corners + n + 1, corners + n + 2)),
+        )
+    )
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+
+def _distance(mesh: trimesh.Trimesh, other: trimesh.Trimesh) -> float:
+    # Largest distance from the vertices of a mesh to the surface of the other, both ways
+    return max(
+        trimesh.proximity.closest_point(other, mesh.vertices)[1].max(),
+        trimesh.proximity.closest_point(mesh, other.vertices)[1].max(),
+    )
+
+
+@pytest.mark.parametrize("max_faces", [32, 64, 128, 512])
+def test_face_budget(max_faces: int) -> None:
+    sphere = _sphere()
+    simplified = simplify_quadric(sphere, max_faces=max_faces)
+    assert max_faces - 2 <= len(simplified.faces) <= max_faces
+    # The collapses keep the mesh closed, and most of its volume
+    assert simplified.is_watertight
+    assert simplified.volume > 0.8 * sphere.volume
+
+
+def test_face_budget_planar() -> None:
+    # A planar mesh is simplified without error, and its border is kept
+    grid = _grid()
+    simplified = simplify_quadric(grid, max_faces=2, max_error=1e-6)
+    assert len(simplified.faces) == 2
+    np.testing.assert_allclose(simplified.bounds, grid.bounds)
+    assert simplified.area == pytest.approx(grid.area)
+
+
+@pytest.mark.parametrize("max_error", [0.05, 0.2, 0.5, 1.0])
+def test_max_error(max_error: float) -> None:
+    sphere = _sphere()
+    simplified = simplify_quadric(sphere, max_faces=16, max_error=max_error)
+    assert len(simplified.faces) > 16
+    assert _distance(simplified, sphere) <= max_error
+
+
+def test_simplify_mesh() -> None:
+    sphere = _sphere()
+    # A mesh already within the budget is kept as it is
+    assert simplify_mesh(sphere, max_faces=len(sphere.faces)) is sphere
+    simplified = simplify_mesh(sphere, max_faces=100, max_error=0.5)
+    assert 100 <= len(simplified.faces) < len(sphere.faces)
+    assert _distance(simplified, sphere) <= 0.5
+    assert len(simplify_mesh(sphere, max_faces=100).faces) <= 100
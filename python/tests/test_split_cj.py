@@ -0,0 +1,466 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+import trimesh
+from numpy.typing import NDArray
+from typer.testing import CliRunner
+
+from conftest import add_templates, write_city, write_city_seq
+from data_pipeline import cli
+from data_pipeline.cj_loading import cj_loader
+from data_pipeline.utils.gltf_utils import (
+    FEATURE_ID_ATTRIBUTE,
+    FEATURES_EXTENSION,
+    GlbDocument,
+    _world_matrices,
+)
+from data_pipeline.utils.mesh_optimization import acmr
+
+pytestmark = pytest.mark.usefixtures("cli_state")
+
+
+@pytest.fixture(params=[".city.json", ".city.jsonl"])
+def city_path(request: pytest.FixtureRequest, city, tmp_path: Path) -> Path:
+    city_model, features = city
+    # The buildings also have a LoD 1, the rooms only have a LoD 2
+    for b in range(2):
+        building = city_model["CityObjects"][f"B{b}"]
+        building["geometry"].insert(0, dict(building["geometry"][0], lod="1"))
+        building["attributes"] = {"name": f"Gebäude {b}", "area": 1e-05 + b}
+    if request.param == ".city.json":
+        return write_city(city_model, tmp_path / "city.city.json")
+    return write_city_seq(city_model, features, tmp_path / "city.city.jsonl")
+
+
+def run_split_cj(cj_path: Path, output_folder: Path, *options: str) -> Path:
+    result = CliRunner().invoke(
+        cli.app, ["split_cj", str(cj_path), str(output_folder), "-o", *options]
+    )
+    assert result.exit_code == 0, result.output
+    return output_folder
+
+
+def glb_nodes(glb_path: Path) -> dict[str, int | None]:
+    """
+    Read the names of the nodes of a glb file, mapped to the index of their mesh, or None if they have no mesh.
+    """
+    gltf = GlbDocument.from_bytes(glb_path.read_bytes()).gltf
+    return {node["name"]: node.get("mesh") for node in gltf["nodes"]}
+
+
+def object_nodes(lods: dict[str, list[str]]) -> list[str]:
+    """
+    Names of the nodes of all the objects, in the order of the file, followed by the names of their LoD nodes.
+    """
+    names = []
+    for b in range(2):
+        for suffix in ["", "-S0", "-S0-R0", "-S0-R1", "-S1", "-S1-R0", "-S1-R1"]:
+            obj_id = f"B{b}{suffix}"
+            names.append(obj_id)
+            names.extend(f"{obj_id}-lod_{lod}" for lod in lods.get(obj_id, []))
+    return names
+
+
+def glb_parents(glb_path: Path) -> dict[str, str | None]:
+    """
+    Read the name of the parent of every node of a glb file, or None for the root nodes of the scene.
+    """
+    gltf = GlbDocument.from_bytes(glb_path.read_bytes()).gltf
+    names = [node["name"] for node in gltf["nodes"]]
+    parents: dict[str, str | None] = {name: None for name in names}
+    for node in gltf["nodes"]:
+        for child in node.get("children", []):
+            assert parents[names[child]] is None
+            parents[names[child]] = node["name"]
+    roots = gltf["scenes"][gltf.get("scene", 0)]["nodes"]
+    assert sorted(names[root] for root in roots) == sorted(
+        name for name, parent in parents.items() if parent is None
+    )
+    return parents
+
+
+def glb_triangles(glb_path: Path) -> dict[str, NDArray[np.float64]]:
+    """
+    Read the triangles (T, 3, 3) of the mesh of every node of a glb file, in world coordinates.
+    """
+    document = GlbDocument.from_bytes(glb_path.read_bytes())
+    gltf = document.gltf
+    world = _world_matrices(gltf)
+    triangles = {}
+    for node_idx, node in enumerate(gltf["nodes"]):
+        if "mesh" not in node:
+            continue
+        node_triangles = []
+        for primitive in gltf["meshes"][node["mesh"]]["primitives"]:
+            positions = document.accessor_array(primitive["attributes"]["POSITION"])
+            positions = np.column_stack((positions, np.ones(len(positions))))
+            positions = (positions @ world[node_idx].T)[:, :3]
+            faces = document.accessor_array(primitive["indices"]).reshape(-1, 3)
+            node_triangles.append(positions[faces])
+        triangles[node["name"]] = np.concatenate(node_triangles)
+    return triangles
+
+
+def glb_feature_ids(glb_path: Path) -> dict[str, NDArray[np.int64]]:
+    """
+    Read the feature id of every triangle of the mesh of every node of a glb file, in the order of `glb_triangles`.
+    """
+    document = GlbDocument.from_bytes(glb_path.read_bytes())
+    gltf = document.gltf
+    feature_ids = {}
+    for node in gltf["nodes"]:
+        if "mesh" not in node:
+            continue
+        node_ids = []
+        for primitive in gltf["meshes"][node["mesh"]]["primitives"]:
+            vertex_ids = document.accessor_array(
+                primitive["attributes"][FEATURE_ID_ATTRIBUTE]
+            ).reshape(-1)
+            faces = document.accessor_array(primitive["indices"]).reshape(-1, 3)
+            # All the vertices of a triangle belong to the same feature
+            assert np.all(vertex_ids[faces] == vertex_ids[faces[:, :1]])
+            feature_count = len(np.unique(vertex_ids))
+            assert primitive["extensions"][FEATURES_EXTENSION] == {
+                "featureIds": [{"featureCount": feature_count, "attribute": 0}]
+            }
+            node_ids.append(vertex_ids[faces[:, 0]])
+        feature_ids[node["name"]] = np.concatenate(node_ids).astype(np.int64)
+    return feature_ids
+
+
+def triangle_set(triangles: NDArray[np.float64]) -> list[tuple]:
+    """
+    Sort the triangles and start every one at its smallest vertex, keeping its orientation, to compare them in any order.
+    """
+    result = []
+    for triangle in np.round(triangles, 3).tolist():
+        vertices = [tuple(vertex) for vertex in triangle]
+        first = vertices.index(min(vertices))
+        result.append(tuple(vertices[first:] + vertices[:first]))
+    return sorted(result)
+
+
+def triangle_faces(triangles: NDArray[np.float64]) -> NDArray[np.int64]:
+    """
+    Index the vertices of the triangles (T, 3, 3), to get the faces (T, 3) of the mesh.
+    """
+    _, inverse = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    return inverse.reshape(-1, 3)
+
+
+def city_lods(lods: list[str] | None = None) -> dict[str, list[str]]:
+    """
+    LoDs of the objects of the city of `city_path`, limited to `lods` if given.
+    """
+    obj_lods = {}
+    for obj_id in object_nodes({}):
+        if "-S" not in obj_id:
+            obj_lods[obj_id] = ["1", "2"]
+        elif "-R" in obj_id:
+            obj_lods[obj_id] = ["2"]
+        else:
+            obj_lods[obj_id] = []
+    if lods is None:
+        return obj_lods
+    return {
+        obj_id: [lod for lod in obj_lods[obj_id] if lod in lods] for obj_id in obj_lods
+    }
+
+
+def test_attributes_only(city_path: Path, tmp_path: Path) -> None:
+    output_folder = run_split_cj(city_path, tmp_path / "output", "--attributes-only")
+    assert [path.name for path in output_folder.iterdir()] == ["attributes.city.json"]
+    with open(output_folder / "attributes.city.json") as cj_file:
+        objects = json.load(cj_file)["CityObjects"]
+    assert list(objects) == object_nodes({})
+    assert all("geometry" not in obj for obj in objects.values())
+    assert objects["B1"]["attributes"] == {"name": "Gebäude 1", "area": 1.00001}
+    assert objects["B1"]["children"] == ["B1-S0", "B1-S1"]
+    assert objects["B1-S1-R0"]["parents"] == ["B1-S1"]
+
+    # The attributes are the same as the ones written with the geometry
+    full_folder = run_split_cj(city_path, tmp_path / "full")
+    assert (full_folder / "geometry.glb").exists()
+    assert (output_folder / "attributes.city.json").read_bytes() == (
+        full_folder / "attributes.city.json"
+    ).read_bytes()
+
+
+@pytest.mark.parametrize("lods", [["1"], ["2"], ["2", "1"]])
+def test_lods(
+    city_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, lods: list[str]
+) -> None:
+    converted: list[str] = []
+    geometry_to_mesh = cj_loader._cj_geometry_to_mesh
+
+    def count_conversions(boundaries, geom_idx, vertices):
+        converted.append(boundaries.geometry_lods[geom_idx])
+        return geometry_to_mesh(boundaries, geom_idx, vertices)
+
+    monkeypatch.setattr(cj_loader, "_cj_geometry_to_mesh", count_conversions)
+    options = [option for lod in lods for option in ["--lod", lod]]
+    output_folder = run_split_cj(city_path, tmp_path / "output", *options)
+
+    # The other LoDs are never triangulated
+    expected_lods = city_lods(lods)
+    assert sorted(converted) == sorted(
+        lod for obj_lods in expected_lods.values() for lod in obj_lods
+    )
+    # All the objects keep their node, but only the nodes of the LoDs have a mesh
+    nodes = glb_nodes(output_folder / "geometry.glb")
+    assert list(nodes) == object_nodes(expected_lods)
+    assert [name for name, mesh in nodes.items() if mesh is not None] == [
+        name for name in nodes if "-lod_" in name
+    ]
+
+
+@pytest.mark.parametrize("suffix", [".city.json", ".city.jsonl"])
+def test_low_memory(city, tmp_path: Path, suffix: str) -> None:
+    city_model, features = city
+    features.append(add_templates(city_model))
+    cj_path = tmp_path / f"city{suffix}"
+    if suffix == ".city.jsonl":
+        write_city_seq(city_model, features, cj_path)
+    else:
+        write_city(city_model, cj_path)
+
+    outputs = {}
+    for options in [[], ["--low-memory"]]:
+        output_folder = run_split_cj(
+            cj_path, tmp_path / f"output{len(options)}", *options
+        )
+        outputs[len(options)] = {
+            path.name: path.read_bytes() for path in sorted(output_folder.iterdir())
+        }
+    # Releasing the input while converting it does not change the output
+    assert list(outputs[1]) == ["attributes.city.json", "geometry.glb"]
+    assert outputs[1] == outputs[0]
+    nodes = glb_nodes(tmp_path / "output1" / "geometry.glb")
+    assert list(nodes) == object_nodes(city_lods(["2"])) + [
+        "T0",
+        "T0-lod_1",
+        "T1",
+        "T1-lod_1",
+    ]
+    assert nodes["T0-lod_1"] == nodes["T1-lod_1"]
+
+
+def test_hierarchy(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    objects = city_model["CityObjects"]
+    # A child referenced but missing from the file still gets a node
+    objects["B1"]["children"].append("B1-missing")
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    output_folder = run_split_cj(cj_path, tmp_path / "output")
+
+    parents = glb_parents(output_folder / "geometry.glb")
+    expected: dict[str, str | None] = {}
+    for obj_id, obj in objects.items():
+        expected[obj_id] = obj["parents"][0] if "parents" in obj else None
+        if "geometry" in obj:
+            expected[f"{obj_id}-lod_2"] = obj_id
+    expected["B1-missing"] = "B1"
+    assert parents == expected
+    # The nodes are in the order of the file
+    assert list(parents) == object_nodes(city_lods(["2"])) + ["B1-missing"]
+
+
+def test_split_lods(city_path: Path, tmp_path: Path) -> None:
+    output_folder = run_split_cj(city_path, tmp_path / "output", "--split-lods")
+    assert sorted(path.name for path in output_folder.iterdir()) == [
+        "attributes.city.json",
+        "geometry-lod_1.glb",
+        "geometry-lod_2.glb",
+        "geometry-lods.json",
+    ]
+    with open(output_folder / "geometry-lods.json") as index_file:
+        assert json.load(index_file) == {
+            "lods": {
+                "1": {"uri": "geometry-lod_1.glb", "meshes": 2},
+                "2": {"uri": "geometry-lod_2.glb", "meshes": 10},
+            }
+        }
+
+    # Every file has the hierarchy and the meshes of its LoD, named as in geometry.glb
+    full_folder = run_split_cj(city_path, tmp_path / "full")
+    full_parents = glb_parents(full_folder / "geometry.glb")
+    full_triangles = glb_triangles(full_folder / "geometry.glb")
+    for lod in ["1", "2"]:
+        lod_path = output_folder / f"geometry-lod_{lod}.glb"
+        expected_names = object_nodes(city_lods([lod]))
+        assert sorted(glb_nodes(lod_path)) == sorted(expected_names)
+        assert glb_parents(lod_path) == {
+            name: full_parents[name] for name in expected_names
+        }
+        lod_triangles = glb_triangles(lod_path)
+        assert sorted(lod_triangles) == sorted(
+            name for name in expected_names if "-lod_" in name
+        )
+        for name, triangles in lod_triangles.items():
+            assert len(triangles) == 12
+            assert triangle_set(triangles) == triangle_set(full_triangles[name])
+
+
+def add_relief(city_model: dict[str, Any], n: int = 12) -> None:
+    """
+    Add a relief of n x n squares, flat in a corner and curved in the opposite one, whose triangles are shuffled to be in a bad order for the vertex cache.
+    """
+    rng = np.random.default_rng(0)
+    scale = city_model["transform"]["scale"][0]
+
+    def height(x: int, y: int) -> float:
+        return (max(x - n / 2, 0) ** 2 + max(y - n / 2, 0) ** 2) / 4
+
+    first = len(city_model["vertices"])
+    city_model["vertices"].extend(
+        [round(x / scale), round((y - 20.0) / scale), round(height(x, y) / scale)]
+        for x in range(n + 1)
+        for y in range(n + 1)
+    )
+    triangles = []
+    for x in range(n):
+        for y in range(n):
+            corner = first + x * (n + 1) + y
+            triangles.append([[corner, corner + n + 1, corner + 1]])
+            triangles.append([[corner + 1, corner + n + 1, corner + n + 2]])
+    city_model["CityObjects"]["relief"] = {
+        "type": "TINRelief",
+        "geometry": [
+            {
+                "type": "CompositeSurface",
+                "lod": "1",
+                "boundaries": [triangles[i] for i in rng.permutation(len(triangles))],
+            }
+        ],
+    }
+
+
+def test_optimize_meshes(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    add_relief(city_model)
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    output_folder = run_split_cj(cj_path, tmp_path / "output", "--optimize-meshes")
+    full_folder = run_split_cj(cj_path, tmp_path / "full")
+
+    # Only the order of the triangles and vertices of the meshes can change
+    nodes = glb_nodes(output_folder / "geometry.glb")
+    assert list(nodes) == object_nodes(city_lods(["2"])) + ["relief", "relief-lod_1"]
+    assert nodes == glb_nodes(full_folder / "geometry.glb")
+    triangles = glb_triangles(output_folder / "geometry.glb")
+    full_triangles = glb_triangles(full_folder / "geometry.glb")
+    assert list(triangles) == list(full_triangles)
+    for name, node_triangles in triangles.items():
+        assert triangle_set(node_triangles) == triangle_set(full_triangles[name])
+
+    # The cache misses of the relief are reduced, and never increased for the other meshes
+    for name, node_triangles in triangles.items():
+        acmr_after = acmr(triangle_faces(node_triangles))
+        acmr_before = acmr(triangle_faces(full_triangles[name]))
+        assert acmr_after <= acmr_before
+        if name == "relief-lod_1":
+            assert acmr_after < 0.75 * acmr_before
+
+
+@pytest.mark.parametrize("group", ["building", "storey"])
+def test_batch(city_path: Path, tmp_path: Path, group: str) -> None:
+    output_folder = run_split_cj(city_path, tmp_path / "output", "--batch", group)
+    full_folder = run_split_cj(city_path, tmp_path / "full")
+
+    expected_tables = {}
+    for b in range(2):
+        building = f"B{b}"
+        expected_tables[f"{building}-lod_1"] = [building]
+        if group == "building":
+            expected_tables[f"{building}-lod_2"] = [
+                building,
+                *[f"{building}-S{s}-R{r}" for s in range(2) for r in range(2)],
+            ]
+        else:
+            expected_tables[f"{building}-lod_2"] = [building]
+            for s in range(2):
+                storey = f"{building}-S{s}"
+                expected_tables[f"{storey}-lod_2"] = [
+                    f"{storey}-R{r}" for r in range(2)
+                ]
+    with open(output_folder / "feature-ids.json") as table_file:
+        feature_tables = json.load(table_file)
+    assert feature_tables == expected_tables
+
+    # The objects keep their node, and only the batched nodes have a mesh
+    nodes = glb_nodes(output_folder / "geometry.glb")
+    assert set(object_nodes({})) <= set(nodes)
+    assert sorted(name for name, mesh in nodes.items() if mesh is not None) == sorted(
+        expected_tables
+    )
+
+    # The triangles of every feature id are the triangles of its object
+    triangles = glb_triangles(output_folder / "geometry.glb")
+    feature_ids = glb_feature_ids(output_folder / "geometry.glb")
+    full_triangles = glb_triangles(full_folder / "geometry.glb")
+    for name, obj_ids in feature_tables.items():
+        lod = name.rsplit("-lod_", 1)[1]
+        assert sorted(np.unique(feature_ids[name])) == list(range(len(obj_ids)))
+        for feature_id, obj_id in enumerate(obj_ids):
+            feature_triangles = triangles[name][feature_ids[name] == feature_id]
+            assert triangle_set(feature_triangles) == triangle_set(
+                full_triangles[f"{obj_id}-lod_{lod}"]
+            )
+
+
+def _surface_distance(
+    triangles: NDArray[np.float64], other_triangles: NDArray[np.float64]
+) -> float:
+    # Largest distance from the vertices of a mesh to the surface of the other, both ways
+    mesh = trimesh.Trimesh(
+        vertices=triangles.reshape(-1, 3),
+        faces=np.arange(triangles.size // 3).reshape(-1, 3),
+    )
+    other = trimesh.Trimesh(
+        vertices=other_triangles.reshape(-1, 3),
+        faces=np.arange(other_triangles.size // 3).reshape(-1, 3),
+    )
+    return max(
+        trimesh.proximity.closest_point(other, mesh.vertices)[1].max(),
+        trimesh.proximity.closest_point(mesh, other.vertices)[1].max(),
+    )
+
+
+def test_far_lod(city, tmp_path: Path) -> None:
+    city_model, _ = city
+    add_relief(city_model)
+    cj_path = write_city(city_model, tmp_path / "city.city.json")
+    far_nodes = ["B0-lod_far", "B1-lod_far", "relief-lod_far"]
+
+    output_folder = run_split_cj(
+        cj_path, tmp_path / "output", "--far-lod", "--far-max-faces", "16"
+    )
+    parents = glb_parents(output_folder / "geometry.glb")
+    assert [name for name in parents if name.endswith("-lod_far")] == far_nodes
+    assert [parents[name] for name in far_nodes] == ["B0", "B1", "relief"]
+    triangles = glb_triangles(output_folder / "geometry.glb")
+    # The simplification respects the number of triangles
+    for name in far_nodes:
+        assert 0 < len(triangles[name]) <= 16
+
+    # The maximum error is respected, with more triangles than asked if needed
+    n_faces = []
+    for max_error in [0.01, 0.3]:
+        output_folder = run_split_cj(
+            cj_path,
+            tmp_path / f"output_{max_error}",
+            "--far-lod",
+            "--far-max-faces",
+            "16",
+            "--far-max-error",
+            str(max_error),
+        )
+        triangles = glb_triangles(output_folder / "geometry.glb")
+        far_triangles = triangles["relief-lod_far"]
+        assert 16 < len(far_triangles) < len(triangles["relief-lod_1"])
+        distance = _surface_distance(far_triangles, triangles["relief-lod_1"])
+        assert distance <= max_error
+        n_faces.append(len(far_triangles))
+    assert n_faces[1] < n_faces[0]
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from data_pipeline.utils import triangulation_cache
+from data_pipeline.utils.geometry_utils import (
+    _triangulate_surface_3d,
+    triangulate_surface_3d,
+)
+
+
+@pytest.fixture
+def cache_path(tmp_path: Path):
+    path = tmp_path / "triangulations.sqlite"
+    triangulation_cache.enable(path=path)
+    yield path
+    triangulation_cache.disable()
+
+
+def _l_shape(shift: float = 0.0) -> np.ndarray:
+    # Concave surface on a tilted plane
+    points_2d = np.array(
+        [[0, 0], [4, 0], [4, 1], [1, 1], [1, 3], [0, 3]], dtype=np.float64
+    )
+    vertices = np.column_stack((points_2d, 0.5 * points_2d[:, 0])) + 10.0
+    return vertices + shift
+
+
+def _check_same_as_fresh(vertices: np.ndarray, expected_hits: int) -> None:
+    cache = triangulation_cache.get_cache()
+    assert cache is not None
+    outer_boundary = np.arange(len(vertices))
+    tri_vertices, tri_faces, valid = triangulate_surface_3d(
+        outer_boundary, [], vertices
+    )
+    fresh_vertices, fresh_faces, fresh_valid = _triangulate_surface_3d(
+        outer_boundary, [], vertices
+    )
+    assert cache.hits == expected_hits
+    np.testing.assert_array_equal(tri_faces, fresh_faces)
+    np.testing.assert_array_equal(tri_vertices, fresh_vertices)
+    assert valid == fresh_valid
+
+
+def test_cache_hit(cache_path: Path) -> None:
+    _check_same_as_fresh(_l_shape(), expected_hits=0)
+    _check_same_as_fresh(_l_shape(), expected_hits=1)
+    # A surface moved by less than 1e-6 may be triangulated differently, so it is not a hit
+    _check_same_as_fresh(_l_shape(4e-7), expected_hits=1)
+    _check_same_as_fresh(_l_shape(4e-7), expected_hits=2)
+    _check_same_as_fresh(_l_shape(-4e-7), expected_hits=2)
+
+    # The triangulations are found again in the file by the next runs
+    triangulation_cache.enable(path=cache_path)
+    _check_same_as_fresh(_l_shape(), expected_hits=1)
+    _check_same_as_fresh(_l_shape(4e-7), expected_hits=2)
@@ -2,7 +2,11 @@ import { CamerasControls } from "./camera";
 import * as THREE from "three";
 import { GLTFLoader } from "three/addons/loaders/GLTFLoader.js";
 import { ObjectPicker } from "./objectPicker";
-import { getCanvasRelativePosition, cj2gltf } from "./utils";
+import {
+    getCanvasRelativePosition,
+    cj2gltf,
+    restoreInstancedNodes,
+} from "./utils";
 import { addBasemap, preloadAllLayers, getTileCacheStats } from "./basemap";
 import { OutlineManager } from "./outlines";
 import { BUILDINGS_COLOR } from "./constants";
@@ -382,6 +386,8 @@ export class Map {
             path,
             (gltf) => {
                 let objs = gltf.scene;
+                // The objects must be found by name, even if they were instanced
+                restoreInstancedNodes(objs);
                 objs.rotateX(-Math.PI / 2);
                 const newMaterial = new THREE.MeshStandardMaterial({
                     color: BUILDINGS_COLOR,
@@ -37,3 +37,54 @@ export function lodVis(scene, lod = 'lod_2') {
 export function cj2gltf(name) {
     return name.replace(/[.:/]/g, '');
 }
+
+/**
+ * Give back their geometry to the nodes whose meshes were drawn with EXT_mesh_gpu_instancing.
+ * The instanced meshes list the names of the nodes of their instances in `userData.instanceNodes`.
+ * Every node is replaced by a mesh with the same name and children, placed like its instance and sharing the geometry of the instanced mesh,
+ * so that the objects can still be found by name, picked, hidden and highlighted separately.
+ * The geometry stays shared on the GPU, but every object is drawn with its own draw call again.
+ */
+export function restoreInstancedNodes(model) {
+    const instancedMeshes = [];
+    model.traverse((child) => {
+        if (child.isInstancedMesh && child.userData.instanceNodes) {
+            instancedMeshes.push(child);
+        }
+    });
+    model.updateMatrixWorld(true);
+
+    const instanceMatrix = new THREE.Matrix4();
+    const parentInverse = new THREE.Matrix4();
+    for (const instancedMesh of instancedMeshes) {
+        instancedMesh.userData.instanceNodes.forEach((nodeName, index) => {
+            const node = model.getObjectByName(
+                THREE.PropertyBinding.sanitizeNodeName(nodeName)
+            );
+            if (!node || !node.parent) return;
+            const parent = node.parent;
+            const mesh = new THREE.Mesh(
+                instancedMesh.geometry,
+                instancedMesh.material
+            );
+            mesh.name = node.name;
+            mesh.userData = node.userData;
+
+            // Same world transformation as the instance, which also dequantizes the positions
+            instancedMesh.getMatrixAt(index, instanceMatrix);
+            instanceMatrix.premultiply(instancedMesh.matrixWorld);
+            instanceMatrix.premultiply(parentInverse.copy(parent.matrixWorld).invert());
+            instanceMatrix.decompose(mesh.position, mesh.quaternion, mesh.scale);
+
+            // Replace the node at the same place among the children of its parent
+            parent.children[parent.children.indexOf(node)] = mesh;
+            mesh.parent = parent;
+            mesh.updateMatrixWorld(true);
+            for (const child of [...node.children]) {
+                mesh.attach(child);
+            }
+            node.parent = null;
+        });
+        instancedMesh.removeFromParent();
+    }
+}